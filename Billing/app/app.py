@@ -1,27 +1,530 @@
 import os
-from flask import Flask, request, jsonify
+import queue
+import threading
+import weakref
+import csv
+import hashlib
+import io
+import json
+import time
+from collections import OrderedDict
+from contextlib import contextmanager
+from flask import Flask, Response, request, jsonify, stream_with_context
+from openpyxl import Workbook
 import mysql.connector
 from mysql.connector import Error
+from mysql.connector.errors import PoolError
 import pandas as pd
 import datetime
 import requests
+from requests.adapters import HTTPAdapter
+
+# Weight service client: one keep-alive connection pool shared by all requests
+WEIGHT_API_URL = os.environ.get("WEIGHT_API_URL", "http://web_weight:5000")
+WEIGHT_API_WORKERS = int(os.environ.get("WEIGHT_API_WORKERS", 8))
+WEIGHT_API_TIMEOUT = float(os.environ.get("WEIGHT_API_TIMEOUT", 10))
+
+def make_weight_http():
+    session = requests.Session()
+    session.mount("http://", HTTPAdapter(pool_connections=1, pool_maxsize=WEIGHT_API_WORKERS))
+    return session
+
+
+weight_http = make_weight_http()
+
+
+class BillCache:
+    """LRU cache of computed bills for periods that already ended.
+
+    Entries are keyed on (provider, from, to) and stored with a version, a digest of
+    the provider's name, trucks, effective rates and the database rates version (see
+    bill_version). Those come from the shared database, so a provider, truck or rates
+    change made through another worker makes this worker's entry stale at its next
+    lookup. Weighings can
+    still change after a period ends (back-dated readings, netos completed later),
+    so entries also expire after `ttl` seconds. Local writes drop their entries at once.
+    """
+
+    def __init__(self, max_size=256, ttl=300):
+        self.max_size = max_size
+        self.ttl = ttl
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.invalidations = 0
+        self.expired = 0
+
+    def get(self, key, version):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and (entry[2] != version or time.monotonic() - entry[3] > self.ttl):
+                del self._entries[key]
+                self.expired += 1
+                entry = None
+            if entry is None:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return entry[0]
+
+    def put(self, key, bill, trucks, version):
+        with self._lock:
+            self._entries[key] = (bill, frozenset(trucks), version, time.monotonic())
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+                self.evictions += 1
+
+    def _drop(self, matches):
+        with self._lock:
+            stale = [key for key, entry in self._entries.items() if matches(key, entry)]
+            for key in stale:
+                del self._entries[key]
+            self.invalidations += len(stale)
+
+    def invalidate_provider(self, provider_id):
+        self._drop(lambda key, entry: key[0] == str(provider_id))
+
+    def invalidate_truck(self, truck_id):
+        self._drop(lambda key, entry: truck_id in entry[1])
+
+    def clear(self):
+        self._drop(lambda key, entry: True)
+
+    def stats(self):
+        with self._lock:
+            return {
+                "size": len(self._entries),
+                "max_size": self.max_size,
+                "ttl": self.ttl,
+                "hits": self.hits,
+                "misses": self.misses,
+                "expired": self.expired,
+                "evictions": self.evictions,
+                "invalidations": self.invalidations,
+            }
+
+
+# Everything a bill reads from the billing database, as one digest
+def bill_version(name, trucks, rates, rates_version):
+    return hashlib.sha1(json.dumps([name, sorted(trucks), sorted(rates.items()), rates_version],
+                                   default=str).encode()).hexdigest()
+
+
+bill_cache = BillCache(max_size=int(os.environ.get("BILL_CACHE_SIZE", 256)),
+                       ttl=float(os.environ.get("BILL_CACHE_TTL", 300)))
+
+RATES_QUERY = "SELECT product_id, rate, scope FROM Rates"
+RATES_UPSERT_QUERY = """
+INSERT INTO Rates (product_id, rate, scope)
+VALUES {} ON DUPLICATE KEY UPDATE rate = VALUES(rate)
+"""
+RATES_BATCH_SIZE = 500
+RATES_COLUMNS = ("Product", "Rate", "Scope")
+
+# The upsert relies on the unique key and the single transaction on InnoDB. Databases
+# created before both were added to billingdb.sql need db/upgrade_rates.sql first.
+RATES_SCHEMA_QUERY = """
+SELECT ENGINE, (SELECT COUNT(*) FROM information_schema.STATISTICS
+                WHERE TABLE_SCHEMA = DATABASE() AND TABLE_NAME = 'Rates' AND INDEX_NAME = 'uq_rates_product_scope'),
+               (SELECT COUNT(*) FROM information_schema.TABLES
+                WHERE TABLE_SCHEMA = DATABASE() AND TABLE_NAME = 'RatesVersion')
+FROM information_schema.TABLES
+WHERE TABLE_SCHEMA = DATABASE() AND TABLE_NAME = 'Rates'
+"""
+_rates_schema_ready = False
+
+
+def check_rates_schema(cursor):
+    """Refuse rate uploads until the Rates table is upgraded, checked once per process"""
+    global _rates_schema_ready
+    if _rates_schema_ready:
+        return
+    cursor.execute(RATES_SCHEMA_QUERY)
+    row = cursor.fetchone()
+    if not row or row[0] != "InnoDB" or not row[1] or not row[2]:
+        raise RuntimeError("Rates table lacks InnoDB, the uq_rates_product_scope key or RatesVersion, "
+                           "apply db/upgrade_rates.sql before uploading rates")
+    _rates_schema_ready = True
+
+# Fixed queries run as server-side prepared statements (see prepared_cursor)
+PROVIDER_EXISTS_QUERY = "SELECT id FROM Provider WHERE id = %s"
+TRUCK_EXISTS_QUERY = "SELECT id FROM Trucks WHERE id = %s"
+INSERT_TRUCK_QUERY = "INSERT INTO Trucks (id, provider_id) VALUES (%s, %s)"
+UPDATE_TRUCK_QUERY = "UPDATE Trucks SET provider_id=%s where id=%s"
+
+# SQL query to get provider name and count trucks
+NAME_AND_COUNT_QUERY = """
+SELECT
+    p.name AS provider_name,
+    COUNT(t.id) AS truck_count
+FROM
+    Provider p
+LEFT JOIN
+    Trucks t ON p.id = t.provider_id
+WHERE
+    p.id = %s
+GROUP BY
+    p.id, p.name
+"""
+
+PROVIDER_TRUCKS_QUERY = """
+SELECT
+    t.id
+FROM
+    Trucks t
+WHERE
+    t.provider_id = %s
+"""
+
+
+# Bumped in the transaction of every rates upload, so each worker can tell with one
+# cheap read whether the rates it holds are still the ones in the database
+RATES_VERSION_QUERY = "SELECT version FROM RatesVersion WHERE id = 1"
+RATES_VERSION_BUMP = "UPDATE RatesVersion SET version = version + 1 WHERE id = 1"
+
+
+def read_rates_version(cursor=None):
+    """Current rates version in the database, None when it cannot be told"""
+    try:
+        if cursor is not None:
+            cursor.execute(RATES_VERSION_QUERY)
+            row = cursor.fetchone()
+        else:
+            with db_connection() as conn:
+                cursor = conn.cursor()
+                cursor.execute(RATES_VERSION_QUERY)
+                row = cursor.fetchone()
+                cursor.close()
+    except Error:
+        # A database without RatesVersion (see db/upgrade_rates.sql)
+        return None
+    return row[0] if row else None
+
+
+class RateIndex:
+    """Effective rate of every product for every provider, held in memory.
+
+    Provider-specific rates override the "All" rates. The maps are rebuilt from the
+    Rates table and swapped in as a whole, so readers never see a half-built index.
+    Every lookup compares the index with the rates version in the database and
+    reloads when another worker uploaded rates since. Without a version to compare
+    (an old database) every lookup reloads.
+    """
+
+    def __init__(self):
+        self._index = None
+        self._lock = threading.Lock()
+        self.version = 0
+        self.loaded_at = None
+        self.reloads = 0
+
+    def load(self, rows, rates_version=None):
+        rows = sorted((str(product_id), rate, str(scope)) for product_id, rate, scope in rows)
+        # The same rates version and table give every worker the same etag
+        etag = hashlib.sha1(repr(rows).encode()).hexdigest()
+        if rates_version is not None:
+            etag = f"{rates_version}-{etag}"
+        defaults = {}
+        by_provider = {}
+        for product_id, rate, scope in rows:
+            if scope.lower() == "all":
+                defaults[product_id] = rate
+            else:
+                by_provider.setdefault(scope, {})[product_id] = rate
+        with self._lock:
+            self._index = (defaults, by_provider, rows, etag, rates_version)
+            self.version += 1
+            self.loaded_at = datetime.datetime.now().strftime('%Y%m%d%H%M%S')
+            self.reloads += 1
+
+    def reload(self):
+        with db_connection() as conn:
+            cursor = conn.cursor()
+            # Version first: an upload landing in between only costs one more reload
+            rates_version = read_rates_version(cursor)
+            cursor.execute(RATES_QUERY)
+            rows = cursor.fetchall()
+            cursor.close()
+        self.load(rows, rates_version)
+
+    def invalidate(self):
+        with self._lock:
+            self._index = None
+
+    @property
+    def rates_version(self):
+        """Database rates version of the loaded index"""
+        index = self._index
+        return index[4] if index else None
+
+    def _current(self, check=True):
+        index = self._index
+        if index is None or (check and (index[4] is None or read_rates_version() != index[4])):
+            self.reload()
+            index = self._index
+        return index
+
+    def refresh(self):
+        """Reload now if the database holds other rates, for a run of unchecked lookups"""
+        self._current()
+
+    def rates_for(self, provider_id, check=True):
+        defaults, by_provider = self._current(check)[:2]
+        return {**defaults, **by_provider.get(str(provider_id), {})}
+
+    # All (product_id, rate, scope) rows sorted by product, and their etag, reloaded
+    # first when the database rates version moved on
+    def snapshot(self):
+        return self._current()[2:4]
+
+    def stats(self):
+        index = self._index
+        return {
+            "version": self.version,
+            "rates_version": index[4] if index else None,
+            "etag": index[3] if index else None,
+            "loaded_at": self.loaded_at,
+            "reloads": self.reloads,
+            "providers": len(index[1]) if index else 0,
+            "default_products": len(index[0]) if index else 0,
+        }
+
+
+rate_index = RateIndex()
+
+
+# Database connection pool. Connections run in autocommit mode so a returned connection
+# never carries an open transaction (or a stale InnoDB snapshot) to its next borrower;
+# code that needs a transaction starts one explicitly.
+DB_POOL_SIZE = int(os.environ.get("DB_POOL_SIZE", 8))
+DB_POOL_TIMEOUT = float(os.environ.get("DB_POOL_TIMEOUT", 5))
+
+_pool = None
+_pool_lock = threading.Lock()
+
+
+class DbStats:
+    """Borrow and hold latency of pooled connections, and prepared statement reuse."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.borrows = 0
+        self.waits = 0
+        self.timeouts = 0
+        self.borrow_ms_total = 0.0
+        self.borrow_ms_max = 0.0
+        self.returns = 0
+        self.held_ms_total = 0.0
+        self.held_ms_max = 0.0
+        self.statements_prepared = 0
+        self.statements_reused = 0
+
+    def borrowed(self, elapsed, waited):
+        with self._lock:
+            self.borrows += 1
+            self.waits += waited
+            self.borrow_ms_total += elapsed * 1000
+            self.borrow_ms_max = max(self.borrow_ms_max, elapsed * 1000)
+
+    def timed_out(self):
+        with self._lock:
+            self.timeouts += 1
+
+    def returned(self, held):
+        with self._lock:
+            self.returns += 1
+            self.held_ms_total += held * 1000
+            self.held_ms_max = max(self.held_ms_max, held * 1000)
+
+    def statement(self, reused):
+        with self._lock:
+            if reused:
+                self.statements_reused += 1
+            else:
+                self.statements_prepared += 1
+
+    def stats(self):
+        with self._lock:
+            return {
+                "pool_size": DB_POOL_SIZE,
+                "borrows": self.borrows,
+                "waits": self.waits,
+                "timeouts": self.timeouts,
+                "borrow_ms_avg": round(self.borrow_ms_total / self.borrows, 3) if self.borrows else 0,
+                "borrow_ms_max": round(self.borrow_ms_max, 3),
+                "held_ms_avg": round(self.held_ms_total / self.returns, 3) if self.returns else 0,
+                "held_ms_max": round(self.held_ms_max, 3),
+                "statements_prepared": self.statements_prepared,
+                "statements_reused": self.statements_reused,
+            }
+
+
+db_stats = DbStats()
+
+
+class PooledConnection:
+    """A borrowed connection, close() hands it back to its pool instead of closing it.
+
+    Everything else goes to the underlying `connection`.
+    """
+
+    def __init__(self, pool, connection):
+        self.pool = pool
+        self.connection = connection
+
+    def __getattr__(self, name):
+        return getattr(self.connection, name)
+
+    def close(self):
+        self.pool.release(self.connection)
+
+
+class ConnectionPool:
+    """`size` connections to billdb, each opened on its first borrow.
+
+    Idle connections wait in a queue; a borrower blocks on it for up to `timeout`
+    seconds when all of them are out, and is woken as soon as one comes back.
+    """
+
+    def __init__(self, size, connect):
+        self.size = size
+        self._connect = connect
+        self._idle = queue.LifoQueue()
+        for _ in range(size):
+            # A free slot that has no connection yet
+            self._idle.put(None)
+
+    def acquire(self, timeout):
+        """Borrow a connection, returns it and whether the borrower had to wait"""
+        waited = False
+        try:
+            connection = self._idle.get_nowait()
+        except queue.Empty:
+            waited = True
+            try:
+                connection = self._idle.get(timeout=timeout)
+            except queue.Empty:
+                raise PoolError(f"No database connection available after {timeout}s")
+        try:
+            if connection is None:
+                connection = self._connect()
+            elif not connection.is_connected():
+                connection.reconnect()
+        except Exception:
+            self._idle.put(None)
+            raise
+        return PooledConnection(self, connection), waited
+
+    def release(self, connection):
+        try:
+            # Never hand an open transaction to the next borrower
+            if connection.in_transaction:
+                connection.rollback()
+        except Error:
+            # Reconnected on its next borrow
+            pass
+        self._idle.put(connection)
+
+
+def connect_db():
+    return mysql.connector.connect(
+        host=os.environ["DB_HOST"],
+        user="root",
+        password="secret",
+        database="billdb",
+        connection_timeout=5,
+        autocommit=True,
+    )
+
+
+def get_pool():
+    global _pool
+    if _pool is None:
+        with _pool_lock:
+            if _pool is None:
+                _pool = ConnectionPool(DB_POOL_SIZE, connect_db)
+    return _pool
 
 
 def get_db_connection():
-    """Create a connection to the MySQL database"""
-    # Try to connect multiple times (useful when starting up)
-
+    """Borrow a connection from the pool, conn.close() gives it back"""
+    # Wait up to DB_POOL_TIMEOUT for a connection when the pool is exhausted
+    started = time.monotonic()
     try:
-        conn = mysql.connector.connect(
-            host=os.environ["DB_HOST"],
-            user="root",
-            password="secret",
-            database="billdb",
-            connection_timeout=5
-        )
-        return conn
+        conn, waited = get_pool().acquire(DB_POOL_TIMEOUT)
+    except PoolError as e:
+        db_stats.timed_out()
+        raise Exception(f"Could not connect to MySQL database: {e}")
     except Error as e:
         raise Exception(f"Could not connect to MySQL database: {e}")
+    db_stats.borrowed(time.monotonic() - started, waited)
+    return conn
+
+
+@contextmanager
+def db_connection():
+    """Borrow a pooled connection for the duration of a with block, returned even on errors"""
+    conn = get_db_connection()
+    borrowed = time.monotonic()
+    completed = False
+    try:
+        yield conn
+        completed = True
+    finally:
+        # A failed block or statement can leave unread results behind, prepare afresh next time
+        if not completed or conn.unread_result:
+            forget_statements(conn)
+        conn.close()
+        db_stats.returned(time.monotonic() - borrowed)
+
+
+# Prepared cursors per physical connection, kept across borrows: {connection: (connection id, {key: cursor})}
+_statements = weakref.WeakKeyDictionary()
+
+
+def prepared_cursor(conn, query, dictionary=False):
+    """Cursor holding `query` as a server-side prepared statement on this connection.
+
+    The statement is prepared on first use and reused by later borrowers of the same
+    pooled connection, until the connection reconnects.
+    """
+    connection = conn.connection
+    cached = _statements.get(connection)
+    if cached is None or cached[0] != connection.connection_id:
+        cached = (connection.connection_id, {})
+        _statements[connection] = cached
+    key = (query, dictionary)
+    cursor = cached[1].get(key)
+    db_stats.statement(reused=cursor is not None)
+    if cursor is None:
+        cursor = conn.cursor(prepared=True, dictionary=dictionary)
+        cached[1][key] = cursor
+    return cursor
+
+
+# Per-process state for a freshly forked worker (gunicorn post_fork with preload_app):
+# sockets inherited from the parent are dropped, not closed, so the parent keeps its own
+def reset_after_fork():
+    global _pool, _statements, weight_http
+    _pool = None
+    _statements = weakref.WeakKeyDictionary()
+    weight_http = make_weight_http()
+    bill_cache.clear()
+    rate_index.invalidate()
+
+
+def forget_statements(conn):
+    cached = _statements.pop(conn.connection, None)
+    if cached:
+        for cursor in cached[1].values():
+            try:
+                cursor.close()
+            except Error:
+                pass
 
 
 app = Flask(__name__)
@@ -31,15 +534,14 @@ app = Flask(__name__)
 def health():
     # Connect to database
     try:
-        conn = get_db_connection()
-        cursor = conn.cursor()
+        with db_connection() as conn:
+            cursor = conn.cursor()
 
-        # Execute "SELECT 1" on the mysqlDB
-        cursor.execute("SELECT 1")
+            # Execute "SELECT 1" on the mysqlDB
+            cursor.execute("SELECT 1")
 
-        cursor.fetchall()
-        cursor.close()
-        conn.close()
+            cursor.fetchall()
+            cursor.close()
 
         return "OK", 200
     # Error handling for connectivity is done in get_db_connection.
@@ -47,6 +549,16 @@ def health():
         return "Failure", 500
 
 
+# GET /stats - Cache counters for monitoring
+@app.route('/stats', methods=["GET"])
+def stats():
+    return jsonify({
+        "bill_cache": bill_cache.stats(),
+        "rate_index": rate_index.stats(),
+        "db": db_stats.stats(),
+    }), 200
+
+
 
 @app.route('/provider', methods=['POST'])
 def add_provider():
@@ -57,26 +569,24 @@ def add_provider():
             return jsonify({'error': 'Name is required'}), 400
 
         # Get database connection
-        conn = get_db_connection()
-        cursor = conn.cursor()
+        with db_connection() as conn:
+            cursor = conn.cursor()
 
-        check_query = "SELECT id FROM Provider WHERE name = %s"
-        cursor.execute(check_query, (data['name'],))
-        existing = cursor.fetchone()
+            check_query = "SELECT id FROM Provider WHERE name = %s"
+            cursor.execute(check_query, (data['name'],))
+            existing = cursor.fetchone()
 
-        if existing:
-            cursor.close()
-            conn.close()
-            return jsonify({'error': 'Provider with this name already exists'}), 409
+            if existing:
+                cursor.close()
+                return jsonify({'error': 'Provider with this name already exists'}), 409
 
-        insert_query = "INSERT INTO Provider (name) VALUES (%s)"
-        cursor.execute(insert_query, (data['name'],))
+            insert_query = "INSERT INTO Provider (name) VALUES (%s)"
+            cursor.execute(insert_query, (data['name'],))
 
-        provider_id = cursor.lastrowid
+            provider_id = cursor.lastrowid
 
-        conn.commit()
-        cursor.close()
-        conn.close()
+            conn.commit()
+            cursor.close()
 
         return jsonify({'id': str(provider_id)}), 201
 
@@ -93,36 +603,34 @@ def update_provider(id):
             return jsonify({'error': 'Name is required'}), 400
 
         # Get database connection
-        conn = get_db_connection()
-        cursor = conn.cursor()
+        with db_connection() as conn:
+            cursor = conn.cursor()
 
-        # Check if provider exists
-        check_query = "SELECT id FROM Provider WHERE id = %s"
-        cursor.execute(check_query, (id,))
-        existing = cursor.fetchone()
+            # Check if provider exists
+            check_query = "SELECT id FROM Provider WHERE id = %s"
+            cursor.execute(check_query, (id,))
+            existing = cursor.fetchone()
 
-        if not existing:
-            cursor.close()
-            conn.close()
-            return jsonify({'error': 'Provider not found'}), 404
+            if not existing:
+                cursor.close()
+                return jsonify({'error': 'Provider not found'}), 404
 
-        # Check if the new name already exists with a different ID
-        check_name_query = "SELECT id FROM Provider WHERE name = %s AND id != %s"
-        cursor.execute(check_name_query, (data['name'], id))
-        name_exists = cursor.fetchone()
+            # Check if the new name already exists with a different ID
+            check_name_query = "SELECT id FROM Provider WHERE name = %s AND id != %s"
+            cursor.execute(check_name_query, (data['name'], id))
+            name_exists = cursor.fetchone()
 
-        if name_exists:
-            cursor.close()
-            conn.close()
-            return jsonify({'error': 'Another provider with this name already exists'}), 409
+            if name_exists:
+                cursor.close()
+                return jsonify({'error': 'Another provider with this name already exists'}), 409
 
-        # Update the provider
-        update_query = "UPDATE Provider SET name = %s WHERE id = %s"
-        cursor.execute(update_query, (data['name'], id))
+            # Update the provider
+            update_query = "UPDATE Provider SET name = %s WHERE id = %s"
+            cursor.execute(update_query, (data['name'], id))
 
-        conn.commit()
-        cursor.close()
-        conn.close()
+            conn.commit()
+            bill_cache.invalidate_provider(id)
+            cursor.close()
 
         return jsonify({'id': str(id), 'name': data['name']}), 200
     except Exception as e:
@@ -142,50 +650,112 @@ def add_rate():
             raise FileNotFoundError (f"Error: The file '{filepath}' does not exist")
 
         # Read data from excel file in /in dir
-        data_frame = pd.read_excel(f"in/{filename}.xlsx", engine = "openpyxl")
-        file_data = data_frame.to_records(index=False).tolist()
+        data_frame = pd.read_excel(filepath, engine = "openpyxl")
+        incoming = normalize_rates(data_frame)
 
         # DB connection
-        conn = get_db_connection() 
-        cursor = conn.cursor(buffered=True)
-
-        for rate in file_data:
-            # Create dictionary out of data
-            row_dict = dict(zip(data_frame.columns, rate))
-
-            # If provider id is specified, check if provider exists
-            if(row_dict["Scope"] != "All"):
-                cursor.execute("SELECT * FROM Provider WHERE id=%s", (row_dict["Scope"],))
-                existing_provider = cursor.fetchone()
-                if not existing_provider:
-                    raise LookupError(f"Provider with ID {row_dict["Scope"]} does not exist")
-
-            # Check if product for specified scope already exists
-            cursor.execute("SELECT * FROM Rates WHERE product_id=%s AND scope=%s", (row_dict["Product"], row_dict["Scope"]))
-            existing_product = cursor.fetchone()
-
-
-            status = None
-            # Update existing product
-            if existing_product:
-                cursor.execute("UPDATE Rates SET rate=%s, scope=%s WHERE product_id=%s",(row_dict["Rate"], row_dict["Scope"], row_dict["Product"]))
-                status = 200
-            # Create new product
-            else :
-                cursor.execute("INSERT INTO Rates (product_id, rate, scope) VALUES (%s, %s, %s)", (row_dict["Product"],row_dict["Rate"], row_dict["Scope"]))
-                status = 201
-                
-        conn.commit()
-        cursor.close()
-        conn.close()
+        with db_connection() as conn:
+            cursor = conn.cursor(buffered=True)
+            try:
+                check_rates_schema(cursor)
+
+                # Validate every provider scope in the file with a single query
+                scopes = sorted(set(incoming.loc[incoming["scope"] != "All", "scope"]))
+                if scopes:
+                    cursor.execute(
+                        f"SELECT id FROM Provider WHERE id IN ({','.join(['%s'] * len(scopes))})", scopes)
+                    known = {str(row[0]) for row in cursor.fetchall()}
+                    missing = [scope for scope in scopes if scope not in known]
+                    if missing:
+                        raise LookupError(f"Provider with ID {', '.join(missing)} does not exist")
+
+                # Diff against the current rates in memory
+                cursor.execute(RATES_QUERY)
+                current = pd.DataFrame(cursor.fetchall(), columns=["product_id", "current_rate", "scope"])
+                current["scope"] = current["scope"].astype(str)
+                current.loc[current["scope"].str.lower() == "all", "scope"] = "All"
+                diff = incoming.merge(current, on=["product_id", "scope"], how="left", indicator=True)
+                new_rows = diff["_merge"] == "left_only"
+                changed_rows = ~new_rows & (diff["rate"] != diff["current_rate"])
+                changes = diff.loc[new_rows | changed_rows, ["product_id", "rate", "scope"]]
+
+                # Apply all changes as batched upserts in one transaction
+                rows = [(product, int(rate), scope) for product, rate, scope in changes.itertuples(index=False)]
+                if rows:
+                    conn.start_transaction()
+                for i in range(0, len(rows), RATES_BATCH_SIZE):
+                    batch = rows[i:i + RATES_BATCH_SIZE]
+                    cursor.execute(
+                        RATES_UPSERT_QUERY.format(",".join(["(%s, %s, %s)"] * len(batch))),
+                        [value for row in batch for value in row])
+                if rows:
+                    # Tells every worker's rate index to reload
+                    cursor.execute(RATES_VERSION_BUMP)
+                conn.commit()
+            except Exception:
+                conn.rollback()
+                raise
+            finally:
+                cursor.close()
+
+        if len(changes):
+            try:
+                rate_index.reload()
+            except Exception:
+                # The upload is committed, let the next bill reload the index instead
+                rate_index.invalidate()
+
+        # Rates scoped to "All" can change every provider's bill
+        changed_scopes = set(changes["scope"])
+        if "All" in changed_scopes:
+            bill_cache.clear()
+        else:
+            for scope in changed_scopes:
+                bill_cache.invalidate_provider(scope)
+
+        inserted = int(new_rows.sum())
+        result = dict(data, inserted=inserted, updated=int(changed_rows.sum()),
+                      unchanged=len(diff) - len(changes))
 
     except LookupError as e :
         return jsonify({'error': str(e)}), 404  # Return 404 if provider is not found
     except FileNotFoundError as e:
         return jsonify({'error': str(e)}), 404  # Return 404 if file is not found
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400  # Return 400 if the file content is invalid
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
+    return jsonify(result), 201 if inserted else 200
+
+
+# POST /rates/reload rebuilds the in-memory rate index from the Rates table
+@app.route("/rates/reload", methods=["POST"])
+def reload_rates():
+    try:
+        rate_index.reload()
     except Exception as e:
         return jsonify({'error': str(e)}), 500
-    return data, status
+    bill_cache.clear()
+    return jsonify(rate_index.stats()), 200
+
+
+# Turns an uploaded rates sheet into unique (product_id, rate, scope) rows, the last row wins
+def normalize_rates(data_frame):
+    missing = [column for column in RATES_COLUMNS if column not in data_frame.columns]
+    if missing:
+        raise ValueError(f"Rates file is missing column(s): {', '.join(missing)}")
+
+    rates = pd.DataFrame({
+        "product_id": data_frame["Product"].astype(str).str.strip(),
+        "rate": pd.to_numeric(data_frame["Rate"], errors="coerce"),
+        "scope": data_frame["Scope"].astype(str).str.strip(),
+    })
+    if rates["rate"].isna().any():
+        raise ValueError(f"Invalid rate for product(s): {', '.join(rates.loc[rates['rate'].isna(), 'product_id'])}")
+    # Rates is an integer column, round here so the diff matches what the database stores
+    rates["rate"] = rates["rate"].round().astype(int)
+    rates.loc[rates["scope"].str.lower() == "all", "scope"] = "All"
+    return rates.drop_duplicates(["product_id", "scope"], keep="last")
 
     
 # POST /truck registers a truck in the system, provider - known provider id, 
@@ -199,30 +769,24 @@ def register_truck():
     if not truck_id or not provider_id:
         return jsonify({"error": "Both 'id' and 'provider' fields are required"}), 400
     
-    conn = get_db_connection()
-    cursor = conn.cursor()
-    
-    # Check if provider exists
-    cursor.execute("SELECT id FROM Provider WHERE id = %s", (provider_id,))
-    provider = cursor.fetchone()
-    
-    if not provider:
-        cursor.close()
-        conn.close()
-        return jsonify({"error": "Provider not found"}), 404
-    
-    try:
-        # Insert truck record
-        cursor.execute("INSERT INTO Trucks (id, provider_id) VALUES (%s, %s)", (truck_id, provider_id))
-        conn.commit()
-    except mysql.connector.IntegrityError:
-        cursor.close()
-        conn.close()
-        return jsonify({"error": "Truck ID already exists"}), 409
-    
-    cursor.close()
-    conn.close()
-    
+    with db_connection() as conn:
+        # Check if provider exists
+        cursor = prepared_cursor(conn, PROVIDER_EXISTS_QUERY)
+        cursor.execute(PROVIDER_EXISTS_QUERY, (provider_id,))
+        provider = cursor.fetchone()
+
+        if not provider:
+            return jsonify({"error": "Provider not found"}), 404
+
+        try:
+            # Insert truck record
+            cursor = prepared_cursor(conn, INSERT_TRUCK_QUERY)
+            cursor.execute(INSERT_TRUCK_QUERY, (truck_id, provider_id))
+            conn.commit()
+            bill_cache.invalidate_provider(provider_id)
+        except mysql.connector.IntegrityError:
+            return jsonify({"error": "Truck ID already exists"}), 409
+
     return jsonify({"message": "Truck registered successfully"}), 201
 
     
@@ -259,68 +823,91 @@ def update_truck(id):
         #return jsonify({"error": 'provider' field is required"}), 400"
         return jsonify({'error': 'provider is required'}), 400
     
-    conn = get_db_connection()
-    cursor = conn.cursor()
-    
-    # Check if provider exists in Provider table
-    cursor.execute("SELECT id FROM Provider WHERE id = %s", (provider_id,))
-    provider = cursor.fetchone()
-    
-    if not provider:
-        cursor.close()
-        conn.close()
-        return jsonify({"error": "Provider not found in Trucks"}), 404
+    with db_connection() as conn:
+        # Check if provider exists in Provider table
+        cursor = prepared_cursor(conn, PROVIDER_EXISTS_QUERY)
+        cursor.execute(PROVIDER_EXISTS_QUERY, (provider_id,))
+        provider = cursor.fetchone()
+
+        if not provider:
+            return jsonify({"error": "Provider not found in Trucks"}), 404
+
+        # Check if truck exists in Trucks table
+        cursor = prepared_cursor(conn, TRUCK_EXISTS_QUERY)
+        cursor.execute(TRUCK_EXISTS_QUERY, (truck_id,))
+        truck = cursor.fetchone()
+
+        if not truck:
+            return jsonify({"error": "Truck not found in Trucks"}), 404
+
+        try:
+            # Change provider in Truck table
+            cursor = prepared_cursor(conn, UPDATE_TRUCK_QUERY)
+            cursor.execute(UPDATE_TRUCK_QUERY, (provider_id, truck_id,))
+            conn.commit()
+            # Both the previous provider's bills (through the truck) and the new provider's are stale
+            bill_cache.invalidate_truck(truck_id)
+            bill_cache.invalidate_provider(provider_id)
+        except Exception as e:
+            return jsonify({'error': str(e)}), 500
 
-    # Check if truck exists in Trucks table
-    cursor.execute("SELECT id FROM Trucks WHERE id = %s", (truck_id,))
-    truck = cursor.fetchone()
-    
-    if not truck:
-        cursor.close()
-        conn.close()
-        return jsonify({"error": "Truck not found in Trucks"}), 404
-    
-    try:
-        # Change provider in Truck table
-        cursor.execute("UPDATE Trucks SET provider_id=%s where id=%s", (provider_id, truck_id,))
-        conn.commit()
-    except Exception as e:
-        cursor.close()
-        conn.close()        
-        return jsonify({'error': str(e)}), 500
-    
-    # Closing the valid conncetion  
-    cursor.close()
-    conn.close()
-    
     return jsonify({"message": "Truck provider changed successfully"}), 201
 
 
+# GET /rates downloads the current rates in the same Product/Rate/Scope layout that
+# POST /rates accepts, as xlsx (default) or csv (?format=csv)
 @app.route('/rates', methods=["GET"])
 def rates_download():
+    file_format = request.args.get("format", "xlsx").lower()
+    if file_format not in ("xlsx", "csv"):
+        return jsonify({"error": "format must be xlsx or csv"}), 400
+
     try:
-        conn = get_db_connection()
-        cursor = conn.cursor(dictionary=True)
-        
-        query = "SELECT product_id, rate, scope FROM Rates"
-        cursor.execute(query)
-        rates = cursor.fetchall()
-        
-        cursor.close()
-        conn.close()
-        
-        if not rates:
-            return jsonify({"error": "No rates available for download"}), 404
-        
-        df = pd.DataFrame(rates)
-        excel_path = "../in/rates.xlsx"
-        df.to_excel(excel_path, index=False)
-        
-        # Return a success response
-        return jsonify({"message": "Rates successfully downloaded to Excel", "file_path": excel_path}), 200
+        rows, etag = rate_index.snapshot()
     except Exception as e:
         return jsonify({"error": f"Error downloading rates: {str(e)}"}), 500
-    
+
+    if not rows:
+        return jsonify({"error": "No rates available for download"}), 404
+
+    etag = f"{etag}-{file_format}"
+    if request.if_none_match.contains(etag):
+        response = Response(status=304)
+    elif file_format == "csv":
+        response = Response(stream_with_context(rates_csv(rows)), mimetype="text/csv")
+    else:
+        response = Response(rates_xlsx(rows),
+                            mimetype="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet")
+    response.set_etag(etag)
+    response.headers["Cache-Control"] = "no-cache"
+    if response.status_code == 200:
+        response.headers["Content-Disposition"] = f"attachment; filename=rates.{file_format}"
+    return response
+
+
+def rates_csv(rows):
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    writer.writerow(RATES_COLUMNS)
+    for i in range(0, len(rows), RATES_BATCH_SIZE):
+        writer.writerows(rows[i:i + RATES_BATCH_SIZE])
+        yield buffer.getvalue()
+        buffer.seek(0)
+        buffer.truncate()
+
+
+def rates_xlsx(rows):
+    # Write-only mode streams rows into the zip instead of building a cell grid in memory
+    workbook = Workbook(write_only=True)
+    sheet = workbook.create_sheet("Rates")
+    sheet.append(RATES_COLUMNS)
+    for row in rows:
+        sheet.append(row)
+    output = io.BytesIO()
+    workbook.save(output)
+    return output.getvalue()
+
+
 @app.route('/bill/<id>', methods=['GET'])
 def get_bill(id):
     if not id.strip():
@@ -335,30 +922,43 @@ def get_bill(id):
 
     if not success:
         return jsonify({"error": result_or_error}), 404 if "not found" in result_or_error else 500
-    
-    sessionCount, sessionListPerTruck = get_session_list_per_truck(truckList,t1,t2)
-
-    if isinstance(sessionListPerTruck, str):
-        return jsonify({"error": sessionListPerTruck})
 
-    product_stats = process_session_data(sessionListPerTruck,t1,t2)   
+    # A period that already ended produces the same bill until its inputs change
+    closed_period = t2 < datetime.datetime.now().strftime('%Y%m%d%H%M%S')
+    cache_key = (id, t1, t2)
+    version = bill_version(name, [truck['id'] for truck in truckList],
+                           {rate['product_id']: rate['rate'] for rate in ratesList}, rate_index.rates_version)
+    if closed_period:
+        cached = bill_cache.get(cache_key, version)
+        if cached is not None:
+            return jsonify(cached), 201
+    
+    sessionCount, product_stats = get_produce_summary(truckList, t1, t2)
 
     if isinstance(product_stats, str):
         return jsonify({"error": product_stats})
-    
+
+    data = make_bill(id, name, t1, t2, truckCount, sessionCount, product_stats, ratesList)
+
+    if closed_period:
+        bill_cache.put(cache_key, data, [truck['id'] for truck in truckList], version)
+
+    return jsonify(data), 201
+
+def make_bill(id, name, t1, t2, truckCount, sessionCount, product_stats, ratesList):
     products = []
     for product_data in ratesList:
         product_id = product_data['product_id']
         rate = product_data['rate']
-        
-        if product_id in product_stats: 
+
+        if product_id in product_stats:
             amount = product_stats[product_id]["amount"]
             count = product_stats[product_id]["count"]
             products.append(create_product(product_id, count, amount, rate))
 
     total_payment = sum(product["pay"] for product in products)
 
-    data = {
+    return {
         "id": id,
         "name": name,
         "from": t1,
@@ -369,54 +969,149 @@ def get_bill(id):
         "total": total_payment
     }
 
-    return jsonify(data), 201
 
-def process_session_data(sessionListPerTruck,t1,t2):
-    product_stats = {}
-    for truck, sessions in sessionListPerTruck.items():
-        for session_id in sessions:
+# GET /bills?from=t1&to=t2&providers=10001,10002
+# Bills every provider (or the listed ones) for one period as NDJSON, one bill per line.
+# Uses one Provider/Trucks query, the rate index and a single Weight call for all trucks;
+# bills already in the cache are sent first.
+@app.route('/bills', methods=['GET'])
+def get_bills():
+    t1, t2, error = validate_time(request.args.get('from'), request.args.get('to'))
+    if error:
+        return jsonify({"error": error[0]}), error[1]
+
+    provider_ids = [p.strip() for p in request.args.get('providers', '').split(',') if p.strip()]
+    try:
+        providers = get_providers_with_trucks(provider_ids)
+        # One rates version check for the whole run, the lookups below trust it
+        rate_index.refresh()
+    except Exception as e:
+        return jsonify({"error": str(e)}), 500
+
+    missing = [p for p in provider_ids if p not in providers]
+    if missing:
+        return jsonify({"error": f"Provider(s) not found: {', '.join(missing)}"}), 404
+
+    closed_period = t2 < datetime.datetime.now().strftime('%Y%m%d%H%M%S')
+
+    def generate():
+        pending = {}
+        for provider_id, provider in providers.items():
+            cached = None
             try:
-                api = f"http://web_weight:5000/session/{session_id}?from={t1}&to={t2}"
-                response = requests.get(api)
-                session_data = response.json()
-
-                if "truckTara" in session_data:
-                    neto = session_data.get("neto")
-                    product = session_data.get("produce")
-                else:
-                    continue
-                if neto != "na":
-                    if product not in product_stats:
-                        product_stats[product] = {"count": 0, "amount": 0}
-
-                    product_stats[product]["count"] += 1
-                    product_stats[product]["amount"] += int(neto)
-
-            except requests.exceptions.RequestException as e:
-                return f"Error fetching data for truck {session_id}: {e}"
+                provider["rates"] = rate_index.rates_for(provider_id, check=False)
+                provider["version"] = bill_version(provider["name"], provider["trucks"], provider["rates"],
+                                                   rate_index.rates_version)
+                if closed_period:
+                    cached = bill_cache.get((provider_id, t1, t2), provider["version"])
             except Exception as e:
-                return f"Error processing truck {session_id}: {e}"
-            
-    return product_stats
+                yield json.dumps({"id": provider_id, "error": str(e)}) + "\n"
+                continue
+            if cached is not None:
+                yield json.dumps(cached) + "\n"
+            else:
+                pending[provider_id] = provider
 
-def get_session_list_per_truck(truckList,t1,t2):
-    truck_sessions_dict = {}
-    for truck in truckList:
-        truck_id = truck['id']
-        try:
-            api = f"http://web_weight:5000/item/{truck_id}?from={t1}&to={t2}"
-            response = requests.get(api)
-            truck_data = response.json()
-            truck_sessions_dict[truck_id] = truck_data.get('sessions', [])
+        if not pending:
+            return
 
-        except requests.exceptions.RequestException as e:
-            return None, f"Error fetching data for truck {truck}: {e}"
+        trucks = [truck for provider in pending.values() for truck in provider["trucks"]]
+        try:
+            by_truck = get_produce_totals_by_truck(trucks, t1, t2)
         except Exception as e:
-            return None, f"Error processing truck {truck}: {e}"
-        
-    total_sessions = sum(len(sessions) for sessions in truck_sessions_dict.values())
-    
-    return total_sessions, truck_sessions_dict
+            for provider_id in pending:
+                yield json.dumps({"id": provider_id, "error": f"Error fetching data for trucks: {e}"}) + "\n"
+            return
+
+        for provider_id, provider in pending.items():
+            try:
+                sessionCount, product_stats = combine_truck_totals(by_truck, provider["trucks"])
+                rates = provider["rates"]
+                ratesList = [{"product_id": product_id, "rate": rates[product_id]} for product_id in sorted(rates)]
+                bill = make_bill(provider_id, provider["name"], t1, t2, len(provider["trucks"]),
+                                 sessionCount, product_stats, ratesList)
+            except Exception as e:
+                yield json.dumps({"id": provider_id, "error": str(e)}) + "\n"
+                continue
+            if closed_period:
+                bill_cache.put((provider_id, t1, t2), bill, provider["trucks"], provider["version"])
+            yield json.dumps(bill) + "\n"
+
+    return Response(stream_with_context(generate()), mimetype="application/x-ndjson")
+
+
+# {provider id: {"name": ..., "trucks": [...]}} in one query, for all providers or the given ids
+def get_providers_with_trucks(provider_ids=None):
+    query = "SELECT p.id, p.name, t.id AS truck FROM Provider p LEFT JOIN Trucks t ON t.provider_id = p.id"
+    if provider_ids:
+        query += f" WHERE p.id IN ({','.join(['%s'] * len(provider_ids))})"
+    query += " ORDER BY p.id"
+
+    with db_connection() as conn:
+        cursor = conn.cursor(dictionary=True)
+        cursor.execute(query, provider_ids or ())
+        rows = cursor.fetchall()
+        cursor.close()
+
+    providers = {}
+    for row in rows:
+        provider = providers.setdefault(str(row["id"]), {"name": row["name"], "trucks": []})
+        if row["truck"] is not None:
+            provider["trucks"].append(row["truck"])
+    return providers
+
+
+def get_produce_totals_by_truck(trucks, t1, t2):
+    if not trucks:
+        return {}
+    return weight_post("/produce-totals", {"trucks": trucks, "from": t1, "to": t2, "group_by": "truck"})["trucks"]
+
+
+# Adds up the per-truck totals of one provider into get_produce_summary's shape
+def combine_truck_totals(by_truck, trucks):
+    sessionCount = 0
+    product_stats = {}
+    for truck in trucks:
+        summary = by_truck.get(truck)
+        if not summary:
+            continue
+        sessionCount += summary["sessionCount"]
+        for product in summary["products"]:
+            # Only sessions with a known neto are billed
+            if product["count"]:
+                stats = product_stats.setdefault(product["produce"], {"count": 0, "amount": 0})
+                stats["count"] += product["count"]
+                stats["amount"] += int(product["amount"])
+    return sessionCount, product_stats
+
+
+def weight_post(path, payload):
+    response = weight_http.post(f"{WEIGHT_API_URL}{path}", json=payload, timeout=WEIGHT_API_TIMEOUT)
+    response.raise_for_status()
+    return response.json()
+
+
+# Asks the Weight service for per-produce totals of all the trucks in one call,
+# returns (sessionCount, {product: {"count", "amount"}}) or (None, error message)
+def get_produce_summary(truckList, t1, t2):
+    truck_ids = [truck['id'] for truck in truckList]
+    if not truck_ids:
+        return 0, {}
+
+    try:
+        summary = weight_post("/produce-totals", {"trucks": truck_ids, "from": t1, "to": t2})
+    except requests.exceptions.RequestException as e:
+        return None, f"Error fetching data for trucks: {e}"
+
+    try:
+        product_stats = {}
+        for product in summary.get("products", []):
+            # Only sessions with a known neto are billed
+            if product["count"]:
+                product_stats[product["produce"]] = {"count": product["count"], "amount": int(product["amount"])}
+        return summary.get("sessionCount", 0), product_stats
+    except Exception as e:
+        return None, f"Error processing produce totals: {e}"
 
 def validate_time(t1, t2):
     if t1 is None:
@@ -443,56 +1138,19 @@ def validate_time(t1, t2):
 
 def get_billdb_data(id):
     try:
-        conn = get_db_connection()
-        cursor = conn.cursor(dictionary=True)
-
-        # SQL query to get provider name and count trucks
-        name_and_count_query = """
-        SELECT 
-            p.name AS provider_name,
-            COUNT(t.id) AS truck_count
-        FROM 
-            Provider p
-        LEFT JOIN 
-            Trucks t ON p.id = t.provider_id
-        WHERE 
-            p.id = %s
-        GROUP BY 
-            p.id, p.name
-        """
-
-        trucks_query = """
-        SELECT
-            t.id
-        FROM
-            Trucks t
-        WHERE
-            t.provider_id = %s
-        """
-
-        rates_query = """
-        SELECT r1.product_id, r1.rate
-        FROM Rates r1
-        WHERE 
-            (r1.scope = %s) OR
-            (r1.scope = 'all' AND NOT EXISTS (
-                SELECT 1 FROM Rates r2 
-                WHERE r2.product_id = r1.product_id AND r2.scope = %s
-            ))
-        ORDER BY r1.product_id
-        """
-
-        cursor.execute(name_and_count_query, (id,))
-        name_and_truckcount = cursor.fetchone()
-
-        cursor.execute(trucks_query, (id,))
-        trucks_list = cursor.fetchall()
-        
-        cursor.execute(rates_query, (id,id))
-        rates_list = cursor.fetchall()
-
-        cursor.close()
-        conn.close()
+        with db_connection() as conn:
+            cursor = prepared_cursor(conn, NAME_AND_COUNT_QUERY, dictionary=True)
+            cursor.execute(NAME_AND_COUNT_QUERY, (id,))
+            name_and_truckcount = cursor.fetchone()
+            # A prepared cursor has to be drained before it can run again
+            cursor.fetchall()
+
+            cursor = prepared_cursor(conn, PROVIDER_TRUCKS_QUERY, dictionary=True)
+            cursor.execute(PROVIDER_TRUCKS_QUERY, (id,))
+            trucks_list = cursor.fetchall()
+
+        rates = rate_index.rates_for(id)
+        rates_list = [{"product_id": product_id, "rate": rates[product_id]} for product_id in sorted(rates)]
             
         if name_and_truckcount is not None and trucks_list is not None:
             return True, True, name_and_truckcount["provider_name"], name_and_truckcount["truck_count"], trucks_list, rates_list
@@ -0,0 +1,27 @@
+# Production server settings: gunicorn --config gunicorn.conf.py app:app
+# Reload workers gracefully with `kill -HUP <master pid>`.
+import multiprocessing
+import os
+import sys
+
+bind = f"0.0.0.0:{os.environ.get('PORT', 5000)}"
+# Compose passes these through as empty strings when they are not set on the host
+workers = int(os.environ.get("WEB_WORKERS") or multiprocessing.cpu_count() * 2 + 1)
+threads = int(os.environ.get("WEB_THREADS") or 4)
+worker_class = "gthread"
+timeout = int(os.environ.get("WEB_TIMEOUT", 60))
+graceful_timeout = int(os.environ.get("WEB_GRACEFUL_TIMEOUT", 30))
+keepalive = int(os.environ.get("WEB_KEEPALIVE", 5))
+max_requests = int(os.environ.get("WEB_MAX_REQUESTS", 0))
+max_requests_jitter = int(os.environ.get("WEB_MAX_REQUESTS_JITTER", 0))
+# Each worker imports the app itself and builds its own pool on first use
+preload_app = os.environ.get("WEB_PRELOAD", "0") == "1"
+accesslog = "-"
+errorlog = "-"
+
+
+def post_fork(server, worker):
+    # Only a preloaded app has state inherited from the master
+    billing = sys.modules.get("app")
+    if billing is not None:
+        billing.reset_after_fork()
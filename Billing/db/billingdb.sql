@@ -17,12 +17,23 @@ CREATE TABLE IF NOT EXISTS `Provider` (
   PRIMARY KEY (`id`)
 ) ENGINE=MyISAM  AUTO_INCREMENT=10001 ;
 
+-- InnoDB so a rates upload is applied in a single transaction. Scope is a provider id
+-- or "All", so it cannot carry a foreign key to Provider.
 CREATE TABLE IF NOT EXISTS `Rates` (
   `product_id` varchar(50) NOT NULL,
   `rate` int(11) DEFAULT 0,
   `scope` varchar(50) DEFAULT NULL,
-  FOREIGN KEY (scope) REFERENCES `Provider`(`id`)
-) ENGINE=MyISAM ;
+  UNIQUE KEY `uq_rates_product_scope` (`product_id`, `scope`)
+) ENGINE=InnoDB ;
+
+-- One row, bumped by every rates upload so each worker's rate index can tell it is stale
+CREATE TABLE IF NOT EXISTS `RatesVersion` (
+  `id` tinyint NOT NULL,
+  `version` bigint NOT NULL DEFAULT 0,
+  PRIMARY KEY (`id`)
+) ENGINE=InnoDB ;
+
+INSERT IGNORE INTO `RatesVersion` (`id`, `version`) VALUES (1, 0);
 
 CREATE TABLE IF NOT EXISTS `Trucks` (
   `id` varchar(10) NOT NULL,
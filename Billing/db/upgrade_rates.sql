@@ -0,0 +1,38 @@
+--
+-- Upgrades a `billdb` created before Rates moved to InnoDB with a unique
+-- (product_id, scope) key and RatesVersion was added, POST /rates refuses
+-- to upload until it is applied:
+--
+--   mysql billdb < upgrade_rates.sql
+--
+-- Rates has no id, so duplicates are folded while copying into a new table.
+-- MyISAM returns rows in insertion order, the last rate uploaded for a
+-- product and scope wins, as it does with the upsert.
+--
+
+USE `billdb`;
+
+DROP TABLE IF EXISTS `Rates_upgrade`;
+
+CREATE TABLE `Rates_upgrade` (
+  `product_id` varchar(50) NOT NULL,
+  `rate` int(11) DEFAULT 0,
+  `scope` varchar(50) DEFAULT NULL,
+  UNIQUE KEY `uq_rates_product_scope` (`product_id`, `scope`)
+) ENGINE=InnoDB ;
+
+INSERT INTO `Rates_upgrade` (`product_id`, `rate`, `scope`)
+SELECT `product_id`, `rate`, `scope` FROM `Rates`
+ON DUPLICATE KEY UPDATE `rate` = VALUES(`rate`);
+
+RENAME TABLE `Rates` TO `Rates_old`, `Rates_upgrade` TO `Rates`;
+
+DROP TABLE `Rates_old`;
+
+CREATE TABLE IF NOT EXISTS `RatesVersion` (
+  `id` tinyint NOT NULL,
+  `version` bigint NOT NULL DEFAULT 0,
+  PRIMARY KEY (`id`)
+) ENGINE=InnoDB ;
+
+INSERT IGNORE INTO `RatesVersion` (`id`, `version`) VALUES (1, 0);
@@ -0,0 +1,143 @@
+import pytest
+import json
+from unittest.mock import patch
+import app as billing
+
+BILLDB_DATA = (True, True, "Test Provider", 1, [{"id": "T1"}], [{"product_id": "corn", "rate": 12}])
+
+
+@pytest.fixture(autouse=True)
+def empty_cache():
+    billing.bill_cache.clear()
+    yield
+    billing.bill_cache.clear()
+
+
+@patch('app.get_billdb_data', return_value=BILLDB_DATA)
+@patch('app.get_produce_summary', return_value=(1, {"corn": {"count": 1, "amount": 100}}))
+def test_closed_period_bill_is_cached(mock_summary, mock_billdb, client):
+    first = client.get('/bill/1?from=20240101000000&to=20240131235959')
+    second = client.get('/bill/1?from=20240101000000&to=20240131235959')
+
+    assert first.status_code == second.status_code == 201
+    assert json.loads(first.data) == json.loads(second.data)
+    assert mock_billdb.call_count == 2
+    assert mock_summary.call_count == 1
+    stats = billing.bill_cache.stats()
+    assert stats["hits"] == 1
+    assert stats["misses"] == 1
+
+
+@patch('app.get_billdb_data', return_value=BILLDB_DATA)
+@patch('app.get_produce_summary', return_value=(1, {"corn": {"count": 1, "amount": 100}}))
+def test_open_period_bill_is_not_cached(mock_summary, mock_billdb, client):
+    client.get('/bill/1?from=20240101000000&to=29991231235959')
+    client.get('/bill/1?from=20240101000000&to=29991231235959')
+
+    assert mock_billdb.call_count == 2
+    assert billing.bill_cache.stats()["size"] == 0
+
+
+@patch('app.get_billdb_data', return_value=BILLDB_DATA)
+@patch('app.get_produce_summary', return_value=(None, "Error fetching data for trucks"))
+def test_failed_bill_is_not_cached(mock_summary, mock_billdb, client):
+    client.get('/bill/1?from=20240101000000&to=20240131235959')
+
+    assert billing.bill_cache.stats()["size"] == 0
+
+
+def test_update_provider_invalidates_its_bills(client, mock_db_connection):
+    mock_conn, mock_cursor = mock_db_connection
+    mock_cursor.fetchone.side_effect = [(1,), None]
+    billing.bill_cache.put(("1", "a", "b"), {"total": 1}, ["T1"], "v")
+    billing.bill_cache.put(("2", "a", "b"), {"total": 2}, ["T2"], "v")
+
+    response = client.put('/provider/1', json={"name": "renamed"})
+
+    assert response.status_code == 200
+    assert billing.bill_cache.get(("1", "a", "b"), "v") is None
+    assert billing.bill_cache.get(("2", "a", "b"), "v") == {"total": 2}
+
+
+def test_update_truck_invalidates_old_and_new_provider(client, mock_db_connection):
+    mock_conn, mock_cursor = mock_db_connection
+    mock_cursor.fetchone.side_effect = [('2',), ('T1',)]
+    billing.bill_cache.put(("1", "a", "b"), {"total": 1}, ["T1"], "v")
+    billing.bill_cache.put(("2", "a", "b"), {"total": 2}, ["T2"], "v")
+    billing.bill_cache.put(("3", "a", "b"), {"total": 3}, ["T3"], "v")
+
+    response = client.put('/truck/T1', json={"provider": "2"})
+
+    assert response.status_code == 201
+    assert billing.bill_cache.get(("1", "a", "b"), "v") is None
+    assert billing.bill_cache.get(("2", "a", "b"), "v") is None
+    assert billing.bill_cache.get(("3", "a", "b"), "v") == {"total": 3}
+
+
+def test_bill_cache_evicts_least_recently_used():
+    cache = billing.BillCache(max_size=2)
+    cache.put(("1", "a", "b"), 1, [], "v")
+    cache.put(("2", "a", "b"), 2, [], "v")
+    cache.get(("1", "a", "b"), "v")
+    cache.put(("3", "a", "b"), 3, [], "v")
+
+    assert cache.get(("2", "a", "b"), "v") is None
+    assert cache.get(("1", "a", "b"), "v") == 1
+    assert cache.stats()["evictions"] == 1
+
+
+def test_bill_cache_entries_expire():
+    cache = billing.BillCache(ttl=0)
+    cache.put(("1", "a", "b"), 1, [], "v")
+
+    assert cache.get(("1", "a", "b"), "v") is None
+    assert cache.stats()["expired"] == 1
+
+
+@patch('app.get_produce_summary', return_value=(1, {"corn": {"count": 1, "amount": 100}}))
+def test_write_through_another_worker_makes_bill_stale(mock_summary, client, mock_db_connection):
+    mock_conn, mock_cursor = mock_db_connection
+    mock_cursor.fetchone.side_effect = [(1,), None]
+    with patch('app.get_billdb_data', return_value=BILLDB_DATA):
+        client.get('/bill/1?from=20240101000000&to=20240131235959')
+
+    # Another worker renames the provider, only its own cache is invalidated
+    with patch('app.bill_cache', billing.BillCache()):
+        assert client.put('/provider/1', json={"name": "renamed"}).status_code == 200
+
+    renamed = (True, True, "renamed") + BILLDB_DATA[3:]
+    with patch('app.get_billdb_data', return_value=renamed):
+        response = client.get('/bill/1?from=20240101000000&to=20240131235959')
+
+    assert json.loads(response.data)["name"] == "renamed"
+    assert mock_summary.call_count == 2
+
+
+@patch('app.get_produce_summary', return_value=(1, {"corn": {"count": 1, "amount": 100}}))
+def test_rates_upload_through_another_worker_makes_bill_stale(mock_summary, client):
+    rows = [("corn", 12, "All")]
+    index = billing.RateIndex()
+    index.load(rows, 1)
+
+    def billdb_data(id):
+        rates = billing.rate_index.rates_for(id)
+        return True, True, "Test Provider", 1, [{"id": "T1"}], [{"product_id": p, "rate": r} for p, r in rates.items()]
+
+    with patch('app.rate_index', index), patch('app.get_billdb_data', side_effect=billdb_data), \
+            patch.object(index, 'reload', side_effect=lambda: index.load(rows, 2)):
+        with patch('app.read_rates_version', return_value=1):
+            client.get('/bill/1?from=20240101000000&to=20240131235959')
+            client.get('/bill/1?from=20240101000000&to=20240131235959')
+        # Another worker took an upload, this worker's cache was not told
+        with patch('app.read_rates_version', return_value=2):
+            client.get('/bill/1?from=20240101000000&to=20240131235959')
+
+    assert mock_summary.call_count == 2
+    assert index.rates_version == 2
+
+
+def test_stats_endpoint(client):
+    response = client.get('/stats')
+
+    assert response.status_code == 200
+    assert "bill_cache" in json.loads(response.data)
@@ -0,0 +1,126 @@
+import pytest
+import json
+from unittest.mock import patch, MagicMock
+import app as billing
+
+PROVIDER_ROWS = [
+    {"id": 10001, "name": "p1", "truck": "T1"},
+    {"id": 10001, "name": "p1", "truck": "T2"},
+    {"id": 10002, "name": "p2", "truck": "T3"},
+    {"id": 10003, "name": "p3", "truck": None},
+]
+
+BY_TRUCK = {"trucks": {
+    "T1": {"sessionCount": 2, "products": [{"produce": "apple", "sessions": 2, "count": 2, "amount": 100}]},
+    "T2": {"sessionCount": 1, "products": [{"produce": "apple", "sessions": 1, "count": 1, "amount": 50}]},
+    "T3": {"sessionCount": 2, "products": [{"produce": "mango", "sessions": 2, "count": 1, "amount": 30}]},
+}}
+
+
+@pytest.fixture(autouse=True)
+def setup():
+    index = billing.RateIndex()
+    index.load([("apple", 2, "All"), ("mango", 5, "All"), ("apple", 3, "10001")], 1)
+    billing.bill_cache.clear()
+    with patch('app.rate_index', index), patch('app.read_rates_version', return_value=1):
+        yield
+    billing.bill_cache.clear()
+
+
+@pytest.fixture
+def mock_weight_post():
+    with patch('app.weight_post', return_value=BY_TRUCK) as mock_post:
+        yield mock_post
+
+
+def read_bills(response):
+    return [json.loads(line) for line in response.data.decode().splitlines()]
+
+
+def test_bills_for_all_providers(client, mock_db_connection, mock_weight_post):
+    mock_conn, mock_cursor = mock_db_connection
+    mock_cursor.fetchall.return_value = PROVIDER_ROWS
+
+    response = client.get('/bills?from=20240101000000&to=20240131235959')
+
+    assert response.status_code == 200
+    assert response.mimetype == "application/x-ndjson"
+    bills = {bill["id"]: bill for bill in read_bills(response)}
+    assert bills["10001"]["truckCount"] == 2
+    assert bills["10001"]["sessionCount"] == 3
+    assert bills["10001"]["products"] == [{"product": "apple", "count": "3", "amount": 150, "rate": 3, "pay": 450}]
+    assert bills["10002"]["total"] == 150
+    assert bills["10003"] == {"id": "10003", "name": "p3", "from": "20240101000000", "to": "20240131235959",
+                              "truckCount": 0, "sessionCount": 0, "products": [], "total": 0}
+
+    # One Provider/Trucks query and one Weight call for every truck
+    mock_cursor.execute.assert_called_once()
+    mock_weight_post.assert_called_once_with("/produce-totals", {
+        "trucks": ["T1", "T2", "T3"], "from": "20240101000000", "to": "20240131235959", "group_by": "truck"})
+
+
+def test_bills_match_single_bill(client, mock_db_connection, mock_weight_post):
+    mock_conn, mock_cursor = mock_db_connection
+    mock_cursor.fetchall.return_value = PROVIDER_ROWS[:2]
+    bulk = read_bills(client.get('/bills?from=20240101000000&to=20240131235959&providers=10001'))[0]
+    billing.bill_cache.clear()
+
+    with patch('app.get_billdb_data', return_value=(True, True, "p1", 2, [{"id": "T1"}, {"id": "T2"}],
+                                                     [{"product_id": "apple", "rate": 3}])), \
+         patch('app.get_produce_summary', return_value=(3, {"apple": {"count": 3, "amount": 150}})):
+        single = json.loads(client.get('/bill/10001?from=20240101000000&to=20240131235959').data)
+
+    assert bulk == single
+
+
+def test_bills_filtered_providers(client, mock_db_connection, mock_weight_post):
+    mock_conn, mock_cursor = mock_db_connection
+    mock_cursor.fetchall.return_value = PROVIDER_ROWS[2:3]
+
+    response = client.get('/bills?from=20240101000000&to=20240131235959&providers=10002')
+
+    assert [bill["id"] for bill in read_bills(response)] == ["10002"]
+    query, params = mock_cursor.execute.call_args[0]
+    assert "WHERE p.id IN (%s)" in query
+    assert params == ["10002"]
+
+
+def test_bills_unknown_provider(client, mock_db_connection, mock_weight_post):
+    mock_conn, mock_cursor = mock_db_connection
+    mock_cursor.fetchall.return_value = PROVIDER_ROWS[2:3]
+
+    response = client.get('/bills?providers=10002,99999')
+
+    assert response.status_code == 404
+    assert "99999" in json.loads(response.data)["error"]
+    mock_weight_post.assert_not_called()
+
+
+def test_bills_served_from_cache(client, mock_db_connection, mock_weight_post):
+    mock_conn, mock_cursor = mock_db_connection
+    mock_cursor.fetchall.return_value = PROVIDER_ROWS[2:3]
+    first = read_bills(client.get('/bills?from=20240101000000&to=20240131235959&providers=10002'))
+
+    second = read_bills(client.get('/bills?from=20240101000000&to=20240131235959&providers=10002'))
+
+    assert first == second
+    mock_weight_post.assert_called_once()
+
+
+def test_bills_weight_error(client, mock_db_connection, mock_weight_post):
+    mock_conn, mock_cursor = mock_db_connection
+    mock_cursor.fetchall.return_value = PROVIDER_ROWS[2:3]
+    mock_weight_post.side_effect = billing.requests.exceptions.ConnectionError("down")
+
+    response = client.get('/bills?from=20240101000000&to=20240131235959')
+
+    bills = read_bills(response)
+    assert bills[0]["id"] == "10002"
+    assert "Error fetching data for trucks" in bills[0]["error"]
+    assert billing.bill_cache.stats()["size"] == 0
+
+
+def test_bills_invalid_time(client):
+    response = client.get('/bills?from=2024')
+
+    assert response.status_code == 400
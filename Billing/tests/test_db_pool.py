@@ -0,0 +1,151 @@
+import pytest
+import json
+import threading
+from contextlib import nullcontext
+from unittest.mock import patch, MagicMock
+from mysql.connector import Error
+from mysql.connector.errors import PoolError
+import app as billing
+
+
+@pytest.fixture
+def mock_pool():
+    pool = MagicMock()
+    with patch('app.get_pool', return_value=pool):
+        yield pool
+
+
+def connection(connection_id=7):
+    cnx = MagicMock()
+    cnx.connection_id = connection_id
+    cnx.in_transaction = False
+    cnx.is_connected.return_value = True
+    return cnx
+
+
+def test_borrow_counts_waits(mock_pool):
+    conn = MagicMock()
+    mock_pool.acquire.return_value = (conn, True)
+    waits = billing.db_stats.waits
+
+    assert billing.get_db_connection() is conn
+    mock_pool.acquire.assert_called_once_with(billing.DB_POOL_TIMEOUT)
+    assert billing.db_stats.waits == waits + 1
+
+
+def test_borrow_times_out_when_pool_stays_exhausted(mock_pool):
+    mock_pool.acquire.side_effect = PoolError("pool exhausted")
+    timeouts = billing.db_stats.timeouts
+
+    with pytest.raises(Exception, match="Could not connect"):
+        billing.get_db_connection()
+    assert billing.db_stats.timeouts == timeouts + 1
+
+
+def test_pool_opens_connections_on_first_borrow():
+    connect = MagicMock(side_effect=[connection(1), connection(2)])
+    pool = billing.ConnectionPool(2, connect)
+
+    first, waited = pool.acquire(0)
+    second, _ = pool.acquire(0)
+
+    assert not waited
+    assert {first.connection_id, second.connection_id} == {1, 2}
+    with pytest.raises(PoolError):
+        pool.acquire(0)
+
+
+def test_pool_wakes_waiting_borrower_on_release():
+    cnx = connection()
+    pool = billing.ConnectionPool(1, MagicMock(return_value=cnx))
+    conn, _ = pool.acquire(0)
+    releaser = threading.Timer(0.05, conn.close)
+    releaser.start()
+
+    again, waited = pool.acquire(5)
+
+    releaser.join()
+    assert waited
+    assert again.connection is cnx
+
+
+def test_pool_release_rolls_back_and_reconnects():
+    cnx = connection()
+    pool = billing.ConnectionPool(1, MagicMock(return_value=cnx))
+    conn, _ = pool.acquire(0)
+    cnx.in_transaction = True
+    conn.close()
+    cnx.rollback.assert_called_once()
+
+    cnx.is_connected.return_value = False
+    pool.acquire(0)
+    cnx.reconnect.assert_called_once()
+
+
+def test_pool_frees_slot_when_connect_fails():
+    pool = billing.ConnectionPool(1, MagicMock(side_effect=[Error("down"), connection()]))
+
+    with pytest.raises(Error):
+        pool.acquire(0)
+    assert pool.acquire(0)[0].connection_id == 7
+
+
+def test_connection_returned_when_block_raises(mock_db_connection):
+    mock_conn, mock_cursor = mock_db_connection
+
+    with pytest.raises(RuntimeError):
+        with billing.db_connection():
+            raise RuntimeError("boom")
+
+    mock_conn.close.assert_called_once()
+
+
+def test_prepared_cursor_reused_per_connection():
+    conn = MagicMock()
+    conn.connection = connection()
+    conn.cursor.side_effect = lambda **kwargs: MagicMock()
+
+    first = billing.prepared_cursor(conn, billing.TRUCK_EXISTS_QUERY)
+    again = billing.prepared_cursor(conn, billing.TRUCK_EXISTS_QUERY)
+    other = billing.prepared_cursor(conn, billing.PROVIDER_EXISTS_QUERY)
+
+    assert first is again
+    assert other is not first
+    conn.cursor.assert_called_with(prepared=True, dictionary=False)
+    assert conn.cursor.call_count == 2
+
+
+def test_prepared_cursor_dropped_after_reconnect():
+    conn = MagicMock()
+    conn.connection = connection()
+    conn.cursor.side_effect = lambda **kwargs: MagicMock()
+    first = billing.prepared_cursor(conn, billing.TRUCK_EXISTS_QUERY)
+
+    conn.connection.connection_id = 8
+
+    assert billing.prepared_cursor(conn, billing.TRUCK_EXISTS_QUERY) is not first
+
+
+@pytest.mark.parametrize("raises,unread,forgotten", [(True, False, True), (False, True, True), (False, False, False)])
+def test_prepared_cursors_forgotten_on_return(mock_db_connection, raises, unread, forgotten):
+    mock_conn, mock_cursor = mock_db_connection
+    mock_conn.connection = connection()
+    mock_conn.unread_result = unread
+
+    with pytest.raises(RuntimeError) if raises else nullcontext():
+        with billing.db_connection() as conn:
+            billing.prepared_cursor(conn, billing.TRUCK_EXISTS_QUERY)
+            if raises:
+                raise RuntimeError("boom")
+
+    assert (mock_conn.connection not in billing._statements) == forgotten
+    billing.forget_statements(mock_conn)
+
+
+def test_stats_include_pool(client):
+    response = client.get('/stats')
+
+    db = json.loads(response.data)["db"]
+    assert db["pool_size"] == billing.DB_POOL_SIZE
+    assert "borrow_ms_avg" in db
+    assert "statements_reused" in db
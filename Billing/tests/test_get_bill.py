@@ -20,10 +20,8 @@ def mock_db_connection():
         yield mock_conn, mock_cursor  # Yield both for test assertions
 
 @patch('app.get_billdb_data')
-@patch('app.get_session_list_per_truck')
-@patch('app.process_session_data')
-def test_get_bill_success(mock_process_session_data,
-                          mock_get_session_list,
+@patch('app.get_produce_summary')
+def test_get_bill_success(mock_get_produce_summary,
                           mock_get_billdb_data,
                           client):
     # Setup mocks
@@ -36,18 +34,19 @@ def test_get_bill_success(mock_process_session_data,
         [{"product_id": "corn", "rate": 12}, {"product_id": "wheat", "rate": 15}]  # rates list
     )
     
-    mock_get_session_list.return_value = (
+    mock_get_produce_summary.return_value = (
         3,  # session count
-        {"T1": ["S1", "S2"], "T2": ["S3"]}  # session list per truck
+        {
+            "corn": {"count": 2, "amount": 3000},
+            "wheat": {"count": 1, "amount": 1500}
+        }
     )
     
-    mock_process_session_data.return_value = {
-        "corn": {"count": 2, "amount": 3000},
-        "wheat": {"count": 1, "amount": 1500}
-    }
-    
     # Make the request
     response = client.get('/bill/1?from=20240101000000&to=20240131235959')
+
+    mock_get_produce_summary.assert_called_once_with(
+        [{"id": "T1"}, {"id": "T2"}], "20240101000000", "20240131235959")
     
     # Verify response
     assert response.status_code == 201
@@ -147,39 +146,8 @@ def test_get_bill_empty_id(client):
     assert "Provider ID cannot be empty" in data["error"]
 
 @patch('app.get_billdb_data')
-@patch('app.get_session_list_per_truck')
-def test_get_bill_session_list_error(mock_get_session_list,
-                                    mock_get_billdb_data,
-                                    client):
-    # Setup mocks
-    mock_get_billdb_data.return_value = (
-        True, 
-        True, 
-        "Test Provider", 
-        2,  # truck count
-        [{"id": "T1"}, {"id": "T2"}],  # truck list
-        [{"product_id": "corn", "rate": 12}]  # rates list
-    )
-    
-    # Simulate error in get_session_list_per_truck
-    mock_get_session_list.return_value = (
-        None,  # session count
-        "Error fetching data for truck T1: Connection refused"  # Error message
-    )
-    
-    # Make the request
-    response = client.get('/bill/1')
-    
-    # Verify response
-    data = json.loads(response.data)
-    assert "error" in data
-    assert "Error fetching data for truck" in data["error"]
-
-@patch('app.get_billdb_data')
-@patch('app.get_session_list_per_truck')
-@patch('app.process_session_data')
-def test_get_bill_process_session_error(mock_process_session_data,
-                                       mock_get_session_list,
+@patch('app.get_produce_summary')
+def test_get_bill_produce_summary_error(mock_get_produce_summary,
                                        mock_get_billdb_data,
                                        client):
     # Setup mocks
@@ -192,33 +160,23 @@ def test_get_bill_process_session_error(mock_process_session_data,
         [{"product_id": "corn", "rate": 12}]  # rates list
     )
     
-    mock_get_session_list.return_value = (
-        3,  # session count
-        {"T1": ["S1", "S2"], "T2": ["S3"]}  # session list per truck
+    # Simulate error talking to the Weight service
+    mock_get_produce_summary.return_value = (
+        None,  # session count
+        "Error fetching data for trucks: Connection refused"  # Error message
     )
     
-    # Simulate error in process_session_data - the function returns a string on error
-    mock_process_session_data.return_value = "Error processing session S1: Invalid data format"
-    
     # Make the request
     response = client.get('/bill/1')
     
-    # Looking at your code, when process_session_data returns a string error,
-    # it gets assigned directly to the "error" field in the response
+    # Verify response
     data = json.loads(response.data)
     assert "error" in data
-    # The error should be the session list - because there's a check in your code:
-    # if isinstance(product_stats, str):
-    #     return jsonify({"error": sessionListPerTruck})
-    # So the error is actually the sessionListPerTruck value
-    assert "Error processing session S1: Invalid data format" in data["error"]
-    assert "Error processing session" in data["error"]
+    assert "Error fetching data for trucks" in data["error"]
 
 @patch('app.get_billdb_data')
-@patch('app.get_session_list_per_truck')
-@patch('app.process_session_data')
-def test_get_bill_no_matching_products(mock_process_session_data,
-                                       mock_get_session_list,
+@patch('app.get_produce_summary')
+def test_get_bill_no_matching_products(mock_get_produce_summary,
                                        mock_get_billdb_data,
                                        client):
     # Setup mocks
@@ -231,16 +189,12 @@ def test_get_bill_no_matching_products(mock_process_session_data,
         [{"product_id": "corn", "rate": 12}]  # rates list
     )
     
-    mock_get_session_list.return_value = (
+    # Return session data with no matching products
+    mock_get_produce_summary.return_value = (
         3,  # session count
-        {"T1": ["S1", "S2"], "T2": ["S3"]}  # session list per truck
+        {"wheat": {"count": 1, "amount": 1500}}  # No corn (which was in rates list)
     )
     
-    # Return session data with no matching products
-    mock_process_session_data.return_value = {
-        "wheat": {"count": 1, "amount": 1500}  # No corn (which was in rates list)
-    }
-    
     # Make the request
     response = client.get('/bill/1')
     
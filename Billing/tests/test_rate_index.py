@@ -0,0 +1,95 @@
+import pytest
+import json
+from unittest.mock import patch
+import app as billing
+
+RATES = [("apple", 10, "All"), ("orange", 20, "ALL"), ("apple", 15, "10001"), ("mango", 30, "10002")]
+
+
+@pytest.fixture
+def rate_index():
+    index = billing.RateIndex()
+    index.load(RATES, 1)
+    with patch('app.read_rates_version', return_value=1):
+        yield index
+
+
+def test_provider_rates_override_all(rate_index):
+    assert rate_index.rates_for("10001") == {"apple": 15, "orange": 20}
+    assert rate_index.rates_for(10002) == {"apple": 10, "orange": 20, "mango": 30}
+    assert rate_index.rates_for("10003") == {"apple": 10, "orange": 20}
+
+
+def test_load_swaps_in_new_version(rate_index):
+    version = rate_index.version
+    rate_index.load([("apple", 11, "All")], 1)
+
+    assert rate_index.version == version + 1
+    assert rate_index.rates_for("10001") == {"apple": 11}
+
+
+def test_index_reloads_when_rates_version_changes(mock_db_connection):
+    mock_conn, mock_cursor = mock_db_connection
+    # Another worker's upload bumps the version between the second and third lookup
+    mock_cursor.fetchone.side_effect = [(1,), (1,), (2,), (2,)]
+    mock_cursor.fetchall.return_value = RATES
+    index = billing.RateIndex()
+
+    for _ in range(3):
+        index.rates_for("10001")
+
+    loads = [c for c in mock_cursor.execute.call_args_list if c[0][0] == billing.RATES_QUERY]
+    assert len(loads) == 2
+    assert index.stats()["rates_version"] == 2
+
+
+def test_index_without_rates_version_reloads_every_lookup(mock_db_connection):
+    mock_conn, mock_cursor = mock_db_connection
+    mock_cursor.fetchone.return_value = None
+    mock_cursor.fetchall.return_value = RATES
+    index = billing.RateIndex()
+
+    index.rates_for("10001")
+    index.rates_for("10001")
+
+    loads = [c for c in mock_cursor.execute.call_args_list if c[0][0] == billing.RATES_QUERY]
+    assert len(loads) == 2
+
+
+def test_unchecked_lookup_trusts_index(rate_index):
+    with patch('app.read_rates_version') as read_version:
+        assert rate_index.rates_for("10001", check=False) == {"apple": 15, "orange": 20}
+    read_version.assert_not_called()
+
+
+def test_get_billdb_data_uses_rate_index(mock_db_connection, rate_index):
+    mock_conn, mock_cursor = mock_db_connection
+    mock_cursor.fetchone.return_value = {"provider_name": "p1", "truck_count": 1}
+    mock_cursor.fetchall.return_value = [{"id": "T1"}]
+
+    with patch('app.rate_index', rate_index):
+        result = billing.get_billdb_data("10001")
+
+    assert result[5] == [{"product_id": "apple", "rate": 15}, {"product_id": "orange", "rate": 20}]
+    assert mock_cursor.execute.call_count == 2
+
+
+def test_reload_endpoint(client, mock_db_connection):
+    mock_conn, mock_cursor = mock_db_connection
+    mock_cursor.fetchall.return_value = RATES
+
+    response = client.post('/rates/reload')
+
+    assert response.status_code == 200
+    data = json.loads(response.data)
+    assert data["providers"] == 2
+    assert data["default_products"] == 2
+
+
+def test_reload_endpoint_db_error(client, mock_db_connection):
+    mock_conn, mock_cursor = mock_db_connection
+    mock_cursor.execute.side_effect = Exception("Database error")
+
+    response = client.post('/rates/reload')
+
+    assert response.status_code == 500
@@ -1,7 +1,10 @@
 import pytest
 import json
+import io
 import os
-from unittest.mock import patch, MagicMock
+import pandas as pd
+from unittest.mock import patch, MagicMock, call
+import app as billing
 from app import app
 
 @pytest.fixture
@@ -20,38 +23,58 @@ def mock_db_connection():
         mock_get_db_connection.return_value = mock_conn  # Return just the connection
         yield mock_conn, mock_cursor  # Yield both for test assertions
 
+@pytest.fixture(autouse=True)
+def mock_rate_index():
+    with patch('app.rate_index') as mock_index:
+        yield mock_index
+
+@pytest.fixture(autouse=True)
+def rates_schema_ready():
+    with patch('app._rates_schema_ready', True):
+        yield
+
+UPSERT_PREFIX = "INSERT INTO Rates (product_id, rate, scope)"
+
+
+def rates_frame(rows):
+    return pd.DataFrame(rows, columns=["Product", "Rate", "Scope"])
+
+
+def upsert_calls(mock_cursor):
+    return [c for c in mock_cursor.execute.call_args_list if UPSERT_PREFIX in c[0][0]]
+
+
 # Tests for POST /rates endpoint
 @patch('os.path.exists')
 @patch('pandas.read_excel')
-def test_add_rate_success_new_product(mock_read_excel, mock_exists, client, mock_db_connection):
+def test_add_rate_success_new_product(mock_read_excel, mock_exists, client, mock_db_connection, mock_rate_index):
     """Test adding a new rate successfully."""
     # Setup
     mock_conn, mock_cursor = mock_db_connection
     mock_exists.return_value = True
-    
-    # Create a mock DataFrame
-    mock_df = MagicMock()
-    mock_df.columns = ["Product", "Rate", "Scope"]
-    mock_df.to_records.return_value.tolist.return_value = [("PROD1", 10.5, "All")]
-    mock_read_excel.return_value = mock_df
-    
-    # Configure cursor behavior
-    mock_cursor.fetchone.return_value = None  # No existing product
-    
+    mock_read_excel.return_value = rates_frame([("PROD1", 10, "All")])
+
+    # No current rates
+    mock_cursor.fetchall.return_value = []
+
     # Make the request
     response = client.post('/rates', json={"filename": "test_rates"})
-    
+
     # Assertions
     assert response.status_code == 201
-    
+    response_data = json.loads(response.data)
+    assert (response_data["inserted"], response_data["updated"], response_data["unchanged"]) == (1, 0, 0)
+
     mock_exists.assert_called_once_with('/in/test_rates.xlsx')
     mock_read_excel.assert_called_once_with('/in/test_rates.xlsx', engine='openpyxl')
-    
-    # Check that INSERT was called with correct params
-    mock_cursor.execute.assert_any_call(
-        "INSERT INTO Rates (product_id, rate, scope) VALUES (%s, %s, %s)", 
-        ("PROD1", 10.5, "All")
-    )
+
+    # Check that one upsert was sent with correct params
+    upserts = upsert_calls(mock_cursor)
+    assert len(upserts) == 1
+    assert upserts[0][0][1] == ["PROD1", 10, "All"]
+    # Other workers learn about the upload from the version bumped with it
+    mock_cursor.execute.assert_called_with(billing.RATES_VERSION_BUMP)
+    mock_rate_index.reload.assert_called_once()
     mock_conn.commit.assert_called_once()
     mock_cursor.close.assert_called_once()
     mock_conn.close.assert_called_once()
@@ -63,27 +86,23 @@ def test_add_rate_update_existing_product(mock_read_excel, mock_exists, client,
     # Setup
     mock_conn, mock_cursor = mock_db_connection
     mock_exists.return_value = True
-    
-    # Create a mock DataFrame
-    mock_df = MagicMock()
-    mock_df.columns = ["Product", "Rate", "Scope"]
-    mock_df.to_records.return_value.tolist.return_value = [("PROD1", 15.75, "All")]
-    mock_read_excel.return_value = mock_df
-    
-    # Configure cursor to return an existing product
-    mock_cursor.fetchone.return_value = {"product_id": "PROD1", "rate": 10.5, "scope": "All"}
-    
+    mock_read_excel.return_value = rates_frame([("PROD1", 16, "All"), ("PROD2", 5, "All")])
+
+    # PROD1 changes, PROD2 is already up to date
+    mock_cursor.fetchall.return_value = [("PROD1", 10, "All"), ("PROD2", 5, "ALL")]
+
     # Make the request
     response = client.post('/rates', json={"filename": "test_rates"})
-    
+
     # Assertions
     assert response.status_code == 200
-    
-    # Check that UPDATE was called with correct params
-    mock_cursor.execute.assert_any_call(
-        "UPDATE Rates SET rate=%s, scope=%s WHERE product_id=%s",
-        (15.75, "All", "PROD1")
-    )
+    response_data = json.loads(response.data)
+    assert (response_data["inserted"], response_data["updated"], response_data["unchanged"]) == (0, 1, 1)
+
+    # Only the changed row is written
+    upserts = upsert_calls(mock_cursor)
+    assert len(upserts) == 1
+    assert upserts[0][0][1] == ["PROD1", 16, "All"]
     mock_conn.commit.assert_called_once()
     mock_cursor.close.assert_called_once()
     mock_conn.close.assert_called_once()
@@ -95,46 +114,57 @@ def test_add_rate_for_specific_provider(mock_read_excel, mock_exists, client, mo
     # Setup
     mock_conn, mock_cursor = mock_db_connection
     mock_exists.return_value = True
-    
-    # Create a mock DataFrame
-    mock_df = MagicMock()
-    mock_df.columns = ["Product", "Rate", "Scope"]
-    mock_df.to_records.return_value.tolist.return_value = [("PROD1", 20.0, "PROVIDER123")]
-    mock_read_excel.return_value = mock_df
-    
-    # Mock cursor to return a provider on first call and no existing product on second
-    mock_cursor.fetchone.side_effect = [{"id": "PROVIDER123"}, None]
-    
+    mock_read_excel.return_value = rates_frame([("PROD1", 20, 10001), ("PROD2", 7, 10002)])
+
+    # Both providers exist, no current rates
+    mock_cursor.fetchall.side_effect = [[(10001,), (10002,)], []]
+
     # Make the request
     response = client.post('/rates', json={"filename": "test_rates"})
-    
+
     # Assertions
     assert response.status_code == 201
-    
-    # Check provider exists query
-    mock_cursor.execute.assert_any_call(
-        "SELECT * FROM Provider WHERE id=%s", 
-        ("PROVIDER123",)
-    )
-    
-    # Check that INSERT was called with correct params
+
+    # All providers are checked with a single query
     mock_cursor.execute.assert_any_call(
-        "INSERT INTO Rates (product_id, rate, scope) VALUES (%s, %s, %s)", 
-        ("PROD1", 20.0, "PROVIDER123")
+        "SELECT id FROM Provider WHERE id IN (%s,%s)",
+        ["10001", "10002"]
     )
+
+    # Both rows are written in one batched upsert
+    upserts = upsert_calls(mock_cursor)
+    assert len(upserts) == 1
+    assert upserts[0][0][1] == ["PROD1", 20, "10001", "PROD2", 7, "10002"]
     mock_conn.commit.assert_called_once()
     mock_cursor.close.assert_called_once()
     mock_conn.close.assert_called_once()
 
+@patch('os.path.exists')
+@patch('pandas.read_excel')
+def test_add_rate_unchanged_file_writes_nothing(mock_read_excel, mock_exists, client, mock_db_connection, mock_rate_index):
+    """Test uploading a file identical to the current rates."""
+    mock_conn, mock_cursor = mock_db_connection
+    mock_exists.return_value = True
+    mock_read_excel.return_value = rates_frame([("PROD1", 10, "All")])
+    mock_cursor.fetchall.return_value = [("PROD1", 10, "All")]
+
+    response = client.post('/rates', json={"filename": "test_rates"})
+
+    assert response.status_code == 200
+    assert json.loads(response.data)["unchanged"] == 1
+    assert upsert_calls(mock_cursor) == []
+    mock_rate_index.reload.assert_not_called()
+    assert call(billing.RATES_VERSION_BUMP) not in mock_cursor.execute.call_args_list
+
 @patch('os.path.exists')
 def test_add_rate_file_not_found(mock_exists, client):
     """Test handling when Excel file doesn't exist."""
     # Setup
     mock_exists.return_value = False
-    
+
     # Make the request
     response = client.post('/rates', json={"filename": "nonexistent"})
-    
+
     # Assertions
     assert response.status_code == 404
     response_data = json.loads(response.data)
@@ -148,24 +178,34 @@ def test_add_rate_provider_not_found(mock_read_excel, mock_exists, client, mock_
     # Setup
     mock_conn, mock_cursor = mock_db_connection
     mock_exists.return_value = True
-    
-    # Create a mock DataFrame
-    mock_df = MagicMock()
-    mock_df.columns = ["Product", "Rate", "Scope"]
-    mock_df.to_records.return_value.tolist.return_value = [("PROD1", 10.5, "NONEXISTENT")]
-    mock_read_excel.return_value = mock_df
-    
-    # Make cursor return None (no provider found)
-    mock_cursor.fetchone.return_value = None
-    
+    mock_read_excel.return_value = rates_frame([("PROD1", 10, "NONEXISTENT")])
+
+    # Make cursor return no provider
+    mock_cursor.fetchall.return_value = []
+
     # Make the request
     response = client.post('/rates', json={"filename": "test_rates"})
-    
+
     # Assertions
     assert response.status_code == 404
     response_data = json.loads(response.data)
     assert "error" in response_data
     assert "does not exist" in response_data["error"]
+    assert upsert_calls(mock_cursor) == []
+    mock_conn.commit.assert_not_called()
+    mock_conn.rollback.assert_called_once()
+
+@patch('os.path.exists')
+@patch('pandas.read_excel')
+def test_add_rate_invalid_rate(mock_read_excel, mock_exists, client, mock_db_connection):
+    """Test handling a rate that is not a number."""
+    mock_exists.return_value = True
+    mock_read_excel.return_value = rates_frame([("PROD1", "abc", "All")])
+
+    response = client.post('/rates', json={"filename": "test_rates"})
+
+    assert response.status_code == 400
+    assert "PROD1" in json.loads(response.data)["error"]
 
 @patch('os.path.exists')
 @patch('pandas.read_excel')
@@ -174,60 +214,155 @@ def test_add_rate_general_exception(mock_read_excel, mock_exists, client, mock_d
     # Setup
     mock_conn, mock_cursor = mock_db_connection
     mock_exists.return_value = True
-    
+
     # Make read_excel raise an exception
     mock_read_excel.side_effect = Exception("Database connection failed")
-    
+
     # Make the request
     response = client.post('/rates', json={"filename": "test_rates"})
-    
+
     # Assertions
     assert response.status_code == 500
     response_data = json.loads(response.data)
     assert "error" in response_data
 
+@pytest.mark.parametrize("schema", [None, ("MyISAM", 1, 1), ("InnoDB", 0, 1), ("InnoDB", 1, 0)])
+@patch('os.path.exists')
+@patch('pandas.read_excel')
+def test_add_rate_refused_before_upgrade(mock_read_excel, mock_exists, schema, client, mock_db_connection):
+    """Test that rates are not upserted into a Rates table without the unique key."""
+    mock_conn, mock_cursor = mock_db_connection
+    mock_exists.return_value = True
+    mock_read_excel.return_value = rates_frame([("PROD1", 10, "All")])
+    mock_cursor.fetchone.return_value = schema
+
+    with patch('app._rates_schema_ready', False):
+        response = client.post('/rates', json={"filename": "test_rates"})
+
+    assert response.status_code == 500
+    assert "upgrade_rates.sql" in json.loads(response.data)["error"]
+    assert upsert_calls(mock_cursor) == []
+    mock_conn.commit.assert_not_called()
+
+@patch('os.path.exists')
+@patch('pandas.read_excel')
+def test_add_rate_checks_schema_once(mock_read_excel, mock_exists, client, mock_db_connection):
+    """Test that the Rates schema is checked on the first upload only."""
+    mock_conn, mock_cursor = mock_db_connection
+    mock_exists.return_value = True
+    mock_read_excel.return_value = rates_frame([("PROD1", 10, "All")])
+    mock_cursor.fetchone.return_value = ("InnoDB", 1, 1)
+    mock_cursor.fetchall.return_value = []
+
+    with patch('app._rates_schema_ready', False):
+        client.post('/rates', json={"filename": "test_rates"})
+        response = client.post('/rates', json={"filename": "test_rates"})
+
+    assert response.status_code == 201
+    checks = [c for c in mock_cursor.execute.call_args_list if c[0][0] == billing.RATES_SCHEMA_QUERY]
+    assert len(checks) == 1
+
 # Tests for GET /rates endpoint
-def test_rates_download_success(client, mock_db_connection):
+@pytest.fixture
+def rate_index():
+    with patch('app.rate_index', billing.RateIndex()) as index, patch('app.read_rates_version', return_value=1):
+        yield index
+
+def test_rates_download_success(client, mock_db_connection, rate_index):
     """Test successful download of rates."""
     # Setup
     mock_conn, mock_cursor = mock_db_connection
-    
+
     # Mock data to be returned from database
-    mock_rates = [
-        {"product_id": "PROD1", "rate": 10.5, "scope": "All"},
-        {"product_id": "PROD2", "rate": 15.75, "scope": "PROVIDER123"}
-    ]
-    mock_cursor.fetchall.return_value = mock_rates
-    
-    # Mock DataFrame.to_excel to avoid actual file operations
-    with patch('pandas.DataFrame.to_excel'):
-        # Make the request
-        response = client.get('/rates')
-        
-        # Assertions
-        assert response.status_code == 200
-        response_data = json.loads(response.data)
-        assert "message" in response_data
-        assert "Rates successfully downloaded" in response_data["message"]
-        
-        # Check that correct SQL query was executed
-        mock_cursor.execute.assert_called_once_with(
-            "SELECT product_id, rate, scope FROM Rates"
-        )
-        mock_cursor.close.assert_called_once()
-        mock_conn.close.assert_called_once()
-
-def test_rates_download_no_rates(client, mock_db_connection):
+    mock_cursor.fetchall.return_value = [("PROD2", 15, "10001"), ("PROD1", 10, "All")]
+
+    # Make the request
+    response = client.get('/rates')
+
+    # Assertions
+    assert response.status_code == 200
+    assert response.mimetype == "application/vnd.openxmlformats-officedocument.spreadsheetml.sheet"
+    assert "rates.xlsx" in response.headers["Content-Disposition"]
+    assert response.headers["ETag"]
+
+    # The file is the same layout POST /rates reads
+    df = pd.read_excel(io.BytesIO(response.data), engine="openpyxl")
+    assert list(df.columns) == ["Product", "Rate", "Scope"]
+    assert df.values.tolist() == [["PROD1", 10, "All"], ["PROD2", 15, "10001"]]
+
+    # Check that correct SQL query was executed
+    mock_cursor.execute.assert_called_once_with(
+        "SELECT product_id, rate, scope FROM Rates"
+    )
+    mock_cursor.close.assert_called_once()
+    mock_conn.close.assert_called_once()
+
+def test_rates_download_csv(client, mock_db_connection, rate_index):
+    """Test downloading rates as CSV."""
+    mock_conn, mock_cursor = mock_db_connection
+    mock_cursor.fetchall.return_value = [("PROD1", 10, "All"), ("PROD2", 15, "10001")]
+
+    response = client.get('/rates?format=csv')
+
+    assert response.status_code == 200
+    assert response.mimetype == "text/csv"
+    assert response.data.decode().splitlines() == ["Product,Rate,Scope", "PROD1,10,All", "PROD2,15,10001"]
+
+def test_rates_download_not_modified(client, mock_db_connection, rate_index):
+    """Test that an unchanged rates table is not sent again."""
+    mock_conn, mock_cursor = mock_db_connection
+    mock_cursor.fetchall.return_value = [("PROD1", 10, "All")]
+    etag = client.get('/rates').headers["ETag"]
+
+    response = client.get('/rates', headers={"If-None-Match": etag})
+
+    assert response.status_code == 304
+    assert response.data == b""
+    # Served from the rate index, the database is read once
+    assert mock_cursor.execute.call_count == 1
+
+def test_rates_download_etag_follows_rates(client, mock_db_connection, rate_index):
+    """Test that changed rates get a new ETag."""
+    mock_conn, mock_cursor = mock_db_connection
+    mock_cursor.fetchall.return_value = [("PROD1", 10, "All")]
+    etag = client.get('/rates').headers["ETag"]
+    rate_index.load([("PROD1", 12, "All")], 1)
+
+    response = client.get('/rates', headers={"If-None-Match": etag})
+
+    assert response.status_code == 200
+
+def test_rates_download_after_upload_on_another_worker(client, mock_db_connection, rate_index):
+    """Test that an upload through another worker is served instead of 304."""
+    mock_conn, mock_cursor = mock_db_connection
+    mock_cursor.fetchall.return_value = [("PROD1", 10, "All")]
+    etag = client.get('/rates?format=csv').headers["ETag"]
+    mock_cursor.fetchall.return_value = [("PROD1", 12, "All")]
+
+    with patch('app.read_rates_version', return_value=2):
+        response = client.get('/rates?format=csv', headers={"If-None-Match": etag})
+
+    assert response.status_code == 200
+    assert response.headers["ETag"].startswith('"2-')
+    assert response.data.decode().splitlines() == ["Product,Rate,Scope", "PROD1,12,All"]
+
+def test_rates_download_invalid_format(client):
+    """Test asking for an unsupported format."""
+    response = client.get('/rates?format=pdf')
+
+    assert response.status_code == 400
+
+def test_rates_download_no_rates(client, mock_db_connection, rate_index):
     """Test download when no rates are available."""
     # Setup
     mock_conn, mock_cursor = mock_db_connection
-    
+
     # Return empty list (no rates)
     mock_cursor.fetchall.return_value = []
-    
+
     # Make the request
     response = client.get('/rates')
-    
+
     # Assertions
     assert response.status_code == 404
     response_data = json.loads(response.data)
@@ -236,19 +371,19 @@ def test_rates_download_no_rates(client, mock_db_connection):
     mock_cursor.close.assert_called_once()
     mock_conn.close.assert_called_once()
 
-def test_rates_download_exception(client, mock_db_connection):
+def test_rates_download_exception(client, mock_db_connection, rate_index):
     """Test handling of exceptions during download."""
     # Setup
     mock_conn, mock_cursor = mock_db_connection
-    
+
     # Make cursor.execute raise an exception
     mock_cursor.execute.side_effect = Exception("Database error")
-    
+
     # Make the request
     response = client.get('/rates')
-    
+
     # Assertions
     assert response.status_code == 500
     response_data = json.loads(response.data)
     assert "error" in response_data
-    assert "Error downloading rates" in response_data["error"]
\ No newline at end of file
+    assert "Error downloading rates" in response_data["error"]
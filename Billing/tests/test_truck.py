@@ -34,7 +34,8 @@ def test_register_truck_success(client, mock_db_connection):
     mock_cursor.execute.assert_any_call("INSERT INTO Trucks (id, provider_id) VALUES (%s, %s)", 
                                        ('TRUCK1', '1'))
     mock_conn.commit.assert_called_once()
-    mock_cursor.close.assert_called_once()
+    # Fixed queries run on prepared cursors that stay open for reuse
+    mock_conn.cursor.assert_called_with(prepared=True, dictionary=False)
     mock_conn.close.assert_called_once()
 
 def test_register_truck_missing_fields(client, mock_db_connection):
@@ -66,7 +67,8 @@ def test_register_truck_provider_not_found(client, mock_db_connection):
     
     mock_cursor.execute.assert_called_once_with("SELECT id FROM Provider WHERE id = %s", ('1',))
     mock_conn.commit.assert_not_called()
-    mock_cursor.close.assert_called_once()
+    # Fixed queries run on prepared cursors that stay open for reuse
+    mock_conn.cursor.assert_called_with(prepared=True, dictionary=False)
     mock_conn.close.assert_called_once()
 
 def test_register_truck_id_exists(client, mock_db_connection):
@@ -89,7 +91,8 @@ def test_register_truck_id_exists(client, mock_db_connection):
     mock_cursor.execute.assert_any_call("INSERT INTO Trucks (id, provider_id) VALUES (%s, %s)", 
                                        ('TRUCK1', '1'))
     mock_conn.commit.assert_not_called()
-    mock_cursor.close.assert_called_once()
+    # Fixed queries run on prepared cursors that stay open for reuse
+    mock_conn.cursor.assert_called_with(prepared=True, dictionary=False)
     mock_conn.close.assert_called_once()
 
 
@@ -111,7 +114,8 @@ def test_update_truck_success(client, mock_db_connection):
     mock_cursor.execute.assert_any_call("SELECT id FROM Trucks WHERE id = %s", ('TRUCK1',))
     mock_cursor.execute.assert_any_call("UPDATE Trucks SET provider_id=%s where id=%s", ('1', 'TRUCK1'))
     mock_conn.commit.assert_called_once()
-    mock_cursor.close.assert_called_once()
+    # Fixed queries run on prepared cursors that stay open for reuse
+    mock_conn.cursor.assert_called_with(prepared=True, dictionary=False)
     mock_conn.close.assert_called_once()
 
 def test_update_truck_missing_provider(client, mock_db_connection):
@@ -142,7 +146,8 @@ def test_update_truck_provider_not_found(client, mock_db_connection):
     
     mock_cursor.execute.assert_called_once_with("SELECT id FROM Provider WHERE id = %s", ('1',))
     mock_conn.commit.assert_not_called()
-    mock_cursor.close.assert_called_once()
+    # Fixed queries run on prepared cursors that stay open for reuse
+    mock_conn.cursor.assert_called_with(prepared=True, dictionary=False)
     mock_conn.close.assert_called_once()
 
 def test_update_truck_truck_not_found(client, mock_db_connection):
@@ -160,7 +165,8 @@ def test_update_truck_truck_not_found(client, mock_db_connection):
     mock_cursor.execute.assert_any_call("SELECT id FROM Provider WHERE id = %s", ('1',))
     mock_cursor.execute.assert_any_call("SELECT id FROM Trucks WHERE id = %s", ('TRUCK1',))
     mock_conn.commit.assert_not_called()
-    mock_cursor.close.assert_called_once()
+    # Fixed queries run on prepared cursors that stay open for reuse
+    mock_conn.cursor.assert_called_with(prepared=True, dictionary=False)
     mock_conn.close.assert_called_once()
 
 def test_update_truck_database_error(client, mock_db_connection):
@@ -180,7 +186,8 @@ def test_update_truck_database_error(client, mock_db_connection):
     mock_cursor.execute.assert_any_call("SELECT id FROM Trucks WHERE id = %s", ('TRUCK1',))
     mock_cursor.execute.assert_any_call("UPDATE Trucks SET provider_id=%s where id=%s", ('1', 'TRUCK1'))
     mock_conn.commit.assert_not_called()
-    mock_cursor.close.assert_called_once()
+    # Fixed queries run on prepared cursors that stay open for reuse
+    mock_conn.cursor.assert_called_with(prepared=True, dictionary=False)
     mock_conn.close.assert_called_once()
 
 
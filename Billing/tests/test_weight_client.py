@@ -0,0 +1,62 @@
+import pytest
+import requests
+from unittest.mock import patch, MagicMock
+import app as billing
+
+
+def make_response(payload, status_code=200):
+    response = MagicMock()
+    response.status_code = status_code
+    response.json.return_value = payload
+    if status_code >= 400:
+        response.raise_for_status.side_effect = requests.exceptions.HTTPError(response=response)
+    return response
+
+
+@pytest.fixture
+def mock_weight_http():
+    with patch('app.weight_http') as mock_http:
+        yield mock_http
+
+
+def test_get_produce_summary_single_call(mock_weight_http):
+    mock_weight_http.post.return_value = make_response({
+        "sessionCount": 4,
+        "products": [
+            {"produce": "corn", "sessions": 3, "count": 2, "amount": 1500},
+            {"produce": "wheat", "sessions": 1, "count": 0, "amount": 0},
+        ],
+    })
+
+    count, stats = billing.get_produce_summary([{"id": "T1"}, {"id": "T2"}], "20240101000000", "20240131235959")
+
+    assert count == 4
+    assert stats == {"corn": {"count": 2, "amount": 1500}}
+    mock_weight_http.post.assert_called_once_with(
+        f"{billing.WEIGHT_API_URL}/produce-totals",
+        json={"trucks": ["T1", "T2"], "from": "20240101000000", "to": "20240131235959"},
+        timeout=billing.WEIGHT_API_TIMEOUT,
+    )
+
+
+def test_get_produce_summary_no_trucks(mock_weight_http):
+    assert billing.get_produce_summary([], "20240101000000", "20240131235959") == (0, {})
+    mock_weight_http.post.assert_not_called()
+
+
+def test_get_produce_summary_connection_error(mock_weight_http):
+    mock_weight_http.post.side_effect = requests.exceptions.ConnectionError("Connection refused")
+
+    count, error = billing.get_produce_summary([{"id": "T1"}], "20240101000000", "20240131235959")
+
+    assert count is None
+    assert "Error fetching data for trucks" in error
+
+
+def test_get_produce_summary_http_error(mock_weight_http):
+    mock_weight_http.post.return_value = make_response({"error": "boom"}, 500)
+
+    count, error = billing.get_produce_summary([{"id": "T1"}], "20240101000000", "20240131235959")
+
+    assert count is None
+    assert isinstance(error, str)
@@ -0,0 +1,95 @@
+"""Closed-loop HTTP load generator for the Weight and Billing services.
+
+Each client thread keeps one keep-alive connection and sends requests back to back
+for the given duration, then the script prints throughput and latency percentiles.
+
+    python bench.py http://localhost:8082/health --clients 32 --duration 30
+    python bench.py "http://localhost:8082/item/T-14409?from=20240101000000" -c 64
+    python bench.py http://localhost:8081/bill/10001 --method GET -c 16 --json
+"""
+import argparse
+import http.client
+import json
+import threading
+import time
+from urllib.parse import urlsplit
+
+
+def client(url, method, body, deadline, results, lock):
+    parts = urlsplit(url)
+    path = parts.path + (f"?{parts.query}" if parts.query else "")
+    headers = {"Content-Type": "application/json"} if body else {}
+    latencies = []
+    errors = 0
+    conn = http.client.HTTPConnection(parts.hostname, parts.port or 80, timeout=30)
+    while time.monotonic() < deadline:
+        started = time.monotonic()
+        try:
+            conn.request(method, path, body=body, headers=headers)
+            response = conn.getresponse()
+            response.read()
+            if response.status >= 500:
+                errors += 1
+            else:
+                latencies.append(time.monotonic() - started)
+        except (OSError, http.client.HTTPException):
+            errors += 1
+            conn.close()
+            conn = http.client.HTTPConnection(parts.hostname, parts.port or 80, timeout=30)
+    conn.close()
+    with lock:
+        results["latencies"].extend(latencies)
+        results["errors"] += errors
+
+
+def percentile(values, p):
+    if not values:
+        return 0.0
+    return values[min(len(values) - 1, int(len(values) * p / 100))]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("url")
+    parser.add_argument("-c", "--clients", type=int, default=16, help="concurrent connections")
+    parser.add_argument("-d", "--duration", type=float, default=20, help="seconds to run")
+    parser.add_argument("-m", "--method", default="GET")
+    parser.add_argument("-b", "--body", help="request body, sent as JSON")
+    parser.add_argument("--json", action="store_true", help="print the summary as JSON")
+    args = parser.parse_args()
+
+    results = {"latencies": [], "errors": 0}
+    lock = threading.Lock()
+    deadline = time.monotonic() + args.duration
+    threads = [
+        threading.Thread(target=client, args=(args.url, args.method, args.body, deadline, results, lock))
+        for _ in range(args.clients)
+    ]
+    started = time.monotonic()
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    elapsed = time.monotonic() - started
+
+    latencies = sorted(results["latencies"])
+    summary = {
+        "url": args.url,
+        "clients": args.clients,
+        "seconds": round(elapsed, 2),
+        "requests": len(latencies),
+        "errors": results["errors"],
+        "requests_per_second": round(len(latencies) / elapsed, 1),
+        "p50_ms": round(percentile(latencies, 50) * 1000, 2),
+        "p95_ms": round(percentile(latencies, 95) * 1000, 2),
+        "p99_ms": round(percentile(latencies, 99) * 1000, 2),
+    }
+    if args.json:
+        print(json.dumps(summary))
+    else:
+        for key, value in summary.items():
+            print(f"{key:>20}: {value}")
+
+
+if __name__ == "__main__":
+    main()
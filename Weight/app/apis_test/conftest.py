@@ -11,12 +11,35 @@ def set_env_vars():
     yield
     # Cleanup if needed, though not critical for these mocks
 
+# Nothing is archived unless a test says so, routes would otherwise ask the mocked database
+@pytest.fixture(autouse=True)
+def no_archive():
+    with patch('db.archived_before', return_value=None) as mock:
+        yield mock
+
 # Fixture for Flask test client
 @pytest.fixture
 def client():
     with app.test_client() as client:
         yield client
 
+# Pooled connection of the routes (db.get_db) and its cursor
+@pytest.fixture
+def mock_conn():
+    conn = MagicMock()
+    cursor = MagicMock()
+    conn.cursor.return_value = cursor
+    with patch('db.get_db', return_value=conn):
+        yield conn, cursor
+
+@pytest.fixture
+def mock_cursor(mock_conn):
+    yield mock_conn[1]
+
+# Statements run on a mocked cursor, in order
+def executed(cursor):
+    return [call[0][0] for call in cursor.execute.call_args_list]
+
 # Fixture to mock the database connection (replaces connect_db or get_db_connection)
 @pytest.fixture
 def mock_db_connection():
@@ -45,4 +68,17 @@ def mock_validate_time():
 @pytest.fixture
 def mock_requests_get():
     with patch('app.requests.get') as mock:
-        yield mock
\ No newline at end of file
+        yield mock
+
+# Connection to the real weight database with migrations applied, tests using
+# it are skipped when no database is reachable (e.g. outside docker compose)
+@pytest.fixture(scope="module")
+def real_db():
+    import db
+    try:
+        conn = db.connect_db()
+    except Exception:
+        pytest.skip("weight database not reachable")
+    db.migrate(conn)
+    yield conn
+    conn.close()
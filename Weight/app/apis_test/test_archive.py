@@ -0,0 +1,106 @@
+from datetime import datetime, date
+from unittest.mock import MagicMock
+import db
+from .conftest import executed
+
+
+def test_archive_sessions_moves_day_by_day():
+    conn = MagicMock()
+    cursor = conn.cursor.return_value
+    cursor.fetchone.side_effect = [
+        (1,),                                   # GET_LOCK
+        (datetime(2024, 1, 1),),                # archived_before
+        (datetime(2024, 1, 1, 9, 30),),         # first day with sessions
+        (datetime(2024, 1, 3, 7, 0),),          # next one
+        (datetime(2024, 2, 1, 7, 0),),          # past the cutoff
+    ]
+    cursor.fetchall.side_effect = [[(11,), (12,), (13,)], [(20,)], []]
+    cursor.rowcount = 2
+
+    report = db.archive_sessions(conn, datetime(2024, 1, 10, 15, 0), chunk_size=2)
+
+    assert report == {"sessions": 4, "transactions": 6, "archived_before": datetime(2024, 1, 10)}
+    queries = executed(cursor)
+    # Every "out" already added its session to the rollups
+    assert not any("daily_rollups" in q for q in queries)
+    cursor.execute.assert_any_call(db.ARCHIVE_DELETE_QUERY.format("%s,%s"), [11, 12, datetime(2024, 1, 2)])
+    cursor.execute.assert_any_call(db.ARCHIVE_DELETE_QUERY.format("%s"), [20, datetime(2024, 1, 4)])
+    watermarks = [call[0][1][0] for call in cursor.execute.call_args_list
+                  if call[0][0].startswith("UPDATE archive_state")]
+    assert watermarks == [datetime(2024, 1, 2), datetime(2024, 1, 4), datetime(2024, 1, 10)]
+    assert conn.commit.call_count == 3
+    assert queries[-1] == "SELECT RELEASE_LOCK('weight_archive')"
+
+
+def test_archive_sessions_already_done():
+    conn = MagicMock()
+    cursor = conn.cursor.return_value
+    cursor.fetchone.side_effect = [(1,), (datetime(2024, 3, 1),)]
+
+    report = db.archive_sessions(conn, datetime(2024, 2, 1))
+
+    assert report["sessions"] == 0
+    conn.commit.assert_not_called()
+
+
+def test_rebuild_sessions_keeps_archived_sessions():
+    conn = MagicMock()
+    cursor = conn.cursor.return_value
+    cursor.rowcount = 5
+
+    assert db.rebuild_sessions(conn) == 5
+
+    delete, rebuild = executed(cursor)
+    assert delete == "DELETE FROM sessions"
+    assert "FROM transactions_archive" in rebuild and "UNION ALL" in rebuild
+    conn.commit.assert_called_once()
+
+
+def test_item_merges_archived_days(client, mock_cursor, no_archive):
+    no_archive.return_value = datetime(2024, 1, 15)
+    mock_cursor.fetchone.side_effect = [
+        {"truck": "T-1"},
+        {"truck": "T-1", "truckTara": 900, "sessions": "30, 31"},
+        {"truckTara": 950, "sessions": "12,14,13"},
+    ]
+
+    response = client.get('/item/T-1?from=20240110120000&to=20240120000000')
+
+    assert response.status_code == 200
+    assert response.get_json() == {"truck": "T-1", "truckTara": 950, "sessions": "12, 13, 14, 30, 31"}
+    rollup = mock_cursor.execute.call_args_list[-1][0]
+    assert "FROM daily_rollups" in rollup[0]
+    assert rollup[1] == ("T-1", date(2024, 1, 10), date(2024, 1, 14))
+
+
+def test_item_only_in_rollups(client, mock_cursor, no_archive):
+    no_archive.return_value = datetime(2024, 1, 15)
+    mock_cursor.fetchone.side_effect = [None, {"truck": "T-1"}, None, {"truckTara": 950, "sessions": "12"}]
+
+    response = client.get('/item/T-1?from=20240101000000&to=20240105000000')
+
+    assert response.status_code == 200
+    assert response.get_json() == {"truck": "T-1", "truckTara": 950, "sessions": "12"}
+
+
+def test_item_after_horizon_skips_rollups(client, mock_cursor, no_archive):
+    no_archive.return_value = datetime(2024, 1, 15)
+    mock_cursor.fetchone.side_effect = [{"truck": "T-1"}, {"truck": "T-1", "truckTara": 900, "sessions": "30"}]
+
+    response = client.get('/item/T-1?from=20240120000000&to=20240121000000')
+
+    assert response.get_json() == {"truck": "T-1", "truckTara": 900, "sessions": "30"}
+    assert not any("daily_rollups" in q for q in executed(mock_cursor))
+
+
+def test_weight_page_spans_archive(client, mock_cursor, no_archive):
+    no_archive.return_value = datetime(2024, 1, 15)
+    mock_cursor.fetchall.return_value = [{"id": 5}, {"id": 40}]
+
+    response = client.get('/weight?from=20240101000000&to=20240131000000&limit=2&next=3')
+
+    assert response.get_json() == {"results": [{"id": 5}, {"id": 40}], "next": "40"}
+    query, params = mock_cursor.execute.call_args[0]
+    assert "FROM transactions_archive" in query
+    assert query.endswith(") ORDER BY id LIMIT %s")
+    assert params[-1] == 2 and params.count(3) == 2
@@ -0,0 +1,155 @@
+import pytest
+from unittest.mock import MagicMock, call
+import db
+from weight import app
+
+
+@pytest.fixture
+def mock_cursor(mock_cursor):
+    db.container_cache.invalidate()
+    with app.app_context():
+        yield mock_cursor
+    db.container_cache.invalidate()
+
+
+def test_container_data_uses_one_query(mock_cursor):
+    mock_cursor.fetchall.return_value = [
+        {"container_id": "C-1", "weight": 100},
+        {"container_id": "C-2", "weight": 250},
+    ]
+
+    assert db.container_data("C-1,C-2,C-3") == (350, ["C-3"])
+    assert mock_cursor.execute.call_count == 1
+    query, params = mock_cursor.execute.call_args[0]
+    assert "IN (%s,%s,%s)" in query
+    assert sorted(params) == ["C-1", "C-2", "C-3"]
+
+
+def test_container_data_served_from_cache(mock_cursor):
+    mock_cursor.fetchall.return_value = [{"container_id": "C-1", "weight": 100}]
+    db.container_data("C-1,C-9")
+    mock_cursor.execute.reset_mock()
+
+    assert db.container_data("C-1,C-9") == (100, ["C-9"])
+    mock_cursor.execute.assert_not_called()
+
+
+def test_container_data_null_weight_is_unresolved(mock_cursor):
+    mock_cursor.fetchall.return_value = [{"container_id": "C-1", "weight": None}, {"container_id": "C-2", "weight": 40}]
+
+    assert db.container_data("C-1,C-2") == (40, ["C-1"])
+
+
+def test_container_data_with_conn_bypasses_cache(mock_cursor):
+    # This worker cached C-2 without a weight, another one loaded it since
+    mock_cursor.fetchall.return_value = [{"container_id": "C-1", "weight": 100}, {"container_id": "C-2", "weight": None}]
+    db.container_data("C-1,C-2")
+    conn = MagicMock()
+    cursor = conn.cursor.return_value
+    cursor.fetchall.return_value = [("C-1", 120), ("C-2", 500)]
+
+    assert db.container_data("C-1,C-2,C-3", conn) == (620, ["C-3"])
+    query, params = cursor.execute.call_args[0]
+    assert query.endswith("IN (%s,%s,%s) FOR SHARE")
+    assert params == ["C-1", "C-2", "C-3"]
+    # Later cached lookups see the fresh weights without another query
+    mock_cursor.execute.reset_mock()
+    assert db.container_data("C-1,C-2") == (620, [])
+    mock_cursor.execute.assert_not_called()
+
+
+def test_recompute_pending_neto_in_bulk():
+    cursor = MagicMock()
+    cursor.fetchall.side_effect = [
+        [(101,), (102,), (103,)],                                       # pending on the loaded ids
+        [(103,)],                                                       # 103 still waits for another
+        [(101, 7, 1000, "C-1,C-2", 5000), (102, 8, 900, "C-1", 4000)],  # ready transactions
+        [("C-1", 300), ("C-2", 200)],
+    ]
+    cursor.rowcount = 2
+
+    report = db.recompute_pending_neto(cursor, ["C-1"])
+
+    assert report["transactions"] == 4 and report["sessions"] == 2 and report["rollups"] == 2
+    cursor.execute.assert_any_call(db.PENDING_RESOLVED_DELETE.format("%s,%s,%s"), [101, 102, 103])
+    cursor.execute.assert_any_call(db.PENDING_TRANSACTIONS_QUERY.format("%s,%s"), [101, 102, 101, 102])
+    cursor.execute.assert_any_call(db.NETO_SESSIONS_UPDATE, ('[[7, 3500], [8, 2800]]',))
+    cursor.execute.assert_any_call(db.NETO_TRANSACTIONS_UPDATE.format("transactions"), ('[[101, 3500], [102, 2800]]',))
+    queries = [call[0][0] for call in cursor.execute.call_args_list]
+    assert queries.index(db.NETO_ROLLUPS_UPDATE) < queries.index(db.NETO_SESSIONS_UPDATE)
+    cursor.executemany.assert_not_called()
+
+
+def test_recompute_pending_neto_keeps_cleared_weights_pending():
+    cursor = MagicMock()
+    cursor.fetchall.side_effect = [[(101,)], [], [(101, 7, 1000, "C-1,C-2", 5000)], [("C-1", 300), ("C-2", None)]]
+
+    report = db.recompute_pending_neto(cursor, ["C-1"])
+
+    assert report["transactions"] == 0
+    cursor.executemany.assert_called_once_with(db.PENDING_NETO_INSERT, [("C-2", 101, 7)])
+    assert db.NETO_SESSIONS_UPDATE not in [call[0][0] for call in cursor.execute.call_args_list]
+
+
+def test_recompute_pending_neto_nothing_pending():
+    cursor = MagicMock()
+    cursor.fetchall.return_value = []
+
+    assert db.recompute_pending_neto(cursor, ["C-1"])["transactions"] == 0
+    cursor.execute.assert_called_once()
+
+
+def test_container_cache_evicts_least_recently_used():
+    cache = db.ContainerCache(max_size=2)
+    cache.put_many({"C-1": 1, "C-2": 2})
+    cache.get_many(["C-1"])
+    cache.put_many({"C-3": 3})
+
+    found, missing = cache.get_many(["C-1", "C-2", "C-3"])
+
+    assert found == {"C-1": 1, "C-3": 3}
+    assert missing == ["C-2"]
+    assert cache.stats()["evictions"] == 1
+
+
+def test_container_cache_invalidate():
+    cache = db.ContainerCache()
+    cache.put_many({"C-1": 1, "C-2": db.UNREGISTERED})
+    cache.invalidate(["C-2"])
+
+    found, missing = cache.get_many(["C-1", "C-2"])
+
+    assert found == {"C-1": 1}
+    assert missing == ["C-2"]
+
+
+def test_record_unknown_containers_only_unregistered(mock_cursor):
+    mock_cursor.fetchall.return_value = [{"container_id": "C-1", "weight": 100}, {"container_id": "C-2", "weight": None}]
+    own_cursor = MagicMock()
+    own_cursor.rowcount = 1
+
+    db.record_unknown_containers(own_cursor, "C-1, C-2,C-3,C-3")
+
+    assert own_cursor.execute.call_args_list == [
+        call(db.UNKNOWN_REFERENCED_INSERT, ('["C-3"]',)),
+        call(db.UNKNOWN_VERSION_BUMP),
+    ]
+
+
+def test_record_unknown_containers_already_listed(mock_cursor):
+    mock_cursor.fetchall.return_value = []
+    own_cursor = MagicMock()
+    own_cursor.rowcount = 0
+
+    db.record_unknown_containers(own_cursor, "C-3")
+
+    own_cursor.execute.assert_called_once_with(db.UNKNOWN_REFERENCED_INSERT, ('["C-3"]',))
+
+
+def test_record_unknown_containers_all_known(mock_cursor):
+    mock_cursor.fetchall.return_value = [{"container_id": "C-1", "weight": 100}]
+    own_cursor = MagicMock()
+
+    db.record_unknown_containers(own_cursor, "C-1")
+
+    own_cursor.execute.assert_not_called()
@@ -0,0 +1,105 @@
+import threading
+import pytest
+from unittest.mock import MagicMock
+import db
+from weight import app
+
+
+def make_pool(**kwargs):
+    kwargs.setdefault("connect", lambda: MagicMock(in_transaction=False))
+    return db.ConnectionPool(**kwargs)
+
+
+def test_pool_reuses_returned_connection():
+    pool = make_pool(size=2, max_overflow=0)
+    conn = pool.acquire()
+    pool.release(conn)
+
+    assert pool.acquire() is conn
+    assert pool.stats()["open"] == 1
+
+
+def test_pool_overflow_is_closed_on_release():
+    pool = make_pool(size=1, max_overflow=1)
+    first = pool.acquire()
+    second = pool.acquire()
+    pool.release(first)
+    pool.release(second)
+
+    second.close.assert_called_once()
+    stats = pool.stats()
+    assert stats["open"] == 1
+    assert stats["idle"] == 1
+
+
+def test_pool_times_out_when_exhausted():
+    pool = make_pool(size=1, max_overflow=0, timeout=0)
+    pool.acquire()
+
+    with pytest.raises(db.PoolTimeout):
+        pool.acquire()
+
+
+def test_pool_replaces_dead_connection_on_borrow():
+    pool = make_pool(size=1, max_overflow=0)
+    dead = pool.acquire()
+    pool.release(dead)
+    dead.ping.side_effect = Exception("MySQL server has gone away")
+
+    fresh = pool.acquire()
+
+    assert fresh is not dead
+    dead.close.assert_called_once()
+    assert pool.stats()["invalidated"] == 1
+
+
+def test_pool_recycles_old_connections():
+    pool = make_pool(size=1, max_overflow=0, recycle=0)
+    old = pool.acquire()
+    pool.release(old)
+
+    assert pool.acquire() is not old
+    assert pool.stats()["recycled"] == 1
+
+
+def test_pool_rolls_back_open_transaction_on_release():
+    pool = make_pool(size=1, max_overflow=0)
+    conn = pool.acquire()
+    conn.in_transaction = True
+    pool.release(conn)
+
+    conn.rollback.assert_called_once()
+
+
+def test_pool_never_exceeds_limit_under_threads():
+    pool = make_pool(size=2, max_overflow=1, timeout=5)
+    peak = []
+    lock = threading.Lock()
+
+    def worker():
+        for _ in range(20):
+            conn = pool.acquire()
+            with lock:
+                peak.append(pool.stats()["checked_out"])
+            pool.release(conn)
+
+    threads = [threading.Thread(target=worker) for _ in range(8)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+
+    assert max(peak) <= 3
+    assert pool.stats()["checked_out"] == 0
+
+
+def test_request_connection_returned_at_teardown(monkeypatch):
+    pool = make_pool(size=1, max_overflow=0)
+    monkeypatch.setattr(db, "_pool", pool)
+
+    with app.test_client() as client:
+        response = client.get('/health')
+
+    assert response.status_code == 200
+    assert pool.stats()["checked_out"] == 0
+    assert pool.stats()["borrows"] == 1
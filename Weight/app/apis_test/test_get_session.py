@@ -0,0 +1,164 @@
+from decimal import Decimal
+from datetime import datetime, date
+import weight
+
+
+def test_get_session_single_row_lookup(client, mock_cursor):
+    row = {"session": 7, "truck": "T-1", "bruto": 5000, "produce": "orange", "truckTara": 1000, "neto": 3700}
+    mock_cursor.fetchone.return_value = row
+
+    response = client.get('/session/7')
+
+    assert response.status_code == 200
+    assert response.get_json() == row
+    mock_cursor.execute.assert_called_once()
+    query = mock_cursor.execute.call_args[0][0]
+    assert "FROM sessions WHERE session = %s" in query
+    assert "GROUP BY" not in query
+
+
+def test_get_session_not_found(client, mock_cursor):
+    mock_cursor.fetchone.return_value = None
+
+    response = client.get('/session/999')
+
+    assert response.status_code == 404
+
+
+def test_get_sessions_by_ids_chunked(client, mock_cursor, monkeypatch):
+    monkeypatch.setattr('weight.SESSION_CHUNK_SIZE', 2)
+    mock_cursor.fetchall.side_effect = [
+        [{"session": 1, "neto": 10}, {"session": 2, "neto": 20}],
+        [{"session": 4, "neto": 40}],
+    ]
+
+    response = client.post('/sessions', json={"ids": [1, 2, 3, 4, 2]})
+
+    assert response.status_code == 200
+    assert response.get_json() == {
+        "sessions": [{"session": 1, "neto": 10}, {"session": 2, "neto": 20}, {"session": 4, "neto": 40}],
+        "missing": [3],
+    }
+    assert mock_cursor.execute.call_count == 2
+
+
+def test_get_sessions_range(client, mock_cursor):
+    mock_cursor.fetchall.return_value = [{"session": 5}, {"session": 6}]
+
+    response = client.get('/sessions?from_id=5&to_id=8')
+
+    assert response.status_code == 200
+    assert response.get_json() == {"sessions": [{"session": 5}, {"session": 6}]}
+    assert mock_cursor.execute.call_args[0][1] == (5, 8)
+
+
+def test_get_sessions_over_cap(client, mock_cursor, monkeypatch):
+    monkeypatch.setattr('weight.MAX_BULK_SESSIONS', 3)
+
+    response = client.get('/sessions?ids=1,2,3,4')
+
+    assert response.status_code == 400
+    mock_cursor.execute.assert_not_called()
+
+
+def test_get_sessions_invalid_ids(client, mock_cursor):
+    response = client.get('/sessions?ids=1,abc')
+
+    assert response.status_code == 400
+
+
+def test_produce_totals_single_query(client, mock_cursor):
+    mock_cursor.fetchall.return_value = [
+        {"produce": "orange", "sessions": 3, "count": 2, "amount": 1200},
+        {"produce": "tomato", "sessions": 1, "count": 1, "amount": 300},
+    ]
+
+    response = client.get('/produce-totals?trucks=T-1,T-2&from=20240101000000&to=20240131235959')
+
+    assert response.status_code == 200
+    assert response.get_json() == {
+        "sessionCount": 4,
+        "products": [
+            {"produce": "orange", "sessions": 3, "count": 2, "amount": 1200},
+            {"produce": "tomato", "sessions": 1, "count": 1, "amount": 300},
+        ],
+    }
+    mock_cursor.execute.assert_called_once()
+    query, params = mock_cursor.execute.call_args[0]
+    assert "GROUP BY produce" in query
+    assert params[:2] == ["T-1", "T-2"]
+
+
+def test_produce_totals_post_without_trucks(client, mock_cursor):
+    response = client.post('/produce-totals', json={"trucks": [], "from": "20240101000000", "to": "20240131235959"})
+
+    assert response.status_code == 200
+    assert response.get_json() == {"sessionCount": 0, "products": []}
+    mock_cursor.execute.assert_not_called()
+
+
+def test_produce_totals_grouped_by_truck(client, mock_cursor):
+    mock_cursor.fetchall.return_value = [
+        {"truck": "T-1", "produce": "orange", "sessions": 2, "count": 2, "amount": 800},
+        {"truck": "T-1", "produce": "tomato", "sessions": 1, "count": 0, "amount": None},
+        {"truck": "T-2", "produce": "orange", "sessions": 1, "count": 1, "amount": 400},
+    ]
+
+    response = client.post('/produce-totals', json={
+        "trucks": ["T-1", "T-2", "T-3"], "from": "20240101000000", "to": "20240131235959", "group_by": "truck"})
+
+    assert response.status_code == 200
+    assert response.get_json() == {"trucks": {
+        "T-1": {"sessionCount": 3, "products": [
+            {"produce": "orange", "sessions": 2, "count": 2, "amount": 800},
+            {"produce": "tomato", "sessions": 1, "count": 0, "amount": 0},
+        ]},
+        "T-2": {"sessionCount": 1, "products": [
+            {"produce": "orange", "sessions": 1, "count": 1, "amount": 400},
+        ]},
+    }}
+    mock_cursor.execute.assert_called_once()
+    assert "GROUP BY truck, produce" in mock_cursor.execute.call_args[0][0]
+
+
+def test_produce_totals_invalid_group_by(client, mock_cursor):
+    response = client.get('/produce-totals?trucks=T-1&group_by=produce')
+
+    assert response.status_code == 400
+
+
+def test_produce_totals_windows_split_partial_days():
+    days, partial = weight.produce_totals_windows(datetime(2024, 1, 1, 12, 0), datetime(2024, 1, 31, 8, 0))
+
+    assert days == [(date(2024, 1, 2), date(2024, 1, 31))]
+    assert partial == [(datetime(2024, 1, 1, 12, 0), datetime(2024, 1, 1, 23, 59, 59)),
+                       (datetime(2024, 1, 31), datetime(2024, 1, 31, 8, 0))]
+
+
+def test_produce_totals_windows_within_one_day():
+    days, partial = weight.produce_totals_windows(datetime(2024, 1, 1, 8, 0), datetime(2024, 1, 1, 18, 0))
+
+    assert days == []
+    assert partial == [(datetime(2024, 1, 1, 8, 0), datetime(2024, 1, 1, 18, 0))]
+
+
+def test_produce_totals_rollups_plus_partial_days(client, mock_cursor):
+    mock_cursor.fetchall.side_effect = [
+        [{"produce": "orange", "sessions": Decimal(30), "count": Decimal(29), "amount": Decimal(90000)}],
+        [{"produce": "orange", "sessions": 1, "count": 1, "amount": 3000}, {"produce": None, "sessions": 1, "count": 0, "amount": None}],
+        [],
+    ]
+
+    response = client.get('/produce-totals?trucks=T-1&from=20240101120000&to=20240131080000')
+
+    assert response.get_json() == {
+        "sessionCount": 32,
+        "products": [
+            {"produce": "orange", "sessions": 31, "count": 30, "amount": 93000},
+            {"produce": "na", "sessions": 1, "count": 0, "amount": 0},
+        ],
+    }
+    queries = [call[0][0] for call in mock_cursor.execute.call_args_list]
+    assert "FROM daily_rollups" in queries[0]
+    assert all("FROM sessions" in query for query in queries[1:])
+    assert mock_cursor.execute.call_args_list[0][0][1] == ["T-1", date(2024, 1, 2), date(2024, 1, 31)]
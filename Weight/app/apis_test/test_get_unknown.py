@@ -0,0 +1,79 @@
+import db
+import weight
+
+
+def test_unknown_first_page(client, mock_cursor):
+    mock_cursor.fetchone.return_value = {"version": 7}
+    mock_cursor.fetchall.return_value = [{"container_id": "C-1"}, {"container_id": "C-2"}]
+
+    response = client.get('/unknown?limit=2')
+
+    assert response.status_code == 200
+    assert response.get_json() == {"id": ["C-1", "C-2"], "next": "C-2"}
+    assert mock_cursor.execute.call_args[0][1] == ("", 2)
+    assert response.headers["ETag"]
+
+
+def test_unknown_last_page(client, mock_cursor):
+    mock_cursor.fetchone.return_value = {"version": 7}
+    mock_cursor.fetchall.return_value = [{"container_id": "C-3"}]
+
+    response = client.get('/unknown?after=C-2&limit=2')
+
+    assert response.get_json() == {"id": ["C-3"], "next": None}
+    assert mock_cursor.execute.call_args[0][1] == ("C-2", 2)
+
+
+def test_unknown_not_modified_skips_list_query(client, mock_cursor):
+    mock_cursor.fetchone.return_value = {"version": 7}
+    mock_cursor.fetchall.return_value = [{"container_id": "C-1"}]
+    etag = client.get('/unknown').headers["ETag"]
+    mock_cursor.execute.reset_mock()
+
+    response = client.get('/unknown', headers={"If-None-Match": etag})
+
+    assert response.status_code == 304
+    assert response.get_data() == b""
+    mock_cursor.execute.assert_called_once_with(db.UNKNOWN_VERSION_QUERY)
+
+
+def test_unknown_version_change_refetches(client, mock_cursor):
+    mock_cursor.fetchone.return_value = {"version": 7}
+    mock_cursor.fetchall.return_value = [{"container_id": "C-1"}]
+    etag = client.get('/unknown').headers["ETag"]
+    mock_cursor.fetchone.return_value = {"version": 8}
+    mock_cursor.fetchall.return_value = [{"container_id": "C-1"}, {"container_id": "C-5"}]
+
+    response = client.get('/unknown', headers={"If-None-Match": etag})
+
+    assert response.status_code == 200
+    assert response.get_json()["id"] == ["C-1", "C-5"]
+    assert response.headers["ETag"] != etag
+
+
+def test_unknown_etag_depends_on_page(client, mock_cursor):
+    mock_cursor.fetchone.return_value = {"version": 7}
+    mock_cursor.fetchall.return_value = [{"container_id": "C-3"}]
+
+    first = client.get('/unknown?limit=2').headers["ETag"]
+    second = client.get('/unknown?after=C-2&limit=2').headers["ETag"]
+
+    assert first != second
+
+
+def test_unknown_without_version_row(client, mock_cursor):
+    mock_cursor.fetchone.return_value = None
+    mock_cursor.fetchall.return_value = [{"container_id": "C-1"}]
+
+    response = client.get('/unknown')
+
+    assert response.status_code == 200
+    assert "ETag" not in response.headers
+    mock_cursor.execute.assert_any_call(weight.UNKNOWN_QUERY, ("", 1000))
+
+
+def test_unknown_invalid_limit(client, mock_cursor):
+    response = client.get('/unknown?limit=0')
+
+    assert response.status_code == 400
+    mock_cursor.execute.assert_not_called()
@@ -0,0 +1,55 @@
+import json
+
+
+ROWS = [{"id": 11, "direction": "in", "bruto": 100, "neto": None, "produce": "orange", "containers": "C-1"},
+        {"id": 12, "direction": "out", "bruto": None, "neto": 50, "produce": None, "containers": "C-1"}]
+
+
+def test_get_weight_without_paging_returns_list(client, mock_cursor):
+    mock_cursor.fetchall.return_value = ROWS
+
+    response = client.get('/weight?from=20240101000000&to=20240102000000')
+
+    assert response.status_code == 200
+    assert response.get_json() == ROWS
+    query = mock_cursor.execute.call_args[0][0]
+    assert "LIMIT" not in query
+
+
+def test_get_weight_page_with_next_token(client, mock_cursor):
+    mock_cursor.fetchall.return_value = ROWS
+
+    response = client.get('/weight?from=20240101000000&to=20240102000000&limit=2&next=10')
+
+    assert response.status_code == 200
+    assert response.get_json() == {"results": ROWS, "next": "12"}
+    query, params = mock_cursor.execute.call_args[0]
+    assert "id > %s ORDER BY id LIMIT %s" in query
+    assert params[-2:] == [10, 2]
+
+
+def test_get_weight_last_page_has_no_next(client, mock_cursor):
+    mock_cursor.fetchall.return_value = ROWS[:1]
+
+    response = client.get('/weight?from=20240101000000&to=20240102000000&limit=2')
+
+    assert response.get_json()["next"] is None
+
+
+def test_get_weight_invalid_limit(client, mock_cursor):
+    response = client.get('/weight?limit=0')
+
+    assert response.status_code == 400
+
+
+def test_get_weight_ndjson_stream(client, mock_cursor):
+    mock_cursor.fetchmany.side_effect = [ROWS[:1], ROWS[1:], []]
+
+    response = client.get('/weight?from=20240101000000&to=20240102000000&format=ndjson')
+
+    assert response.status_code == 200
+    assert response.mimetype == 'application/x-ndjson'
+    lines = response.get_data(as_text=True).splitlines()
+    assert [json.loads(line) for line in lines] == ROWS
+    mock_cursor.fetchall.assert_not_called()
+    mock_cursor.close.assert_called_once()
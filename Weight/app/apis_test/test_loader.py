@@ -0,0 +1,115 @@
+import io
+import json
+import pytest
+from unittest.mock import MagicMock, patch
+import db
+import loader
+from weight import app
+
+
+@pytest.fixture
+def mock_conn():
+    conn = MagicMock()
+    conn.cursor.return_value = MagicMock()
+    return conn
+
+
+def upserts(conn):
+    return [call[0] for call in conn.cursor.return_value.execute.call_args_list
+            if "INSERT INTO containers_registered" in call[0][0]]
+
+
+def written_rows(conn):
+    rows = []
+    for _, params in upserts(conn):
+        rows.extend(tuple(params[i:i + 3]) for i in range(0, len(params), 3))
+    return rows
+
+
+def test_iter_json_array_across_small_reads(monkeypatch):
+    monkeypatch.setattr(loader, "READ_SIZE", 7)
+    data = [{"id": f"C-{i}", "weight": i * 10, "unit": "kg"} for i in range(50)]
+
+    assert list(loader.iter_json_array(io.StringIO(json.dumps(data)))) == data
+
+
+def test_iter_json_array_rejects_non_list():
+    with pytest.raises(ValueError):
+        list(loader.iter_json_array(io.StringIO('{"id": "C-1"}')))
+
+
+def test_iter_json_array_reports_line(monkeypatch):
+    monkeypatch.setattr(loader, "READ_SIZE", 7)
+    data = '[\n  {"id": "C-1", "weight": 10},\n  {"id": "C-2", "weight": 20},\n  {"id": "C-3", weight: 30}\n]'
+
+    with pytest.raises(loader.MalformedFile) as error:
+        list(loader.iter_json_array(io.StringIO(data)))
+    assert error.value.line == 4
+
+
+def test_load_malformed_json_keeps_loaded_rows(tmp_path, mock_conn):
+    path = tmp_path / "containers.json"
+    path.write_text('[{"id": "K-1", "weight": 10},\n{"id": "K-2", "weight": 20},\n{"id": "K-3" "weight": 30}]')
+
+    with pytest.raises(loader.MalformedFile) as error:
+        loader.load_file(mock_conn, str(path), chunk_size=1)
+
+    assert "containers.json at line 3" in str(error.value)
+    assert "2 rows before it were loaded" in str(error.value)
+    assert written_rows(mock_conn) == [("K-1", 10, "kg"), ("K-2", 20, "kg")]
+
+
+def test_batch_weight_malformed_json_is_bad_request():
+    error = loader.MalformedFile("Invalid JSON: Expecting ',' delimiter in containers.json at line 3, "
+                                 "2 rows before it were loaded", 3)
+    with app.test_client() as client, patch('os.path.isfile', return_value=True), \
+            patch('db.get_db'), patch('loader.load_file', side_effect=error):
+        response = client.post('/batch-weight', json={"file": "containers.json"})
+
+    assert response.status_code == 400
+    assert "containers.json at line 3" in response.get_json()["error"]
+
+
+def test_load_csv_in_chunks(tmp_path, mock_conn):
+    path = tmp_path / "containers.csv"
+    path.write_text('"id","lbs"\nC-1,100\nC-2,\n,300\nC-3,abc\nC-4,200\n')
+
+    report = loader.load_file(mock_conn, str(path), chunk_size=1)
+
+    assert report["rows"] == 3
+    assert report["rejected"] == 2
+    assert len(report["warnings"]) == 2
+    assert mock_conn.commit.call_count == 3
+    assert written_rows(mock_conn) == [("C-1", 45, "kg"), ("C-2", None, "kg"), ("C-4", 90, "kg")]
+    execute = mock_conn.cursor.return_value.execute
+    execute.assert_any_call(db.UNKNOWN_REGISTERED_UPSERT.format("(%s, 1)"), ["C-2"])
+    execute.assert_any_call(db.UNKNOWN_RESOLVED_DELETE.format("%s"), ["C-4"])
+    execute.assert_any_call(db.UNKNOWN_VERSION_BUMP)
+    execute.assert_any_call(db.PENDING_FOR_CONTAINERS_QUERY.format("%s"), ["C-4"])
+    assert report["recomputed"]["transactions"] == 0
+
+
+def test_load_json_multi_row_upsert(tmp_path, mock_conn):
+    path = tmp_path / "containers.json"
+    path.write_text(json.dumps([
+        {"id": "K-1", "weight": 10, "unit": "kg"},
+        {"id": "K-2", "weight": 100, "unit": "lbs"},
+        {"weight": 5, "unit": "kg"},
+    ]))
+
+    report = loader.load_file(mock_conn, str(path), chunk_size=1000)
+
+    assert report["rows"] == 2
+    assert report["rejected"] == 1
+    mock_conn.commit.assert_called_once()
+    [(query, _)] = upserts(mock_conn)
+    assert query.count("(%s, %s, %s)") == 2
+    assert written_rows(mock_conn) == [("K-1", 10, "kg"), ("K-2", 45, "kg")]
+
+
+def test_load_unsupported_file(tmp_path, mock_conn):
+    path = tmp_path / "containers.txt"
+    path.write_text("C-1")
+
+    with pytest.raises(loader.UnsupportedFile):
+        loader.load_file(mock_conn, str(path))
@@ -0,0 +1,44 @@
+import os
+from unittest.mock import MagicMock
+import db
+
+
+def test_split_statements_skips_comments():
+    sql = """
+    -- comment; with a semicolon
+    CREATE TABLE a (id int);
+
+    INSERT INTO a VALUES (1);
+    """
+
+    assert db.split_statements(sql) == ["CREATE TABLE a (id int)", "INSERT INTO a VALUES (1)"]
+
+
+def test_migrate_applies_only_pending(tmp_path, monkeypatch):
+    (tmp_path / "001_first.sql").write_text("CREATE TABLE a (id int);")
+    (tmp_path / "002_second.sql").write_text("CREATE TABLE b (id int);\nCREATE TABLE c (id int);")
+    (tmp_path / "README").write_text("not a migration")
+    monkeypatch.setattr(db, "MIGRATIONS_DIR", str(tmp_path))
+
+    conn = MagicMock()
+    cursor = conn.cursor.return_value
+    cursor.with_rows = False
+    cursor.fetchone.return_value = (1,)
+    cursor.fetchall.return_value = [("001_first",)]
+
+    assert db.migrate(conn) == ["002_second"]
+
+    queries = [call[0][0] for call in cursor.execute.call_args_list]
+    assert "CREATE TABLE a (id int)" not in queries
+    assert "CREATE TABLE b (id int)" in queries
+    assert "CREATE TABLE c (id int)" in queries
+    cursor.execute.assert_any_call("INSERT INTO schema_migrations (version, applied_at) VALUES (%s, NOW())", ("002_second",))
+    assert queries[-1] == "SELECT RELEASE_LOCK('weight_migrations')"
+    conn.commit.assert_called_once()
+
+
+def test_migrations_are_ordered():
+    files = [name for name in os.listdir(db.MIGRATIONS_DIR) if name.endswith(".sql")]
+
+    assert files
+    assert all(name[:3].isdigit() for name in files)
@@ -0,0 +1,78 @@
+from datetime import datetime
+from unittest.mock import MagicMock
+import pytest
+import db
+from .conftest import executed
+
+
+def partition_cursor(names, oldest=None):
+    conn = MagicMock()
+    cursor = conn.cursor.return_value
+    cursor.fetchone.side_effect = [(1,), (oldest,)]
+    cursor.fetchall.return_value = [(name,) for name in names]
+    return conn, cursor
+
+
+def test_add_months_crosses_years():
+    assert db.add_months(datetime(2024, 11, 1), 3) == datetime(2025, 2, 1)
+    assert db.add_months(datetime(2024, 1, 1), -1) == datetime(2023, 12, 1)
+
+
+def test_ensure_partitions_starts_at_oldest_data():
+    conn, cursor = partition_cursor(["p_future"], oldest=datetime(2024, 1, 15, 8, 30))
+
+    created = db.ensure_partitions(conn, months_ahead=1, now=datetime(2024, 3, 10))
+
+    assert created == ["p202401", "p202402", "p202403", "p202404"]
+    reorganize = next(q for q in executed(cursor) if q.startswith("ALTER TABLE"))
+    assert "REORGANIZE PARTITION p_future" in reorganize
+    assert "PARTITION p202401 VALUES LESS THAN ('2024-02-01')" in reorganize
+    assert "PARTITION p202404 VALUES LESS THAN ('2024-05-01')" in reorganize
+    assert reorganize.endswith("PARTITION p_future VALUES LESS THAN (MAXVALUE))")
+    assert executed(cursor)[-1] == "SELECT RELEASE_LOCK('weight_partitions')"
+
+
+def test_ensure_partitions_only_adds_upcoming_months():
+    conn, cursor = partition_cursor(["p202401", "p202402", "p202403", "p_future"])
+
+    created = db.ensure_partitions(conn, months_ahead=2, now=datetime(2024, 3, 10))
+
+    assert created == ["p202404", "p202405"]
+    assert db.FIRST_PARTITION_QUERY not in executed(cursor)
+
+
+def test_ensure_partitions_up_to_date():
+    conn, cursor = partition_cursor(["p202401", "p202402", "p202403", "p_future"])
+
+    assert db.ensure_partitions(conn, months_ahead=0, now=datetime(2024, 3, 31)) == []
+    assert not any(q.startswith("ALTER TABLE") for q in executed(cursor))
+
+
+def test_ensure_partitions_without_partitioning():
+    conn, cursor = partition_cursor([])
+
+    assert db.ensure_partitions(conn) == []
+    assert not any(q.startswith("ALTER TABLE") for q in executed(cursor))
+
+
+def test_detach_partitions_exchanges_old_months():
+    conn, cursor = partition_cursor(["p202401", "p202402", "p202403", "p_future"])
+    cursor.fetchone.side_effect = [(1,), (0,), (0,)]
+
+    detached = db.detach_partitions(conn, datetime(2024, 3, 1))
+
+    assert detached == ["transactions_p202401", "transactions_p202402"]
+    queries = executed(cursor)
+    assert "ALTER TABLE transactions EXCHANGE PARTITION p202401 WITH TABLE transactions_p202401" in queries
+    assert "ALTER TABLE transactions DROP PARTITION p202402" in queries
+    assert not any("p202403" in q for q in queries)
+
+
+def test_detach_partitions_keeps_open_sessions():
+    conn, cursor = partition_cursor(["p202401", "p202402", "p_future"])
+    cursor.fetchone.side_effect = [(1,), (2,)]
+
+    with pytest.raises(RuntimeError):
+        db.detach_partitions(conn, datetime(2024, 3, 1))
+    assert not any("EXCHANGE PARTITION" in q for q in executed(cursor))
+    assert executed(cursor)[-1] == "SELECT RELEASE_LOCK('weight_partitions')"
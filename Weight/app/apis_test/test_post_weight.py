@@ -0,0 +1,240 @@
+import pytest
+from unittest.mock import patch, MagicMock
+import mysql.connector
+from datetime import datetime, timedelta
+import db
+import weight
+from .conftest import executed
+
+
+@pytest.fixture
+def mock_conn(mock_conn):
+    conn, cursor = mock_conn
+    cursor.lastrowid = 77
+    with patch('db.allocate_session_id', return_value=42):
+        yield conn, cursor
+
+
+def test_in_opens_session(client, mock_conn):
+    conn, cursor = mock_conn
+    cursor.fetchone.return_value = None
+
+    response = client.post('/weight', json={"direction": "in", "truck": "T-1", "containers": "C-1",
+                                            "weight": 5000, "produce": "orange"})
+
+    assert response.status_code == 200
+    assert response.get_json() == {"session": 42, "truck": "T-1", "bruto": 5000}
+    queries = executed(cursor)
+    assert queries[0].startswith("SELECT session, transaction_id, bruto, datetime FROM open_sessions")
+    assert any(q.startswith("INSERT INTO open_sessions") for q in queries)
+    assert any(q.startswith("INSERT INTO sessions") for q in queries)
+    assert not any("NOT IN" in q for q in queries)
+    conn.commit.assert_called_once()
+
+
+def test_in_with_open_session_rejected(client, mock_conn):
+    conn, cursor = mock_conn
+    cursor.fetchone.return_value = {"session": 7, "transaction_id": 3}
+
+    response = client.post('/weight', json={"direction": "in", "truck": "T-1", "containers": "C-1",
+                                            "weight": 5000, "produce": "orange"})
+
+    assert response.status_code == 500
+    conn.commit.assert_not_called()
+
+
+def test_in_race_on_open_session_rejected(client, mock_conn):
+    conn, cursor = mock_conn
+    cursor.fetchone.return_value = None
+    cursor.execute.side_effect = [None, mysql.connector.IntegrityError("Duplicate entry")]
+
+    response = client.post('/weight', json={"direction": "in", "truck": "T-1", "containers": "C-1",
+                                            "weight": 5000, "produce": "orange"})
+
+    assert response.status_code == 500
+    conn.rollback.assert_called_once()
+    conn.commit.assert_not_called()
+
+
+def test_forced_in_updates_within_its_partition(client, mock_conn):
+    conn, cursor = mock_conn
+    started = datetime(2024, 1, 5, 8, 0)
+    cursor.fetchone.return_value = {"session": 7, "transaction_id": 3, "bruto": 4000, "datetime": started}
+
+    response = client.post('/weight', json={"direction": "in", "truck": "T-1", "containers": "C-1",
+                                            "weight": 5000, "produce": "orange", "force": True})
+
+    assert response.status_code == 200
+    update = next(call[0] for call in cursor.execute.call_args_list if call[0][0].startswith("UPDATE transactions"))
+    assert update[0].endswith("WHERE id = %s AND datetime = %s")
+    assert update[1][-2:] == (3, started)
+    conn.commit.assert_called_once()
+
+
+def test_none_looks_at_recent_months_first(client, mock_conn):
+    conn, cursor = mock_conn
+    cursor.fetchone.side_effect = [None, {"direction": "in"}]
+
+    response = client.post('/weight', json={"direction": "none", "truck": "na", "containers": "C-1",
+                                            "weight": 100, "produce": "na"})
+
+    assert response.status_code == 500
+    bounds = [call[0][1][0] for call in cursor.execute.call_args_list if call[0][0] == weight.LAST_DIRECTION_QUERY]
+    assert bounds[0] > datetime.now() - timedelta(days=62)
+    assert bounds[1] == datetime(1970, 1, 1)
+
+
+def test_backfill_skips_weighings_without_truck():
+    conn = MagicMock()
+    cursor = conn.cursor.return_value
+    cursor.fetchone.return_value = (3,)
+
+    assert db.backfill_open_sessions(conn) == 3
+
+    cursor.execute.assert_any_call(db.BACKFILL_OPEN_SESSIONS_QUERY)
+    assert "t.truck IS NOT NULL AND t.truck <> ''" in db.BACKFILL_OPEN_SESSIONS_QUERY
+    conn.commit.assert_called_once()
+
+
+def test_out_closes_session(client, mock_conn):
+    conn, cursor = mock_conn
+    cursor.fetchone.return_value = {"session": 7, "bruto": 5000}
+
+    with patch('db.container_data', return_value=(300, [])):
+        response = client.post('/weight', json={"direction": "out", "truck": "T-1", "containers": "C-1",
+                                                "weight": 1000, "produce": "orange"})
+
+    assert response.status_code == 200
+    assert response.get_json()["neto"] == 3700
+    cursor.execute.assert_any_call("DELETE FROM open_sessions WHERE truck = %s", ("T-1",))
+    assert any(q.startswith("UPDATE sessions SET truckTara") for q in executed(cursor))
+    cursor.execute.assert_any_call(db.ROLLUP_SESSION_QUERY, (7,))
+    conn.commit.assert_called_once()
+
+
+def test_out_with_unresolved_containers_leaves_neto_pending(client, mock_conn):
+    conn, cursor = mock_conn
+    cursor.fetchone.return_value = {"session": 7, "bruto": 5000}
+
+    with patch('db.container_data', return_value=(300, ["C-2", "C-3"])) as container_data:
+        response = client.post('/weight', json={"direction": "out", "truck": "T-1", "containers": "C-1,C-2,C-3",
+                                                "weight": 1000, "produce": "orange"})
+
+    assert response.status_code == 200
+    assert response.get_json()["neto"] == "na"
+    # Read in the weighing's own transaction, not from the cache
+    container_data.assert_called_once_with("C-1,C-2,C-3", conn)
+    insert = next(call[0] for call in cursor.execute.call_args_list if call[0][0].startswith("INSERT INTO transactions"))
+    assert insert[1][-1] is None
+    cursor.executemany.assert_called_once_with(db.PENDING_NETO_INSERT, [("C-2", 77, 7), ("C-3", 77, 7)])
+    conn.commit.assert_called_once()
+
+
+def test_batch_applies_readings_in_one_transaction(client, mock_conn):
+    conn, cursor = mock_conn
+    cursor.fetchone.side_effect = [None, {"session": 42, "bruto": 5000}]
+
+    with patch('db.container_data', return_value=(300, [])):
+        response = client.post('/weight/batch', json=[
+            {"direction": "in", "truck": "T-1", "containers": "C-1", "weight": 5000, "produce": "orange"},
+            {"direction": "out", "truck": "T-1", "containers": "C-1", "weight": 1000, "produce": "orange",
+             "datetime": "20240105120000"},
+        ])
+
+    assert response.status_code == 200
+    body = response.get_json()
+    assert body["applied"] == 2 and body["failed"] == 0
+    assert body["results"][0]["session"] == 42
+    assert body["results"][1]["neto"] == 3700
+    queries = executed(cursor)
+    assert queries.count("SAVEPOINT reading") == 2
+    assert "ROLLBACK TO SAVEPOINT reading" not in queries
+    cursor.execute.assert_any_call("UPDATE sessions SET truckTara = %s, neto = %s, out_datetime = %s WHERE session = %s",
+                                   (1000, 3700, "2024-01-05 12:00:00", 42))
+    conn.commit.assert_called_once()
+
+
+def test_batch_rejected_reading_rolls_back_to_savepoint(client, mock_conn):
+    conn, cursor = mock_conn
+    cursor.fetchone.side_effect = [{"session": 7, "transaction_id": 3}, None]
+
+    response = client.post('/weight/batch', json={"readings": [
+        {"direction": "in", "truck": "T-1", "containers": "C-1", "weight": 5000, "produce": "orange"},
+        {"direction": "in", "truck": "T-2", "containers": "C-2", "weight": 4000, "produce": "tomato"},
+        {"direction": "in", "truck": "T-3"},
+    ]})
+
+    body = response.get_json()
+    assert [r["ok"] for r in body["results"]] == [False, True, False]
+    assert body["results"][0]["status"] == 500
+    assert body["results"][2]["status"] == 400
+    assert executed(cursor).count("ROLLBACK TO SAVEPOINT reading") == 1
+    conn.commit.assert_called_once()
+    conn.rollback.assert_not_called()
+
+
+def test_batch_malformed_reading_fails_alone(client, mock_conn):
+    conn, cursor = mock_conn
+    cursor.fetchone.return_value = None
+    reading = {"direction": "in", "truck": "T-1", "containers": "C-1", "weight": 5000, "produce": "orange"}
+
+    response = client.post('/weight/batch', json=[
+        reading,
+        dict(reading, truck="T-2", unit="lbs", weight="abc"),
+        dict(reading, truck="T-3", unit=5),
+        dict(reading, truck="T-4"),
+    ])
+
+    assert response.status_code == 200
+    body = response.get_json()
+    assert [r["ok"] for r in body["results"]] == [True, False, False, True]
+    assert body["results"][1] == {"index": 1, "status": 400, "ok": False, "error": "Weight must be a whole number"}
+    assert body["results"][2] == {"index": 2, "status": 400, "ok": False, "error": "Unit must be kg or lbs"}
+    conn.commit.assert_called_once()
+
+
+def test_batch_unexpected_error_fails_only_its_reading(client, mock_conn):
+    conn, cursor = mock_conn
+    reading = {"direction": "in", "truck": "T-1", "containers": "C-1", "weight": 5000, "produce": "orange"}
+
+    with patch('weight.apply_reading', side_effect=[({"session": 1}, 200), KeyError("bruto"), ({"session": 3}, 200)]):
+        response = client.post('/weight/batch', json=[reading] * 3)
+
+    body = response.get_json()
+    assert [r["ok"] for r in body["results"]] == [True, False, True]
+    assert body["results"][1]["status"] == 500 and "bruto" in body["results"][1]["error"]
+    assert executed(cursor).count("ROLLBACK TO SAVEPOINT reading") == 1
+    conn.commit.assert_called_once()
+    conn.rollback.assert_not_called()
+
+
+def test_batch_commits_per_chunk(client, mock_conn):
+    conn, cursor = mock_conn
+    cursor.fetchone.return_value = None
+    reading = {"direction": "in", "truck": "T-1", "containers": "C-1", "weight": 5000, "produce": "orange"}
+
+    with patch('weight.READING_CHUNK_SIZE', 2):
+        response = client.post('/weight/batch', json=[reading] * 5)
+
+    assert response.get_json()["applied"] == 5
+    assert conn.commit.call_count == 3
+
+
+def test_batch_database_error_stops_remaining_readings(client, mock_conn):
+    conn, cursor = mock_conn
+    cursor.execute.side_effect = mysql.connector.OperationalError("Lost connection")
+    reading = {"direction": "in", "truck": "T-1", "containers": "C-1", "weight": 5000, "produce": "orange"}
+
+    response = client.post('/weight/batch', json=[reading, reading])
+
+    body = response.get_json()
+    assert body["failed"] == 2
+    assert all("chunk rolled back" in r["error"] for r in body["results"])
+    conn.rollback.assert_called_once()
+    conn.commit.assert_not_called()
+
+
+def test_batch_rejects_empty_payload(client, mock_conn):
+    response = client.post('/weight/batch', json=[])
+
+    assert response.status_code == 400
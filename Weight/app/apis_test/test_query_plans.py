@@ -0,0 +1,79 @@
+import pytest
+from datetime import datetime, timedelta
+import db
+import weight
+
+FROM = datetime(2024, 1, 1)
+TO = datetime(2024, 1, 31, 23, 59, 59)
+
+# Every read path of the routes, with representative parameters
+ROUTE_QUERIES = [
+    ("get_item exists", weight.ITEM_EXISTS_QUERY, ("plan-truck-1",)),
+    ("get_item", weight.ITEM_QUERY, (FROM, TO, "plan-truck-1")),
+    ("get_item archived exists", weight.ITEM_ROLLUP_EXISTS_QUERY, ("plan-truck-1",)),
+    ("get_item archived", weight.ITEM_ROLLUP_QUERY, ("plan-truck-1", FROM.date(), TO.date())),
+    ("get_session", weight.SESSION_QUERY, (900001,)),
+    ("get_sessions ids", weight.SESSIONS_IN_QUERY.format("%s,%s,%s"), (900001, 900002, 900005)),
+    ("get_sessions range", weight.SESSIONS_RANGE_QUERY, (900001, 900050)),
+    ("get_weight", weight.WEIGHT_QUERY.format("%s,%s"), (FROM, TO, "in", "out")),
+    ("get_weight page", weight.WEIGHT_QUERY.format("%s,%s") + " AND id > %s ORDER BY id LIMIT %s",
+     (FROM, TO, "in", "out", 0, 100)),
+    ("get_weight archived", weight.WEIGHT_ARCHIVE_QUERY.format("%s,%s"), (FROM, TO, "in", "out")),
+    ("info_insert none", weight.LAST_DIRECTION_QUERY, (FROM,)),
+    ("info_insert open session", weight.OPEN_SESSION_QUERY, ("plan-truck-1",)),
+    ("get_unknown version", db.UNKNOWN_VERSION_QUERY, ()),
+    ("get_unknown", weight.UNKNOWN_QUERY, ("", 100)),
+    ("get_produce_totals rollups", weight.PRODUCE_ROLLUP_TOTALS_QUERY.format("%s,%s"),
+     ("plan-truck-1", "plan-truck-2", FROM.date(), TO.date())),
+    ("get_produce_totals_by_truck rollups", weight.PRODUCE_ROLLUP_TOTALS_BY_TRUCK_QUERY.format("%s,%s"),
+     ("plan-truck-1", "plan-truck-2", FROM.date(), TO.date())),
+    ("get_produce_totals", weight.PRODUCE_TOTALS_QUERY.format("%s,%s"), ("plan-truck-1", "plan-truck-2", FROM, TO)),
+    ("get_produce_totals_by_truck", weight.PRODUCE_TOTALS_BY_TRUCK_QUERY.format("%s,%s"), ("plan-truck-1", "plan-truck-2", FROM, TO)),
+]
+
+
+@pytest.fixture(scope="module")
+def seeded_db(real_db):
+    cursor = real_db.cursor()
+    rows = []
+    for i in range(300):
+        rows.append((FROM + timedelta(hours=i), "in", f"plan-truck-{i % 30}", 900000 + i))
+    cursor.executemany("INSERT INTO transactions (datetime, direction, truck, session) VALUES (%s, %s, %s, %s)", rows)
+    # /sessions and /produce-totals read the sessions summary
+    cursor.executemany("INSERT INTO sessions (session, truck, in_datetime, out_datetime) VALUES (%s, %s, %s, %s)",
+                       [(session, truck, when, when + timedelta(minutes=30)) for when, _, truck, session in rows])
+    real_db.commit()
+    cursor.execute("ANALYZE TABLE transactions, sessions, containers_registered")
+    cursor.fetchall()
+    db.ensure_partitions(real_db)
+    yield real_db
+    cursor.execute("DELETE FROM transactions WHERE truck LIKE 'plan-truck-%'")
+    cursor.execute("DELETE FROM sessions WHERE truck LIKE 'plan-truck-%'")
+    real_db.commit()
+    cursor.close()
+
+
+@pytest.mark.parametrize("name,query,params", ROUTE_QUERIES, ids=[q[0] for q in ROUTE_QUERIES])
+def test_route_query_uses_index(seeded_db, name, query, params):
+    cursor = seeded_db.cursor(dictionary=True)
+    cursor.execute("EXPLAIN " + query, params)
+    plan = cursor.fetchall()
+    cursor.close()
+    seeded_db.rollback()
+
+    full_scans = [row["table"] for row in plan if row["type"] == "ALL"]
+    assert not full_scans, f"{name} does a full table scan on {full_scans}"
+
+
+# Date-bounded reads of transactions must be pruned to the months they cover
+@pytest.mark.parametrize("name,query,params", [q for q in ROUTE_QUERIES if q[0] in ("get_item", "get_weight")],
+                         ids=["get_item", "get_weight"])
+def test_date_bounded_query_prunes_partitions(seeded_db, name, query, params):
+    cursor = seeded_db.cursor(dictionary=True)
+    cursor.execute("EXPLAIN " + query, params)
+    plan = cursor.fetchall()
+    cursor.close()
+    seeded_db.rollback()
+
+    partitions = [row["partitions"] for row in plan if row["table"] == "transactions"]
+    assert partitions and all(p and "p_future" not in p for p in partitions), f"{name} reads {partitions}"
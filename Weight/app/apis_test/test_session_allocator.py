@@ -0,0 +1,117 @@
+import threading
+import multiprocessing
+import pytest
+import db
+
+
+# Mimics the sequences table: the UPDATE ... LAST_INSERT_ID() is atomic on the server
+class FakeSequenceServer:
+    def __init__(self, start=0):
+        self.next_id = start
+        self.lock = threading.Lock()
+        self.updates = 0
+
+    def connect(self):
+        server = self
+
+        class Cursor:
+            rowcount = 1
+
+            def execute(self, query, params=()):
+                if query.startswith("UPDATE sequences"):
+                    with server.lock:
+                        server.next_id += params[0]
+                        server.updates += 1
+                        self.last = server.next_id
+
+            def fetchone(self):
+                return (self.last,)
+
+            def close(self):
+                pass
+
+        class Conn:
+            in_transaction = False
+
+            def cursor(self):
+                return Cursor()
+
+            def commit(self):
+                pass
+
+            def ping(self, reconnect=False):
+                pass
+
+            def close(self):
+                pass
+
+        return Conn()
+
+
+@pytest.fixture
+def fake_server(monkeypatch):
+    server = FakeSequenceServer()
+    monkeypatch.setattr(db, "_pool", db.ConnectionPool(size=4, max_overflow=4, connect=server.connect))
+    return server
+
+
+def allocate_concurrently(allocators, per_thread):
+    results = []
+    lock = threading.Lock()
+
+    def worker(allocator):
+        ids = [allocator.allocate() for _ in range(per_thread)]
+        with lock:
+            results.extend(ids)
+
+    threads = [threading.Thread(target=worker, args=(allocators[i % len(allocators)],)) for i in range(16)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    return results
+
+
+def test_allocator_ids_are_sequential(fake_server):
+    allocator = db.SessionAllocator()
+
+    assert [allocator.allocate() for _ in range(3)] == [1, 2, 3]
+
+
+def test_allocator_concurrent_ids_are_unique(fake_server):
+    results = allocate_concurrently([db.SessionAllocator()], per_thread=50)
+
+    assert len(results) == len(set(results)) == 800
+    assert sorted(results) == list(range(1, 801))
+
+
+def test_allocator_blocks_across_workers_are_unique(fake_server):
+    # Several allocators stand in for separate worker processes sharing one database
+    workers = [db.SessionAllocator(block_size=10) for _ in range(4)]
+
+    results = allocate_concurrently(workers, per_thread=25)
+
+    assert len(results) == len(set(results)) == 400
+    assert fake_server.updates <= 400 // 10 + len(workers)
+
+
+def _allocate_in_process(count, queue):
+    allocator = db.SessionAllocator(block_size=5)
+    queue.put([allocator.allocate() for _ in range(count)])
+
+
+def test_allocator_unique_across_processes_on_real_db():
+    try:
+        db.connect_db().close()
+    except Exception:
+        pytest.skip("weight database not reachable")
+
+    queue = multiprocessing.Queue()
+    processes = [multiprocessing.Process(target=_allocate_in_process, args=(40, queue)) for _ in range(4)]
+    for p in processes:
+        p.start()
+    results = [session for _ in processes for session in queue.get(timeout=30)]
+    for p in processes:
+        p.join()
+
+    assert len(results) == len(set(results)) == 160
@@ -0,0 +1,236 @@
+import json
+import os
+import time
+import pytest
+from unittest.mock import patch, MagicMock
+import spool
+import weight
+from weight import app
+
+
+@pytest.fixture
+def make_spool(tmp_path):
+    spools = []
+
+    def make(**kwargs):
+        kwargs.setdefault("settle", 0)
+        s = spool.Spool(str(tmp_path), **kwargs)
+        spools.append(s)
+        return s
+
+    yield make
+    for s in spools:
+        s.close()
+
+
+class FakeStore:
+    """Stands in for the database side: committed offsets and applied readings."""
+
+    def __init__(self, reject=()):
+        self.offsets = {}
+        self.applied = []
+        self.forgotten = []
+        self.reject = reject
+        self.fail = False
+
+    def load(self):
+        return dict(self.offsets)
+
+    def apply(self, records, offsets):
+        if self.fail:
+            raise RuntimeError("database went away")
+        self.applied.extend(record["n"] for record in records)
+        self.offsets.update(offsets)
+        return [record for record in records if record["n"] in self.reject]
+
+    def forget(self, segment):
+        self.forgotten.append(segment)
+        self.offsets.pop(segment, None)
+
+
+def drain_all(s, store, offsets):
+    while s.drain_once(offsets, store.apply, store.forget):
+        pass
+
+
+def test_append_is_durable_and_drained_in_order(make_spool):
+    s = make_spool(batch_size=2)
+    store = FakeStore()
+    for n in range(5):
+        assert s.append({"n": n}).endswith(tuple("0123456789"))
+
+    offsets = store.load()
+    drain_all(s, store, offsets)
+
+    assert store.applied == [0, 1, 2, 3, 4]
+    assert s.batches == 3
+
+
+def test_records_of_all_writers_merged_by_time(make_spool):
+    first, second = make_spool(), make_spool()
+    first.append({"n": 0})
+    second.append({"n": 1})
+    first.append({"n": 2})
+    store = FakeStore()
+
+    drain_all(first, store, store.load())
+
+    assert store.applied == [0, 1, 2]
+
+
+def test_recent_records_wait_for_settle(make_spool):
+    s = make_spool(settle=60)
+    s.append({"n": 0})
+    store = FakeStore()
+
+    assert s.drain_once(store.load(), store.apply, store.forget) == 0
+    assert store.applied == []
+
+
+def test_failed_batch_is_retried_from_committed_offsets(make_spool, tmp_path):
+    s = make_spool(batch_size=2)
+    for n in range(4):
+        s.append({"n": n})
+    store = FakeStore()
+    s.drain_once(store.load(), store.apply, store.forget)
+    store.fail = True
+    with pytest.raises(RuntimeError):
+        s.drain_once(store.load(), store.apply, store.forget)
+    s.close()
+
+    # A restarted process picks up at the last committed offset
+    store.fail = False
+    restarted = make_spool(batch_size=2)
+    drain_all(restarted, store, store.load())
+
+    assert store.applied == [0, 1, 2, 3]
+
+
+def test_closed_segment_removed_once_drained(make_spool, tmp_path):
+    old = make_spool()
+    old.append({"n": 0})
+    old.close()
+    active = make_spool()
+    active.append({"n": 1})
+    store = FakeStore()
+
+    drain_all(active, store, store.load())
+
+    assert store.applied == [0, 1]
+    assert len(store.forgotten) == 1
+    assert active.segments() == [active._segment]
+
+
+def test_torn_tail_of_dead_writer_is_dropped(make_spool, tmp_path):
+    s = make_spool()
+    s.append({"n": 0})
+    segment = s._segment
+    s.close()
+    with open(tmp_path / segment, "a") as f:
+        f.write('{"n": 1, "at"')
+    store = FakeStore()
+
+    drain_all(s, store, store.load())
+
+    assert store.applied == [0]
+    assert store.forgotten == [segment]
+    assert not os.path.exists(tmp_path / segment)
+
+
+def test_rejected_records_are_kept(make_spool, tmp_path):
+    s = make_spool()
+    s.append({"n": 0})
+    s.append({"n": 1})
+    store = FakeStore(reject=(1,))
+
+    drain_all(s, store, store.load())
+
+    rejected = [json.loads(line) for line in open(tmp_path / spool.REJECTED_FILE)]
+    assert [r["n"] for r in rejected] == [1]
+    assert s.rejected == 1
+
+
+def test_status_reports_depth_and_lag(make_spool):
+    s = make_spool(settle=60)
+    s.append({"n": 0})
+    s.append({"n": 1})
+
+    s.write_status({})
+    stats = s.stats()
+
+    assert stats["depth"] == 2
+    assert stats["lag_seconds"] >= 0
+    assert stats["appended"] == 2
+
+
+def test_post_weight_queues_reading(make_spool):
+    s = make_spool()
+    with app.test_client() as client, patch('weight.reading_spool', s), \
+            patch('db.allocate_session_id') as allocate, patch('db.get_db') as get_db:
+        response = client.post('/weight', json={"direction": "in", "truck": "T-1", "containers": "C-1",
+                                                "weight": 5000, "produce": "orange"})
+
+    assert response.status_code == 202
+    body = response.get_json()
+    assert body["queued"] is True
+    assert body["ticket"] == f"{s._segment}:0"
+    assert "session" not in body
+    get_db.assert_not_called()
+    allocate.assert_not_called()
+    record, _ = s._read(s._segment, 0, 1)[0]
+    assert record["reading"]["truck"] == "T-1"
+    assert "session" not in record
+
+
+def test_apply_spooled_commits_readings_and_offsets():
+    conn = MagicMock()
+    cursor = MagicMock()
+    cursor.fetchone.return_value = None
+    conn.cursor.return_value = cursor
+    record = {"reading": {"direction": "in", "truck": "T-1", "containers": "C-1", "weight": 5000,
+                          "force": False, "produce": "orange"},
+              "datetime": "2024-01-05 12:00:00", "session": 42}
+
+    with patch('db.get_db', return_value=conn), patch('db.allocate_session_id') as allocate:
+        rejected = weight.apply_spooled([record], {"seg.log": 120})
+
+    assert rejected == []
+    allocate.assert_not_called()
+    cursor.execute.assert_any_call("SAVEPOINT reading")
+    cursor.executemany.assert_called_once_with(weight.SPOOL_OFFSET_UPSERT, [("seg.log", 120)])
+    conn.commit.assert_called_once()
+
+
+def test_apply_spooled_allocates_session_at_drain_time():
+    conn = MagicMock()
+    cursor = MagicMock()
+    cursor.fetchone.return_value = None
+    conn.cursor.return_value = cursor
+    record = {"reading": {"direction": "in", "truck": "T-1", "containers": "C-1", "weight": 5000,
+                          "force": False, "produce": "orange"},
+              "datetime": "2024-01-05 12:00:00"}
+
+    with patch('db.get_db', return_value=conn), patch('db.allocate_session_id', return_value=43) as allocate:
+        rejected = weight.apply_spooled([record], {"seg.log": 120})
+
+    assert rejected == []
+    allocate.assert_called_once_with()
+    cursor.execute.assert_any_call("INSERT INTO open_sessions (truck, session, bruto, datetime) VALUES (%s, %s, %s, %s)",
+                                   ("T-1", 43, 5000, "2024-01-05 12:00:00"))
+    conn.commit.assert_called_once()
+
+
+def test_drainer_thread_elected_once(make_spool):
+    first, second = make_spool(interval=0.01), make_spool(interval=0.01)
+    store = FakeStore()
+    first.start_drainer(store.load, store.apply, store.forget, status_interval=0)
+    second.start_drainer(store.load, store.apply, store.forget, status_interval=0)
+    first.append({"n": 0})
+    second.append({"n": 1})
+
+    deadline = time.monotonic() + 5
+    while len(store.applied) < 2 and time.monotonic() < deadline:
+        time.sleep(0.01)
+
+    assert store.applied == [0, 1]
+    assert (first.drained, second.drained) in ((2, 0), (0, 2))
@@ -1,4 +1,10 @@
-import random
+import json
+import queue
+import re
+import threading
+import time
+from collections import OrderedDict
+from datetime import datetime, timedelta
 from flask import g
 import mysql.connector
 import os
@@ -13,27 +19,885 @@ def connect_db():
     return mydb
 
 
-def container_data(containers):
-    mysql = connect_db()
-    cursor = mysql.cursor(dictionary=True)
+class PoolTimeout(Exception):
+    pass
 
-    # Initialize total weight
-    sum = 0
-    converted_list = containers.split(",")
-    for container in converted_list:
-        # Fetch container weight from the database
+
+# Keeps up to `size` idle connections around and allows `max_overflow` extra ones
+# under load, which are closed instead of returned once the rush is over.
+# Connections older than `recycle` seconds are replaced, and with `pre_ping`
+# every borrowed connection is checked so a dropped socket never reaches a route.
+class ConnectionPool:
+    def __init__(self, size=5, max_overflow=10, recycle=3600, pre_ping=True, timeout=30, connect=connect_db):
+        self.size = size
+        self.max_overflow = max_overflow
+        self.recycle = recycle
+        self.pre_ping = pre_ping
+        self.timeout = timeout
+        self._connect = connect
+        self._idle = queue.LifoQueue()
+        self._lock = threading.Lock()
+        self._born = {}
+        self._open_count = 0
+        self._checked_out = 0
+        self._borrows = 0
+        self._recycled = 0
+        self._invalidated = 0
+        self._waits = 0
+
+    def _open(self):
+        try:
+            conn = self._connect()
+        except Exception:
+            with self._lock:
+                self._open_count -= 1
+            raise
+        self._born[id(conn)] = time.monotonic()
+        return conn
+
+    def _discard(self, conn):
+        with self._lock:
+            self._open_count -= 1
+            self._born.pop(id(conn), None)
+        try:
+            conn.close()
+        except Exception:
+            pass
+
+    def _usable(self, conn):
+        if self.recycle >= 0 and time.monotonic() - self._born.get(id(conn), 0) > self.recycle:
+            self._recycled += 1
+            return False
+        if self.pre_ping:
+            try:
+                conn.ping(reconnect=False)
+            except Exception:
+                self._invalidated += 1
+                return False
+        return True
+
+    def acquire(self):
+        deadline = time.monotonic() + self.timeout
+        waited = False
+        while True:
+            try:
+                conn = self._idle.get_nowait()
+            except queue.Empty:
+                # Reserve the slot before connecting so concurrent borrowers can't overshoot
+                with self._lock:
+                    can_open = self._open_count < self.size + self.max_overflow
+                    if can_open:
+                        self._open_count += 1
+                if can_open:
+                    conn = self._open()
+                else:
+                    remaining = deadline - time.monotonic()
+                    if remaining <= 0:
+                        raise PoolTimeout(f"No database connection available after {self.timeout}s")
+                    if not waited:
+                        waited = True
+                        with self._lock:
+                            self._waits += 1
+                    try:
+                        # Wake up regularly in case a discarded connection freed a slot
+                        conn = self._idle.get(timeout=min(remaining, 0.5))
+                    except queue.Empty:
+                        continue
+                    if not self._usable(conn):
+                        self._discard(conn)
+                        continue
+            else:
+                if not self._usable(conn):
+                    self._discard(conn)
+                    continue
+
+            with self._lock:
+                self._checked_out += 1
+                self._borrows += 1
+            return conn
+
+    def release(self, conn):
+        with self._lock:
+            self._checked_out -= 1
         try:
-            cursor.execute("""SELECT weight FROM containers_registered WHERE container_id = %s LIMIT 1;""", (container,))
-            result = cursor.fetchone()
-            if result is None:
+            # Never hand the next borrower someone else's open transaction
+            if conn.in_transaction:
+                conn.rollback()
+        except Exception:
+            self._invalidated += 1
+            self._discard(conn)
+            return
+        if self._idle.qsize() >= self.size:
+            self._discard(conn)
+        else:
+            self._idle.put(conn)
+
+    def close(self):
+        while True:
+            try:
+                conn = self._idle.get_nowait()
+            except queue.Empty:
+                break
+            self._discard(conn)
+
+    def stats(self):
+        with self._lock:
+            return {
+                "size": self.size,
+                "max_overflow": self.max_overflow,
+                "recycle": self.recycle,
+                "open": self._open_count,
+                "idle": self._idle.qsize(),
+                "checked_out": self._checked_out,
+                "borrows": self._borrows,
+                "waits": self._waits,
+                "recycled": self._recycled,
+                "invalidated": self._invalidated,
+            }
+
+
+_pool = None
+_pool_lock = threading.Lock()
+
+def get_pool():
+    global _pool
+    if _pool is None:
+        with _pool_lock:
+            if _pool is None:
+                _pool = ConnectionPool(
+                    size=int(os.environ.get('DB_POOL_SIZE', 5)),
+                    max_overflow=int(os.environ.get('DB_POOL_MAX_OVERFLOW', 10)),
+                    recycle=int(os.environ.get('DB_POOL_RECYCLE', 3600)),
+                    pre_ping=os.environ.get('DB_POOL_PRE_PING', '1') != '0',
+                    timeout=int(os.environ.get('DB_POOL_TIMEOUT', 30)),
+                )
+    return _pool
+
+
+# Request-scoped connection: borrowed on first use, returned by close_db at teardown
+def get_db():
+    if 'db' not in g:
+        g.db = get_pool().acquire()
+    return g.db
+
+
+def close_db(e=None):
+    conn = g.pop('db', None)
+    if conn is not None:
+        get_pool().release(conn)
+
+
+# Hands out session ids from the `sequences` table. A single atomic
+# UPDATE ... LAST_INSERT_ID() reserves a block of `block_size` ids, so callers in
+# different threads, workers or processes never see the same id and no query
+# touches `transactions`. With block_size > 1 ids are served from memory until
+# the block runs out, at the cost of gaps when a worker exits.
+class SessionAllocator:
+    def __init__(self, name='session', block_size=1):
+        self.name = name
+        self.block_size = block_size
+        self._next = 0
+        self._end = 0
+        self._lock = threading.Lock()
+
+    def _reserve(self, count):
+        conn = get_pool().acquire()
+        try:
+            cursor = conn.cursor()
+            cursor.execute("UPDATE sequences SET next_id = LAST_INSERT_ID(next_id + %s) WHERE name = %s",
+                           (count, self.name))
+            if cursor.rowcount == 0:
+                # First use on an existing database: continue after the highest session recorded
+                cursor.execute("INSERT IGNORE INTO sequences (name, next_id) "
+                               "SELECT %s, COALESCE(MAX(session), 0) FROM transactions", (self.name,))
+                cursor.execute("UPDATE sequences SET next_id = LAST_INSERT_ID(next_id + %s) WHERE name = %s",
+                               (count, self.name))
+            cursor.execute("SELECT LAST_INSERT_ID()")
+            last = cursor.fetchone()[0]
+            cursor.close()
+            conn.commit()
+        finally:
+            get_pool().release(conn)
+        return last - count + 1, last + 1
+
+    def allocate(self):
+        with self._lock:
+            if self._next >= self._end:
+                self._next, self._end = self._reserve(self.block_size)
+            session_id = self._next
+            self._next += 1
+            return session_id
+
+
+session_allocator = SessionAllocator(block_size=int(os.environ.get('SESSION_ID_BLOCK_SIZE', 1)))
+
+def allocate_session_id():
+    return session_allocator.allocate()
+
+
+MIGRATIONS_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'migrations')
+
+
+def split_statements(sql):
+    lines = [line for line in sql.splitlines() if not line.strip().startswith('--')]
+    return [statement.strip() for statement in "\n".join(lines).split(';') if statement.strip()]
+
+
+# Applies every migrations/*.sql file not yet listed in schema_migrations, in
+# file name order. A named lock keeps several workers from migrating at once.
+def migrate(conn):
+    cursor = conn.cursor()
+    cursor.execute("SELECT GET_LOCK('weight_migrations', 60)")
+    if cursor.fetchone()[0] != 1:
+        raise RuntimeError("Timed out waiting for the migration lock")
+    applied_now = []
+    try:
+        cursor.execute("""
+        CREATE TABLE IF NOT EXISTS schema_migrations (
+          version varchar(255) NOT NULL,
+          applied_at datetime NOT NULL,
+          PRIMARY KEY (version)
+        ) ENGINE=InnoDB
+        """)
+        cursor.execute("SELECT version FROM schema_migrations")
+        applied = {row[0] for row in cursor.fetchall()}
+
+        for filename in sorted(os.listdir(MIGRATIONS_DIR)):
+            version, extension = os.path.splitext(filename)
+            if extension != '.sql' or version in applied:
                 continue
-            sum+=result["weight"]
-        except:
-            return (f"No data available for Container: {container} "), 500
+            with open(os.path.join(MIGRATIONS_DIR, filename), encoding='utf-8') as f:
+                statements = split_statements(f.read())
+            for statement in statements:
+                cursor.execute(statement)
+                if cursor.with_rows:
+                    cursor.fetchall()
+            cursor.execute("INSERT INTO schema_migrations (version, applied_at) VALUES (%s, NOW())", (version,))
+            conn.commit()
+            applied_now.append(version)
+    finally:
+        cursor.execute("SELECT RELEASE_LOCK('weight_migrations')")
+        cursor.fetchall()
+        cursor.close()
+    return applied_now
+
+
+# Every "in" weighing that never got an "out". Like POST /weight, which only opens a
+# session for a reading with a truck, weighings without one are left out.
+BACKFILL_OPEN_SESSIONS_QUERY = """
+INSERT INTO open_sessions (truck, session, transaction_id, bruto, datetime)
+SELECT t.truck, t.session, t.id, t.bruto, t.datetime
+FROM transactions t
+WHERE t.direction = 'in'
+AND t.truck IS NOT NULL AND t.truck <> ''
+AND NOT EXISTS (SELECT 1 FROM transactions o WHERE o.session = t.session AND o.direction = 'out')
+ORDER BY t.session
+ON DUPLICATE KEY UPDATE session = VALUES(session), transaction_id = VALUES(transaction_id),
+    bruto = VALUES(bruto), datetime = VALUES(datetime)
+"""
+
+
+# Rebuilds open_sessions from transactions.
+# When a truck has several open sessions the most recent one wins.
+def backfill_open_sessions(conn):
+    cursor = conn.cursor()
+    cursor.execute("DELETE FROM open_sessions")
+    cursor.execute(BACKFILL_OPEN_SESSIONS_QUERY)
+    cursor.execute("SELECT COUNT(*) FROM open_sessions")
+    count = cursor.fetchone()[0]
+    cursor.close()
+    conn.commit()
+    return count
+
+
+# Archived sessions only live on in transactions_archive, so both feed the summary
+REBUILD_SESSIONS_QUERY = """
+INSERT INTO sessions (session, truck, produce, bruto, truckTara, neto, in_datetime, out_datetime)
+SELECT session, MAX(truck), MAX(produce), MAX(bruto), MAX(truckTara), MAX(neto),
+       MIN(CASE WHEN direction <> 'out' THEN datetime END),
+       MAX(CASE WHEN direction = 'out' THEN datetime END)
+FROM (
+    SELECT session, truck, produce, bruto, truckTara, neto, direction, datetime FROM transactions
+    UNION ALL
+    SELECT session, truck, produce, bruto, truckTara, neto, direction, datetime FROM transactions_archive
+) t
+GROUP BY session
+"""
+
 
+# Recomputes the sessions summary table from transactions and their archive
+def rebuild_sessions(conn):
+    cursor = conn.cursor()
+    cursor.execute("DELETE FROM sessions")
+    cursor.execute(REBUILD_SESSIONS_QUERY)
+    count = cursor.rowcount
     cursor.close()
-    mysql.close()
+    conn.commit()
+    return count
+
+
+# Monthly partitions of transactions created ahead of the current month
+PARTITION_MONTHS_AHEAD = int(os.environ.get('PARTITION_MONTHS_AHEAD', 3))
+
+PARTITIONS_QUERY = """
+SELECT PARTITION_NAME FROM information_schema.PARTITIONS
+WHERE TABLE_SCHEMA = DATABASE() AND TABLE_NAME = 'transactions' AND PARTITION_NAME IS NOT NULL
+ORDER BY PARTITION_ORDINAL_POSITION
+"""
+
+# Rows parked at the epoch by migration 006 must not make us create decades of partitions
+FIRST_PARTITION_QUERY = "SELECT MIN(datetime) FROM transactions WHERE datetime >= '2000-01-01'"
+
+
+def month_start(value):
+    return datetime(value.year, value.month, 1)
+
+
+def add_months(month, count):
+    index = month.year * 12 + month.month - 1 + count
+    return datetime(index // 12, index % 12 + 1, 1)
 
-    return sum, 200
 
+def partition_name(month):
+    return month.strftime("p%Y%m")
+
+
+def monthly_partitions(cursor):
+    cursor.execute(PARTITIONS_QUERY)
+    names = [row[0] for row in cursor.fetchall()]
+    return names, [datetime.strptime(name, "p%Y%m") for name in names if re.fullmatch(r"p\d{6}", name)]
+
+
+# Splits monthly partitions off the catch-all p_future partition, from the month after
+# the newest one (or the oldest data) up to `months_ahead` months from now. Done ahead
+# of time p_future stays empty and this is a metadata change, if it ever falls behind
+# nothing breaks, the rows wait in p_future and get moved here. Returns the new names.
+def ensure_partitions(conn, months_ahead=PARTITION_MONTHS_AHEAD, now=None):
+    cursor = conn.cursor()
+    cursor.execute("SELECT GET_LOCK('weight_partitions', 60)")
+    if cursor.fetchone()[0] != 1:
+        raise RuntimeError("Timed out waiting for the partition lock")
+    try:
+        names, months = monthly_partitions(cursor)
+        if 'p_future' not in names:
+            # Migration 006 is not applied
+            return []
+        current = month_start(now or datetime.now())
+        if months:
+            first = add_months(max(months), 1)
+        else:
+            cursor.execute(FIRST_PARTITION_QUERY)
+            oldest = cursor.fetchone()[0]
+            first = month_start(oldest) if oldest else current
+        new_months = []
+        month = first
+        while month <= add_months(current, months_ahead):
+            new_months.append(month)
+            month = add_months(month, 1)
+        if not new_months:
+            return []
+        definitions = [f"PARTITION {partition_name(month)} VALUES LESS THAN ('{add_months(month, 1):%Y-%m-%d}')"
+                       for month in new_months]
+        cursor.execute("ALTER TABLE transactions REORGANIZE PARTITION p_future INTO ({}, "
+                       "PARTITION p_future VALUES LESS THAN (MAXVALUE))".format(", ".join(definitions)))
+        return [partition_name(month) for month in new_months]
+    finally:
+        cursor.execute("SELECT RELEASE_LOCK('weight_partitions')")
+        cursor.fetchall()
+        cursor.close()
+
+
+# Takes every monthly partition before `before` out of transactions. Each one is
+# exchanged with an empty table of the same shape, which only swaps the tablespaces,
+# so the month stays available as transactions_pYYYYMM until someone drops or dumps
+# it. Months an open session started in are kept unless `force` is given.
+def detach_partitions(conn, before, force=False):
+    cursor = conn.cursor()
+    cursor.execute("SELECT GET_LOCK('weight_partitions', 60)")
+    if cursor.fetchone()[0] != 1:
+        raise RuntimeError("Timed out waiting for the partition lock")
+    detached = []
+    try:
+        _, months = monthly_partitions(cursor)
+        cutoff = month_start(before)
+        for month in sorted(m for m in months if m < cutoff):
+            if not force:
+                cursor.execute("SELECT COUNT(*) FROM open_sessions WHERE datetime < %s", (add_months(month, 1),))
+                if cursor.fetchone()[0]:
+                    raise RuntimeError(f"Open sessions started before {add_months(month, 1):%Y-%m-%d}, "
+                                       "close them or use force")
+            name = partition_name(month)
+            table = f"transactions_{name}"
+            cursor.execute(f"CREATE TABLE {table} LIKE transactions")
+            cursor.execute(f"ALTER TABLE {table} REMOVE PARTITIONING")
+            cursor.execute(f"ALTER TABLE transactions EXCHANGE PARTITION {name} WITH TABLE {table}")
+            cursor.execute(f"ALTER TABLE transactions DROP PARTITION {name}")
+            detached.append(table)
+    finally:
+        cursor.execute("SELECT RELEASE_LOCK('weight_partitions')")
+        cursor.fetchall()
+        cursor.close()
+    return detached
+
+
+# Closed sessions older than this many days are moved out of transactions by `archive`
+ARCHIVE_HORIZON_DAYS = int(os.environ.get('ARCHIVE_HORIZON_DAYS', 365))
+ARCHIVE_CHUNK_SIZE = int(os.environ.get('ARCHIVE_CHUNK_SIZE', 1000))
+
+ARCHIVED_BEFORE_QUERY = "SELECT archived_before FROM archive_state WHERE name = 'transactions'"
+
+NEXT_ARCHIVE_DAY_QUERY = "SELECT MIN(out_datetime) FROM sessions WHERE out_datetime >= %s"
+
+ARCHIVE_DAY_SESSIONS_QUERY = """
+SELECT session FROM sessions
+WHERE out_datetime >= %s AND out_datetime < %s
+ORDER BY session
+"""
+
+ARCHIVE_INSERT_QUERY = """
+INSERT INTO transactions_archive (id, datetime, direction, truck, containers, bruto, truckTara, neto, produce, session)
+SELECT id, datetime, direction, truck, containers, bruto, truckTara, neto, produce, session
+FROM transactions WHERE session IN ({}) AND datetime < %s
+"""
+
+ARCHIVE_DELETE_QUERY = "DELETE FROM transactions WHERE session IN ({}) AND datetime < %s"
+
+
+# Process-wide view of archive_state. Read on every request that needs it, it is a
+# primary-key lookup and a cached value would hide sessions the job just moved.
+def archived_before():
+    cursor = get_db().cursor()
+    cursor.execute(ARCHIVED_BEFORE_QUERY)
+    row = cursor.fetchone()
+    cursor.close()
+    return row[0] if row else None
+
+
+# Moves every closed session whose "out" weighing is before `before` (rounded down
+# to midnight) from transactions to transactions_archive. daily_rollups already
+# count them, they are maintained with every "out" (see ROLLUP_SESSION_QUERY).
+# Each day is one transaction (`chunk_size` sessions per statement) that also advances
+# archive_state.archived_before, so an interrupted run just resumes.
+# Sessions still open and standalone "none" weighings stay in transactions.
+def archive_sessions(conn, before, chunk_size=ARCHIVE_CHUNK_SIZE):
+    before = datetime(before.year, before.month, before.day)
+    cursor = conn.cursor()
+    cursor.execute("SELECT GET_LOCK('weight_archive', 60)")
+    if cursor.fetchone()[0] != 1:
+        raise RuntimeError("Timed out waiting for the archive lock")
+    sessions = transactions = 0
+    try:
+        cursor.execute(ARCHIVED_BEFORE_QUERY)
+        row = cursor.fetchone()
+        day = row[0] if row else None
+        if day is not None and day >= before:
+            return {"sessions": 0, "transactions": 0, "archived_before": day}
+        while True:
+            cursor.execute(NEXT_ARCHIVE_DAY_QUERY, (day or datetime(1970, 1, 1),))
+            first = cursor.fetchone()[0]
+            if first is None or first >= before:
+                break
+            day = datetime(first.year, first.month, first.day)
+            next_day = day + timedelta(days=1)
+            cursor.execute(ARCHIVE_DAY_SESSIONS_QUERY, (day, next_day))
+            ids = [row[0] for row in cursor.fetchall()]
+            for start in range(0, len(ids), chunk_size):
+                chunk = ids[start:start + chunk_size]
+                placeholders = ",".join(["%s"] * len(chunk))
+                cursor.execute(ARCHIVE_INSERT_QUERY.format(placeholders), chunk + [next_day])
+                cursor.execute(ARCHIVE_DELETE_QUERY.format(placeholders), chunk + [next_day])
+                transactions += cursor.rowcount
+            # A day is archived as a whole, /item reads it either from transactions or from the rollups
+            cursor.execute("UPDATE archive_state SET archived_before = %s WHERE name = 'transactions'", (next_day,))
+            conn.commit()
+            sessions += len(ids)
+            day = next_day
+        cursor.execute("UPDATE archive_state SET archived_before = %s WHERE name = 'transactions'", (before,))
+        conn.commit()
+    finally:
+        cursor.execute("SELECT RELEASE_LOCK('weight_archive')")
+        cursor.fetchall()
+        cursor.close()
+    return {"sessions": sessions, "transactions": transactions, "archived_before": before}
+
+
+ROLLUP_MERGE = """
+ON DUPLICATE KEY UPDATE
+    sessions = sessions + VALUES(sessions),
+    neto_sessions = neto_sessions + VALUES(neto_sessions),
+    neto = neto + VALUES(neto),
+    max_truckTara = GREATEST(COALESCE(max_truckTara, VALUES(max_truckTara)), COALESCE(VALUES(max_truckTara), max_truckTara)),
+    session_ids = CONCAT_WS(',', session_ids, VALUES(session_ids))
+"""
+
+# Adds one just closed session to its (day of "out", truck, produce) rollup row,
+# run in the same transaction as the "out" weighing
+ROLLUP_SESSION_QUERY = """
+INSERT INTO daily_rollups (day, truck, produce, sessions, neto_sessions, neto, max_truckTara, session_ids)
+SELECT DATE(out_datetime), COALESCE(truck, 'na'), COALESCE(produce, 'na'), 1, IF(neto IS NULL, 0, 1),
+       COALESCE(neto, 0), truckTara, session
+FROM sessions
+WHERE session = %s AND out_datetime IS NOT NULL
+""" + ROLLUP_MERGE
+
+REBUILD_ROLLUPS_QUERY = """
+INSERT INTO daily_rollups (day, truck, produce, sessions, neto_sessions, neto, max_truckTara, session_ids)
+SELECT DATE(out_datetime), COALESCE(truck, 'na'), COALESCE(produce, 'na'), COUNT(*), COUNT(neto),
+       COALESCE(SUM(neto), 0), MAX(truckTara), GROUP_CONCAT(session ORDER BY session)
+FROM sessions
+WHERE out_datetime IS NOT NULL
+GROUP BY DATE(out_datetime), COALESCE(truck, 'na'), COALESCE(produce, 'na')
+"""
+
+
+# Recomputes daily_rollups from the sessions table, which keeps archived sessions too
+def rebuild_rollups(conn):
+    cursor = conn.cursor()
+    cursor.execute("SET SESSION group_concat_max_len = 16777216")
+    cursor.execute("DELETE FROM daily_rollups")
+    cursor.execute(REBUILD_ROLLUPS_QUERY)
+    count = cursor.rowcount
+    cursor.close()
+    conn.commit()
+    return count
+
+
+# Marks ids we looked up that are not in containers_registered at all
+UNREGISTERED = object()
+
+
+# Bounded LRU of containers_registered rows (id -> weight, None or UNREGISTERED).
+# Entries expire after `ttl` seconds so writes made by another worker are picked up.
+class ContainerCache:
+    def __init__(self, max_size=10000, ttl=300):
+        self.max_size = max_size
+        self.ttl = ttl
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self._hits = 0
+        self._misses = 0
+        self._evictions = 0
+
+    def get_many(self, container_ids):
+        found = {}
+        missing = []
+        now = time.monotonic()
+        with self._lock:
+            for container_id in container_ids:
+                entry = self._entries.get(container_id)
+                if entry is None or now - entry[1] > self.ttl:
+                    self._misses += 1
+                    missing.append(container_id)
+                    continue
+                self._entries.move_to_end(container_id)
+                self._hits += 1
+                found[container_id] = entry[0]
+        return found, missing
+
+    def put_many(self, weights):
+        now = time.monotonic()
+        with self._lock:
+            for container_id, weight in weights.items():
+                self._entries[container_id] = (weight, now)
+                self._entries.move_to_end(container_id)
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+                self._evictions += 1
+
+    def invalidate(self, container_ids=None):
+        with self._lock:
+            if container_ids is None:
+                self._entries.clear()
+                return
+            for container_id in container_ids:
+                self._entries.pop(container_id, None)
+
+    def stats(self):
+        with self._lock:
+            return {
+                "size": len(self._entries),
+                "max_size": self.max_size,
+                "ttl": self.ttl,
+                "hits": self._hits,
+                "misses": self._misses,
+                "evictions": self._evictions,
+            }
+
+
+container_cache = ContainerCache(
+    max_size=int(os.environ.get('CONTAINER_CACHE_SIZE', 10000)),
+    ttl=int(os.environ.get('CONTAINER_CACHE_TTL', 300)),
+)
+
+
+# Per-process state for a freshly forked worker (gunicorn post_fork with preload_app).
+# The parent's pooled sockets are dropped without closing them, which would end the
+# parent's sessions too, and a reserved block of session ids must not be shared.
+def reset_after_fork():
+    global _pool, session_allocator
+    _pool = None
+    session_allocator = SessionAllocator(name=session_allocator.name, block_size=session_allocator.block_size)
+    container_cache.invalidate()
+
+
+# unknown_containers holds ids we have no weight for, see migrations/009_unknown_containers.sql
+UNKNOWN_REGISTERED_UPSERT = """
+INSERT INTO unknown_containers (container_id, registered)
+VALUES {} ON DUPLICATE KEY UPDATE registered = 1
+"""
+
+UNKNOWN_RESOLVED_DELETE = "DELETE FROM unknown_containers WHERE container_id IN ({})"
+
+# Checked against the table, not the cache, which may not have seen another worker's load yet
+UNKNOWN_REFERENCED_INSERT = """
+INSERT IGNORE INTO unknown_containers (container_id, registered)
+SELECT ids.id, 0
+FROM JSON_TABLE(%s, '$[*]' COLUMNS (id varchar(50) PATH '$')) ids
+WHERE NOT EXISTS (SELECT 1 FROM containers_registered c WHERE c.container_id = ids.id)
+"""
+
+UNKNOWN_VERSION_QUERY = "SELECT version FROM unknown_containers_version WHERE id = 1"
+
+UNKNOWN_VERSION_BUMP = "UPDATE unknown_containers_version SET version = version + 1 WHERE id = 1"
+
+REBUILD_UNKNOWN_QUERIES = [
+    "DELETE FROM unknown_containers",
+    "INSERT IGNORE INTO unknown_containers (container_id, registered) "
+    "SELECT container_id, 1 FROM containers_registered WHERE weight IS NULL",
+    """
+    INSERT IGNORE INTO unknown_containers (container_id, registered)
+    SELECT DISTINCT TRIM(ids.id), 0
+    FROM (SELECT containers FROM transactions UNION ALL SELECT containers FROM transactions_archive) t,
+    JSON_TABLE(CONCAT('["', REPLACE(REPLACE(REPLACE(t.containers, '\\\\', ''), '"', ''), ',', '","'), '"]'),
+               '$[*]' COLUMNS (id varchar(50) PATH '$')) ids
+    WHERE t.containers IS NOT NULL
+    AND TRIM(ids.id) <> ''
+    AND NOT EXISTS (SELECT 1 FROM containers_registered c WHERE c.container_id = TRIM(ids.id))
+    """,
+]
+
+
+def split_containers(containers):
+    return [container.strip() for container in (containers or "").split(",") if container.strip()]
+
+
+# Loader side: rows without a weight become unknown, rows with one stop being unknown.
+# Runs on the loader's cursor so it commits together with the upsert.
+def update_unknown_containers(cursor, rows):
+    unknown = [row[0] for row in rows if row[1] is None]
+    resolved = [row[0] for row in rows if row[1] is not None]
+    changed = 0
+    if unknown:
+        cursor.execute(UNKNOWN_REGISTERED_UPSERT.format(",".join(["(%s, 1)"] * len(unknown))), unknown)
+        changed += cursor.rowcount
+    if resolved:
+        cursor.execute(UNKNOWN_RESOLVED_DELETE.format(",".join(["%s"] * len(resolved))), resolved)
+        changed += cursor.rowcount
+    if changed:
+        cursor.execute(UNKNOWN_VERSION_BUMP)
+
+
+# Weighing side: ids of `containers` that are not registered at all are added,
+# in the caller's transaction. Costs a query only when the cache saw such an id.
+def record_unknown_containers(cursor, containers):
+    container_ids = split_containers(containers)
+    if not container_ids:
+        return
+    weights = container_weights(container_ids)
+    unregistered = sorted({container_id for container_id in container_ids
+                           if weights[container_id] is UNREGISTERED and len(container_id) <= 50})
+    if unregistered:
+        cursor.execute(UNKNOWN_REFERENCED_INSERT, (json.dumps(unregistered),))
+        # Only a new id moves the version, repeat weighings leave the row unlocked
+        if cursor.rowcount:
+            cursor.execute(UNKNOWN_VERSION_BUMP)
+
+
+# Version of the unknown_containers list read on a dictionary cursor, None before
+# migration 011 has run
+def unknown_containers_version(cursor):
+    cursor.execute(UNKNOWN_VERSION_QUERY)
+    row = cursor.fetchone()
+    return row["version"] if row else None
+
+
+def rebuild_unknown_containers(conn):
+    cursor = conn.cursor()
+    for query in REBUILD_UNKNOWN_QUERIES:
+        cursor.execute(query)
+    cursor.execute(UNKNOWN_VERSION_BUMP)
+    cursor.execute("SELECT COUNT(*) FROM unknown_containers")
+    count = cursor.fetchone()[0]
+    cursor.close()
+    conn.commit()
+    return count
+
+
+# Resolves weights for all ids with at most one query, answering from the cache when possible
+def container_weights(container_ids):
+    weights, missing = container_cache.get_many(set(container_ids))
+    if missing:
+        cursor = get_db().cursor(dictionary=True)
+        cursor.execute(
+            "SELECT container_id, weight FROM containers_registered WHERE container_id IN ({})".format(
+                ",".join(["%s"] * len(missing))),
+            missing)
+        loaded = {row["container_id"]: row["weight"] for row in cursor.fetchall()}
+        cursor.close()
+        fetched = {container_id: loaded.get(container_id, UNREGISTERED) for container_id in missing}
+        container_cache.put_many(fetched)
+        weights.update(fetched)
+    return weights
+
+
+# Reads weights for all ids straight from containers_registered, with a shared lock held
+# until the caller's transaction ends. Used where a weight is written down (neto), so
+# neither this worker's cache nor another worker's /batch-weight can leave it behind:
+# a weight committed meanwhile is read here, one committed after waits for our commit
+# and then finds our pending_neto rows. Refreshes the cache on the way.
+def locked_container_weights(conn, container_ids):
+    container_ids = sorted(set(container_ids))
+    cursor = conn.cursor()
+    cursor.execute(CONTAINER_WEIGHTS_QUERY.format(",".join(["%s"] * len(container_ids))) + " FOR SHARE",
+                   container_ids)
+    loaded = dict(cursor.fetchall())
+    cursor.close()
+    weights = {container_id: loaded.get(container_id, UNREGISTERED) for container_id in container_ids}
+    container_cache.put_many(weights)
+    return weights
+
+
+# Total weight of the comma separated `containers` and the ids it could not count,
+# unregistered or registered without a weight. With `conn` the weights are read fresh
+# under a lock in its transaction (see locked_container_weights), otherwise from the cache.
+def container_data(containers, conn=None):
+    converted_list = split_containers(containers)
+    if not converted_list:
+        return 0, []
+
+    if conn is None:
+        weights = container_weights(converted_list)
+    else:
+        weights = locked_container_weights(conn, converted_list)
+
+    # Initialize total weight
+    sum = 0
+    unresolved = []
+    for container in converted_list:
+        weight = weights[container]
+        if weight is UNREGISTERED or weight is None:
+            unresolved.append(container)
+            continue
+        sum += weight
+
+    return sum, unresolved
+
+
+PENDING_NETO_INSERT = "INSERT IGNORE INTO pending_neto (container_id, transaction_id, session) VALUES (%s, %s, %s)"
+
+PENDING_FOR_CONTAINERS_QUERY = "SELECT DISTINCT transaction_id FROM pending_neto WHERE container_id IN ({})"
+
+PENDING_RESOLVED_DELETE = """
+DELETE p FROM pending_neto p
+JOIN containers_registered c ON c.container_id = p.container_id
+WHERE p.transaction_id IN ({}) AND c.weight IS NOT NULL
+"""
+
+PENDING_REMAINING_QUERY = "SELECT DISTINCT transaction_id FROM pending_neto WHERE transaction_id IN ({})"
+
+PENDING_TRANSACTIONS_QUERY = """
+SELECT t.id, t.session, t.truckTara, t.containers, s.bruto
+FROM transactions t JOIN sessions s ON s.session = t.session
+WHERE t.id IN ({0}) AND t.direction = 'out'
+UNION ALL
+SELECT t.id, t.session, t.truckTara, t.containers, s.bruto
+FROM transactions_archive t JOIN sessions s ON s.session = t.session
+WHERE t.id IN ({0}) AND t.direction = 'out'
+"""
+
+CONTAINER_WEIGHTS_QUERY = "SELECT container_id, weight FROM containers_registered WHERE container_id IN ({})"
+
+# The new netos come in as one JSON parameter, [[session, neto], ...] or [[id, neto], ...].
+# Rollups move by the difference, sessions that had no neto become counted.
+NETO_ROLLUPS_UPDATE = """
+UPDATE daily_rollups r
+JOIN (
+    SELECT DATE(s.out_datetime) AS day, COALESCE(s.truck, 'na') AS truck, COALESCE(s.produce, 'na') AS produce,
+           SUM(s.neto IS NULL) AS counted, SUM(v.neto - COALESCE(s.neto, 0)) AS delta
+    FROM sessions s
+    JOIN JSON_TABLE(%s, '$[*]' COLUMNS (session int PATH '$[0]', neto int PATH '$[1]')) v ON v.session = s.session
+    WHERE s.out_datetime IS NOT NULL
+    GROUP BY DATE(s.out_datetime), COALESCE(s.truck, 'na'), COALESCE(s.produce, 'na')
+) d ON r.day = d.day AND r.truck = d.truck AND r.produce = d.produce
+SET r.neto_sessions = r.neto_sessions + d.counted, r.neto = r.neto + d.delta
+"""
+
+NETO_SESSIONS_UPDATE = """
+UPDATE sessions s
+JOIN JSON_TABLE(%s, '$[*]' COLUMNS (session int PATH '$[0]', neto int PATH '$[1]')) v ON v.session = s.session
+SET s.neto = v.neto
+"""
+
+NETO_TRANSACTIONS_UPDATE = """
+UPDATE {} t
+JOIN JSON_TABLE(%s, '$[*]' COLUMNS (id int PATH '$[0]', neto int PATH '$[1]')) v ON v.id = t.id
+SET t.neto = v.neto
+"""
+
+
+# Recomputes the neto of every pending "out" weighing that `container_ids` (which just
+# got a weight) leaves with no unresolved container, along with its session and daily
+# rollup. Runs on the caller's cursor and transaction, one statement per table.
+def recompute_pending_neto(cursor, container_ids):
+    started = time.monotonic()
+    report = {"transactions": 0, "sessions": 0, "rollups": 0, "elapsed": 0}
+    if container_ids:
+        cursor.execute(PENDING_FOR_CONTAINERS_QUERY.format(",".join(["%s"] * len(container_ids))), list(container_ids))
+        candidates = [row[0] for row in cursor.fetchall()]
+    else:
+        candidates = []
+    if candidates:
+        placeholders = ",".join(["%s"] * len(candidates))
+        cursor.execute(PENDING_RESOLVED_DELETE.format(placeholders), candidates)
+        cursor.execute(PENDING_REMAINING_QUERY.format(placeholders), candidates)
+        waiting = {row[0] for row in cursor.fetchall()}
+        ready = [transaction_id for transaction_id in candidates if transaction_id not in waiting]
+    else:
+        ready = []
+
+    if ready:
+        cursor.execute(PENDING_TRANSACTIONS_QUERY.format(",".join(["%s"] * len(ready))), ready + ready)
+        rows = cursor.fetchall()
+        ids = sorted({container for row in rows for container in split_containers(row[3])})
+        weights = {}
+        if ids:
+            cursor.execute(CONTAINER_WEIGHTS_QUERY.format(",".join(["%s"] * len(ids))), ids)
+            weights = dict(cursor.fetchall())
+
+        netos, session_netos, still_pending = [], [], []
+        for transaction_id, session, truck_tara, containers, bruto in rows:
+            ids = split_containers(containers)
+            missing = [container for container in ids if weights.get(container) is None]
+            if missing:
+                # A weight was cleared again meanwhile, keep waiting for it
+                still_pending.extend((container, transaction_id, session) for container in missing if len(container) <= 50)
+                continue
+            if bruto is None or truck_tara is None:
+                continue
+            neto = bruto - int(truck_tara) - sum(weights[container] for container in ids)
+            netos.append([transaction_id, neto])
+            session_netos.append([session, neto])
+
+        if still_pending:
+            cursor.executemany(PENDING_NETO_INSERT, still_pending)
+        if netos:
+            cursor.execute(NETO_ROLLUPS_UPDATE, (json.dumps(session_netos),))
+            report["rollups"] = cursor.rowcount
+            cursor.execute(NETO_SESSIONS_UPDATE, (json.dumps(session_netos),))
+            report["sessions"] = cursor.rowcount
+            for table in ("transactions", "transactions_archive"):
+                cursor.execute(NETO_TRANSACTIONS_UPDATE.format(table), (json.dumps(netos),))
+                report["transactions"] += cursor.rowcount
 
+    report["elapsed"] = round(time.monotonic() - started, 3)
+    return report
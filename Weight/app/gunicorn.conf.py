@@ -0,0 +1,45 @@
+# Production server settings: gunicorn --config gunicorn.conf.py weight:app
+# Reload workers gracefully with `kill -HUP <master pid>`.
+import multiprocessing
+import os
+import sys
+
+bind = f"0.0.0.0:{os.environ.get('PORT', 5000)}"
+# Compose passes these through as empty strings when they are not set on the host
+workers = int(os.environ.get("WEB_WORKERS") or multiprocessing.cpu_count() * 2 + 1)
+threads = int(os.environ.get("WEB_THREADS") or 4)
+worker_class = "gthread"
+timeout = int(os.environ.get("WEB_TIMEOUT", 60))
+graceful_timeout = int(os.environ.get("WEB_GRACEFUL_TIMEOUT", 30))
+keepalive = int(os.environ.get("WEB_KEEPALIVE", 5))
+max_requests = int(os.environ.get("WEB_MAX_REQUESTS", 0))
+max_requests_jitter = int(os.environ.get("WEB_MAX_REQUESTS_JITTER", 0))
+# Each worker imports the app itself and builds its own pool on first use
+preload_app = os.environ.get("WEB_PRELOAD", "0") == "1"
+accesslog = "-"
+errorlog = "-"
+
+
+def on_starting(server):
+    # Migrate once in the master, before any worker serves a request
+    import db
+
+    conn = db.connect_db()
+    try:
+        db.migrate(conn)
+        db.ensure_partitions(conn)
+    finally:
+        conn.close()
+
+
+def post_fork(server, worker):
+    import db
+
+    db.reset_after_fork()
+
+
+def post_worker_init(worker):
+    # The app is loaded in the worker now, start its (standby) spool drainer
+    weight = sys.modules.get("weight")
+    if weight is not None:
+        weight.start_spool()
@@ -0,0 +1,194 @@
+import csv
+import json
+import os
+import time
+import db
+
+# LBS to Kg conversion factor
+LBS_TO_KG = 0.45359237
+
+READ_SIZE = 64 * 1024
+MAX_ENTRY_SIZE = 1024 * 1024
+MAX_WARNINGS = 100
+
+UPSERT_QUERY = """
+INSERT INTO containers_registered (container_id, weight, unit)
+VALUES {} ON DUPLICATE KEY UPDATE weight = VALUES(weight)
+"""
+
+
+class UnsupportedFile(Exception):
+    pass
+
+
+class RejectedRow(Exception):
+    pass
+
+
+# The file cannot be read past `line`, rows before it are already loaded
+class MalformedFile(ValueError):
+    def __init__(self, message, line):
+        super().__init__(message)
+        self.line = line
+
+
+# Yields the elements of a top-level JSON array one at a time, keeping only
+# the unparsed tail of the file in memory.
+def iter_json_array(f):
+    decoder = json.JSONDecoder()
+    buf = ""
+    pos = 0
+    eof = False
+    started = False
+    # Lines of the file already dropped from buf
+    lines = 0
+
+    def fill():
+        nonlocal buf, pos, eof, lines
+        chunk = f.read(READ_SIZE)
+        if not chunk:
+            eof = True
+        lines += buf.count("\n", 0, pos)
+        buf = buf[pos:] + chunk
+        pos = 0
+
+    def line_at(index):
+        return lines + buf.count("\n", 0, index) + 1
+
+    while True:
+        while pos < len(buf) and (buf[pos].isspace() or (started and buf[pos] == ",")):
+            pos += 1
+        if pos >= len(buf):
+            if eof:
+                raise MalformedFile("Unexpected end of JSON file", line_at(len(buf)))
+            fill()
+            continue
+        if not started:
+            if buf[pos] != "[":
+                raise MalformedFile("JSON file must contain a list of containers", line_at(pos))
+            started = True
+            pos += 1
+            continue
+        if buf[pos] == "]":
+            return
+        try:
+            value, end = decoder.raw_decode(buf, pos)
+        except json.JSONDecodeError as e:
+            if eof or len(buf) - pos > MAX_ENTRY_SIZE:
+                raise MalformedFile(f"Invalid JSON: {e.msg}", line_at(e.pos))
+            fill()
+            continue
+        # A value that ends exactly at the buffer edge may continue in the next read
+        if end == len(buf) and not eof:
+            fill()
+            continue
+        pos = end
+        yield value
+
+
+def json_rows(f):
+    for entry in iter_json_array(f):
+        if not isinstance(entry, dict):
+            yield RejectedRow("Entry is not an object")
+            continue
+        yield entry.get("id"), entry.get("weight"), entry.get("unit") or "kg"
+
+
+def csv_rows(f):
+    csv_reader = csv.DictReader(f)
+    # Detect unit type from headers
+    unit_type = "lbs" if "lbs" in (csv_reader.fieldnames or []) else "kg"
+    for row in csv_reader:
+        yield row.get("id"), row.get(unit_type) or None, unit_type
+
+
+def validate_row(container_id, weight, unit):
+    container_id = str(container_id).strip() if container_id is not None else ""
+    if not container_id:
+        raise RejectedRow("Missing Container ID")
+    if weight is not None:
+        try:
+            weight = int(weight)
+        except (TypeError, ValueError):
+            raise RejectedRow(f"Invalid weight {weight!r} for container {container_id}")
+    return container_id, weight, unit
+
+
+# Converts a whole batch to kg at once, rows without a known weight stay empty
+def convert_batch(rows):
+    return [
+        (container_id, int(weight * LBS_TO_KG) if weight is not None else None, "kg")
+        if unit in ("lbs", "lb") else (container_id, weight, unit)
+        for container_id, weight, unit in rows
+    ]
+
+
+def write_batch(conn, rows):
+    cursor = conn.cursor()
+    params = [value for row in rows for value in row]
+    cursor.execute(UPSERT_QUERY.format(",".join(["(%s, %s, %s)"] * len(rows))), params)
+    db.update_unknown_containers(cursor, rows)
+    recomputed = db.recompute_pending_neto(cursor, [row[0] for row in rows if row[1] is not None])
+    cursor.close()
+    conn.commit()
+    db.container_cache.invalidate([row[0] for row in rows])
+    return recomputed
+
+
+# Streams a ./in/ file into containers_registered, committing every `chunk_size` rows
+# together with the neto recomputation they unlock
+def load_file(conn, file_path, chunk_size=1000):
+    file_extension = os.path.splitext(file_path)[1].lower()
+    if file_extension == ".json":
+        parse = json_rows
+    elif file_extension == ".csv":
+        parse = csv_rows
+    else:
+        raise UnsupportedFile("Unsupported file type. Only CSV and JSON are allowed.")
+
+    started = time.monotonic()
+    loaded = 0
+    rejected = 0
+    warnings = []
+    batch = []
+    recomputed = {"transactions": 0, "sessions": 0, "rollups": 0, "elapsed": 0}
+
+    def write(rows):
+        report = write_batch(conn, convert_batch(rows))
+        for key in recomputed:
+            recomputed[key] += report[key]
+
+    with open(file_path, "r", encoding="utf-8", newline="") as f:
+        try:
+            for line, row in enumerate(parse(f), start=1):
+                try:
+                    if isinstance(row, RejectedRow):
+                        raise row
+                    batch.append(validate_row(*row))
+                except RejectedRow as e:
+                    rejected += 1
+                    if len(warnings) < MAX_WARNINGS:
+                        warnings.append(f"{e} at row {line}")
+                    continue
+                if len(batch) >= chunk_size:
+                    write(batch)
+                    loaded += len(batch)
+                    batch = []
+        except MalformedFile as e:
+            raise MalformedFile(f"{e} in {os.path.basename(file_path)} at line {e.line}, "
+                                f"{loaded} rows before it were loaded", e.line)
+
+    if batch:
+        write(batch)
+        loaded += len(batch)
+
+    elapsed = time.monotonic() - started
+    return {
+        "rows": loaded,
+        "rejected": rejected,
+        "warnings": warnings,
+        "elapsed": round(elapsed, 3),
+        "rows_per_second": round(loaded / elapsed) if elapsed > 0 else loaded,
+        # Pending "out" weighings whose neto these weights completed
+        "recomputed": dict(recomputed, elapsed=round(recomputed["elapsed"], 3)),
+    }
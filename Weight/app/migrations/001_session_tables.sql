@@ -0,0 +1,33 @@
+--
+-- Session id sequence and open-session registry
+--   sequences.next_id holds the last id handed out, the app reserves ids with
+--   UPDATE sequences SET next_id = LAST_INSERT_ID(next_id + n)
+--
+
+CREATE TABLE IF NOT EXISTS `sequences` (
+  `name` varchar(50) NOT NULL,
+  `next_id` int(12) NOT NULL DEFAULT 0,
+  PRIMARY KEY (`name`)
+) ENGINE=InnoDB ;
+
+INSERT IGNORE INTO `sequences` (`name`, `next_id`)
+SELECT 'session', COALESCE(MAX(`session`), 0) FROM `transactions`;
+
+--   One row per truck with an "in" weighing that has no "out" yet
+
+CREATE TABLE IF NOT EXISTS `open_sessions` (
+  `truck` varchar(50) NOT NULL,
+  `session` int(12) NOT NULL,
+  `transaction_id` int(12) DEFAULT NULL,
+  `bruto` int(12) DEFAULT NULL,
+  `datetime` datetime DEFAULT NULL,
+  PRIMARY KEY (`truck`)
+) ENGINE=InnoDB ;
+
+INSERT IGNORE INTO `open_sessions` (`truck`, `session`, `transaction_id`, `bruto`, `datetime`)
+SELECT t.truck, t.session, t.id, t.bruto, t.datetime
+FROM `transactions` t
+WHERE t.direction = 'in'
+AND t.truck IS NOT NULL
+AND NOT EXISTS (SELECT 1 FROM `transactions` o WHERE o.session = t.session AND o.direction = 'out')
+ORDER BY t.session DESC;
@@ -0,0 +1,17 @@
+--
+-- Move to InnoDB for row-level locking and add one index per query path
+--   truck lookups (/item):               truck, datetime, covering session and truckTara
+--   session lookups (/session, backfill): session, direction
+--   time ranges (GET /weight, "none"):   datetime, direction
+--   /unknown:                           weight
+--
+
+ALTER TABLE `containers_registered`
+  ENGINE=InnoDB,
+  ADD INDEX `idx_containers_weight` (`weight`);
+
+ALTER TABLE `transactions`
+  ENGINE=InnoDB,
+  ADD INDEX `idx_transactions_truck_datetime` (`truck`, `datetime`, `session`, `truckTara`),
+  ADD INDEX `idx_transactions_session` (`session`, `direction`),
+  ADD INDEX `idx_transactions_datetime` (`datetime`, `direction`);
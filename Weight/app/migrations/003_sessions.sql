@@ -0,0 +1,23 @@
+--
+-- One summary row per session, written together with its in/out transactions
+-- so /session/<id> is a primary-key lookup
+--
+
+CREATE TABLE IF NOT EXISTS `sessions` (
+  `session` int(12) NOT NULL,
+  `truck` varchar(50) DEFAULT NULL,
+  `produce` varchar(50) DEFAULT NULL,
+  `bruto` int(12) DEFAULT NULL,
+  `truckTara` int(12) DEFAULT NULL,
+  `neto` int(12) DEFAULT NULL,
+  `in_datetime` datetime DEFAULT NULL,
+  `out_datetime` datetime DEFAULT NULL,
+  PRIMARY KEY (`session`)
+) ENGINE=InnoDB ;
+
+INSERT IGNORE INTO `sessions` (`session`, `truck`, `produce`, `bruto`, `truckTara`, `neto`, `in_datetime`, `out_datetime`)
+SELECT session, MAX(truck), MAX(produce), MAX(bruto), MAX(truckTara), MAX(neto),
+       MIN(CASE WHEN direction <> 'out' THEN datetime END),
+       MAX(CASE WHEN direction = 'out' THEN datetime END)
+FROM `transactions`
+GROUP BY session;
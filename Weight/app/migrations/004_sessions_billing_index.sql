@@ -0,0 +1,7 @@
+--
+-- Billing aggregates completed sessions per truck and time window,
+-- cover that lookup (/produce-totals) with one index
+--
+
+ALTER TABLE `sessions`
+  ADD INDEX `idx_sessions_truck_out` (`truck`, `out_datetime`, `produce`, `neto`);
@@ -0,0 +1,10 @@
+--
+-- Write-behind ingestion (WEIGHT_SPOOL=1): how far each spool segment has been
+-- applied, committed in the same transaction as the readings themselves
+--
+
+CREATE TABLE IF NOT EXISTS `spool_offsets` (
+  `segment` varchar(64) NOT NULL,
+  `byte_offset` bigint NOT NULL,
+  PRIMARY KEY (`segment`)
+) ENGINE=InnoDB;
@@ -0,0 +1,24 @@
+--
+-- Partition transactions by month of `datetime`, so date-bounded reads only touch
+-- the months they ask for and old months can be exchanged out as whole tables.
+--
+-- MySQL wants the partitioning column in every unique key, hence the (id, datetime)
+-- primary key, and it must not be NULL. Rows without a datetime never existed in
+-- practice, they are parked at the epoch so they end up in the oldest partition.
+--
+-- Everything starts in the catch-all p_future partition, db.ensure_partitions()
+-- splits it into monthly partitions (pYYYYMM) on startup and ahead of time.
+--
+
+UPDATE `transactions` SET `datetime` = '1970-01-01 00:00:00' WHERE `datetime` IS NULL;
+UPDATE `open_sessions` SET `datetime` = '1970-01-01 00:00:00' WHERE `datetime` IS NULL;
+
+ALTER TABLE `transactions`
+  MODIFY `datetime` datetime NOT NULL,
+  DROP PRIMARY KEY,
+  ADD PRIMARY KEY (`id`, `datetime`);
+
+ALTER TABLE `transactions`
+  PARTITION BY RANGE COLUMNS (`datetime`) (
+    PARTITION `p_future` VALUES LESS THAN (MAXVALUE)
+  );
@@ -0,0 +1,49 @@
+--
+-- Archive for closed sessions past the retention horizon (`flask --app weight archive`)
+--   transactions_archive: their raw rows, compressed, still answering GET /weight
+--   daily_rollups:        one row per day of the "out" weighing, truck and produce,
+--                         answering /item for archived days
+--   archive_state:        archived_before, every closed session that ended before it
+--                         lives in the archive instead of transactions
+--
+
+CREATE TABLE IF NOT EXISTS `transactions_archive` (
+  `id` int(12) NOT NULL,
+  `datetime` datetime NOT NULL,
+  `direction` varchar(10) DEFAULT NULL,
+  `truck` varchar(50) DEFAULT NULL,
+  `containers` varchar(10000) DEFAULT NULL,
+  `bruto` int(12) DEFAULT NULL,
+  `truckTara` int(12) DEFAULT NULL,
+  `neto` int(12) DEFAULT NULL,
+  `produce` varchar(50) DEFAULT NULL,
+  `session` int(12) NOT NULL,
+  PRIMARY KEY (`id`),
+  KEY `idx_transactions_archive_datetime` (`datetime`, `direction`)
+) ENGINE=InnoDB ROW_FORMAT=COMPRESSED KEY_BLOCK_SIZE=8 ;
+
+CREATE TABLE IF NOT EXISTS `daily_rollups` (
+  `day` date NOT NULL,
+  `truck` varchar(50) NOT NULL,
+  `produce` varchar(50) NOT NULL,
+  `sessions` int(12) NOT NULL DEFAULT 0,
+  `neto_sessions` int(12) NOT NULL DEFAULT 0,
+  `neto` bigint NOT NULL DEFAULT 0,
+  `max_truckTara` int(12) DEFAULT NULL,
+  `session_ids` mediumtext,
+  PRIMARY KEY (`day`, `truck`, `produce`),
+  KEY `idx_daily_rollups_truck_day` (`truck`, `day`)
+) ENGINE=InnoDB ;
+
+CREATE TABLE IF NOT EXISTS `archive_state` (
+  `name` varchar(50) NOT NULL,
+  `archived_before` datetime DEFAULT NULL,
+  PRIMARY KEY (`name`)
+) ENGINE=InnoDB ;
+
+INSERT IGNORE INTO `archive_state` (`name`, `archived_before`) VALUES ('transactions', NULL);
+
+--   The archive job walks closed sessions day by day of their "out" weighing
+
+ALTER TABLE `sessions`
+  ADD INDEX `idx_sessions_out_datetime` (`out_datetime`);
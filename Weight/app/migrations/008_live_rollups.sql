@@ -0,0 +1,16 @@
+--
+-- daily_rollups now cover every closed session, not only archived ones: every "out"
+-- adds its session in the same transaction. Start from a full rebuild out of sessions
+-- (the same as `flask --app weight rebuild-rollups`).
+--
+
+SET SESSION group_concat_max_len = 16777216;
+
+DELETE FROM `daily_rollups`;
+
+INSERT INTO `daily_rollups` (`day`, `truck`, `produce`, `sessions`, `neto_sessions`, `neto`, `max_truckTara`, `session_ids`)
+SELECT DATE(out_datetime), COALESCE(truck, 'na'), COALESCE(produce, 'na'), COUNT(*), COUNT(neto),
+       COALESCE(SUM(neto), 0), MAX(truckTara), GROUP_CONCAT(session ORDER BY session)
+FROM `sessions`
+WHERE out_datetime IS NOT NULL
+GROUP BY DATE(out_datetime), COALESCE(truck, 'na'), COALESCE(produce, 'na');
@@ -0,0 +1,25 @@
+--
+-- Index of containers without a known weight, served by /unknown
+--   registered = 1: in containers_registered with a NULL weight
+--   registered = 0: referenced by a weighing but never registered
+-- Kept current by /batch-weight and POST /weight, `flask --app weight rebuild-unknown`
+-- recomputes it like below.
+--
+
+CREATE TABLE IF NOT EXISTS `unknown_containers` (
+  `container_id` varchar(50) NOT NULL,
+  `registered` tinyint(1) NOT NULL DEFAULT 0,
+  PRIMARY KEY (`container_id`)
+) ENGINE=InnoDB ;
+
+INSERT IGNORE INTO `unknown_containers` (`container_id`, `registered`)
+SELECT container_id, 1 FROM `containers_registered` WHERE weight IS NULL;
+
+INSERT IGNORE INTO `unknown_containers` (`container_id`, `registered`)
+SELECT DISTINCT TRIM(ids.id), 0
+FROM (SELECT containers FROM `transactions` UNION ALL SELECT containers FROM `transactions_archive`) t,
+JSON_TABLE(CONCAT('["', REPLACE(REPLACE(REPLACE(t.containers, '\\', ''), '"', ''), ',', '","'), '"]'),
+           '$[*]' COLUMNS (id varchar(50) PATH '$')) ids
+WHERE t.containers IS NOT NULL
+AND TRIM(ids.id) <> ''
+AND NOT EXISTS (SELECT 1 FROM `containers_registered` c WHERE c.container_id = TRIM(ids.id));
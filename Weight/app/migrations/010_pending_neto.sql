@@ -0,0 +1,28 @@
+--
+-- "out" weighings whose neto waits for container weights: one row per container
+-- without a known weight (unregistered or registered with a NULL weight).
+-- When /batch-weight brings a weight for one of them, only these transactions are
+-- recomputed (db.recompute_pending_neto).
+--
+
+CREATE TABLE IF NOT EXISTS `pending_neto` (
+  `container_id` varchar(50) NOT NULL,
+  `transaction_id` int(12) NOT NULL,
+  `session` int(12) NOT NULL,
+  PRIMARY KEY (`container_id`, `transaction_id`),
+  KEY `idx_pending_neto_transaction` (`transaction_id`)
+) ENGINE=InnoDB ;
+
+--   Earlier "out" weighings skipped unregistered containers and stored a neto anyway,
+--   queue them too so their neto is corrected once the weights arrive
+
+INSERT IGNORE INTO `pending_neto` (`container_id`, `transaction_id`, `session`)
+SELECT TRIM(ids.id), t.id, t.session
+FROM (SELECT id, session, containers FROM `transactions` WHERE direction = 'out'
+      UNION ALL
+      SELECT id, session, containers FROM `transactions_archive` WHERE direction = 'out') t,
+JSON_TABLE(CONCAT('["', REPLACE(REPLACE(REPLACE(t.containers, '\\', ''), '"', ''), ',', '","'), '"]'),
+           '$[*]' COLUMNS (id varchar(50) PATH '$')) ids
+WHERE t.containers IS NOT NULL
+AND TRIM(ids.id) <> ''
+AND NOT EXISTS (SELECT 1 FROM `containers_registered` c WHERE c.container_id = TRIM(ids.id) AND c.weight IS NOT NULL);
@@ -0,0 +1,12 @@
+--
+-- Bumped in the same transaction as every change to unknown_containers, so GET /unknown
+-- can answer If-None-Match from this row without reading the list.
+--
+
+CREATE TABLE IF NOT EXISTS `unknown_containers_version` (
+  `id` tinyint NOT NULL,
+  `version` bigint NOT NULL DEFAULT 0,
+  PRIMARY KEY (`id`)
+) ENGINE=InnoDB ;
+
+INSERT IGNORE INTO `unknown_containers_version` (`id`, `version`) VALUES (1, 0);
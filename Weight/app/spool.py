@@ -0,0 +1,253 @@
+import fcntl
+import json
+import logging
+import os
+import threading
+import time
+
+log = logging.getLogger(__name__)
+
+SEGMENT_SUFFIX = ".log"
+DRAINER_LOCK = "drainer.lock"
+STATUS_FILE = "status.json"
+REJECTED_FILE = "rejected.jsonl"
+READ_SIZE = 64 * 1024
+
+
+# Durable write-behind queue for gate readings.
+#
+# Every process appends JSON lines to its own segment file and fsyncs before the
+# reading is acknowledged. While a process may still append to a segment it holds a
+# shared flock on it; a segment nobody holds is closed. One drainer thread across all
+# processes (elected with an exclusive flock on drainer.lock) merges the pending
+# records of all segments in time order and hands them to `apply` in batches. `apply`
+# stores the new per-segment offsets in the same database transaction as the readings,
+# so after a crash the drainer resumes exactly where the last commit left off.
+class Spool:
+    def __init__(self, directory, segment_bytes=64 * 1024 * 1024, batch_size=200,
+                 interval=0.2, settle=0.2):
+        self.directory = directory
+        self.segment_bytes = segment_bytes
+        self.batch_size = batch_size
+        self.interval = interval
+        # Records younger than this may still be overtaken by a slower writer, wait for them
+        self.settle = settle
+        self._lock = threading.Lock()
+        self._pid = None
+        self._fd = None
+        self._segment = None
+        self._size = 0
+        self._last_at = 0.0
+        self._drainer = None
+        self._stop = threading.Event()
+        self.appended = 0
+        self.drained = 0
+        self.rejected = 0
+        self.batches = 0
+        self.errors = 0
+        os.makedirs(directory, exist_ok=True)
+
+    # --- writer side ---
+
+    def _open_segment(self):
+        # In a forked worker this only drops the inherited descriptor, the parent keeps its lock
+        if self._fd is not None:
+            os.close(self._fd)
+        self._pid = os.getpid()
+        self._segment = f"{time.time_ns():020d}-{self._pid}{SEGMENT_SUFFIX}"
+        path = os.path.join(self.directory, self._segment)
+        # Lock before the segment becomes visible, or the drainer could take it for closed
+        self._fd = os.open(path + ".new", os.O_WRONLY | os.O_CREAT | os.O_APPEND, 0o644)
+        fcntl.flock(self._fd, fcntl.LOCK_SH)
+        os.rename(path + ".new", path)
+        self._size = 0
+        self._fsync_directory()
+
+    def _fsync_directory(self):
+        fd = os.open(self.directory, os.O_RDONLY)
+        try:
+            os.fsync(fd)
+        finally:
+            os.close(fd)
+
+    # Appends one record and returns its ticket once it is on disk
+    def append(self, record):
+        with self._lock:
+            # A forked worker must not share its parent's segment
+            if self._fd is None or self._pid != os.getpid() or self._size >= self.segment_bytes:
+                self._open_segment()
+            self._last_at = max(time.time(), self._last_at + 1e-6)
+            data = (json.dumps(dict(record, at=self._last_at)) + "\n").encode()
+            os.write(self._fd, data)
+            os.fsync(self._fd)
+            ticket = f"{self._segment}:{self._size}"
+            self._size += len(data)
+            self.appended += 1
+            return ticket
+
+    def close(self):
+        self._stop.set()
+        with self._lock:
+            if self._fd is not None:
+                os.close(self._fd)
+            self._fd = None
+
+    # --- drainer side ---
+
+    def segments(self):
+        return sorted(name for name in os.listdir(self.directory) if name.endswith(SEGMENT_SUFFIX))
+
+    def _is_closed(self, path):
+        fd = os.open(path, os.O_RDONLY)
+        try:
+            fcntl.flock(fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+            return True
+        except BlockingIOError:
+            return False
+        finally:
+            os.close(fd)
+
+    # Complete records from `offset` on: [(record, end offset)], at most `limit`
+    def _read(self, name, offset, limit):
+        records = []
+        with open(os.path.join(self.directory, name), "rb") as f:
+            f.seek(offset)
+            buf = b""
+            while len(records) < limit:
+                chunk = f.read(READ_SIZE)
+                if not chunk:
+                    break
+                buf += chunk
+                lines = buf.split(b"\n")
+                buf = lines.pop()
+                for line in lines:
+                    offset += len(line) + 1
+                    records.append((json.loads(line), offset))
+                    if len(records) >= limit:
+                        break
+        return records
+
+    def _pending(self, name, offset):
+        count = 0
+        with open(os.path.join(self.directory, name), "rb") as f:
+            f.seek(offset)
+            for chunk in iter(lambda: f.read(READ_SIZE), b""):
+                count += chunk.count(b"\n")
+        return count
+
+    # Applies the next batch. `offsets` is {segment: committed offset} and is updated in place,
+    # `apply(records, new_offsets)` must commit both and return the rejected records.
+    # Returns the number of records applied.
+    def drain_once(self, offsets, apply, forget):
+        candidates = []
+        for name in self.segments():
+            for record, end in self._read(name, offsets.get(name, 0), self.batch_size):
+                candidates.append((record["at"], name, end, record))
+        ready_before = time.time() - self.settle
+        batch = sorted((c for c in candidates if c[0] <= ready_before), key=lambda c: c[:3])[:self.batch_size]
+
+        if batch:
+            new_offsets = {}
+            for _, name, end, _ in batch:
+                new_offsets[name] = max(end, new_offsets.get(name, 0))
+            rejected = apply([record for _, _, _, record in batch], new_offsets)
+            offsets.update(new_offsets)
+            for record in rejected:
+                self._reject(record)
+            self.drained += len(batch)
+            self.rejected += len(rejected)
+            self.batches += 1
+
+        # Remove segments whose writer is gone once everything complete in them is applied
+        for name in self.segments():
+            path = os.path.join(self.directory, name)
+            if not self._is_closed(path):
+                continue
+            if self._pending(name, offsets.get(name, 0)):
+                continue
+            torn = os.path.getsize(path) - offsets.get(name, 0)
+            if torn:
+                # The writer died mid-append, that reading was never acknowledged
+                log.warning("Dropping %d byte torn tail of spool segment %s", torn, name)
+            forget(name)
+            offsets.pop(name, None)
+            os.remove(path)
+        return len(batch)
+
+    def _reject(self, record):
+        with open(os.path.join(self.directory, REJECTED_FILE), "a") as f:
+            f.write(json.dumps(record, default=str) + "\n")
+
+    # --- metrics, shared between processes through status.json ---
+
+    def write_status(self, offsets):
+        pending = 0
+        oldest = None
+        for name in self.segments():
+            offset = offsets.get(name, 0)
+            pending += self._pending(name, offset)
+            first = self._read(name, offset, 1)
+            if first and (oldest is None or first[0][0]["at"] < oldest):
+                oldest = first[0][0]["at"]
+        status = {
+            "depth": pending,
+            "lag_seconds": round(time.time() - oldest, 3) if oldest else 0,
+            "segments": len(self.segments()),
+            "drained": self.drained,
+            "rejected": self.rejected,
+            "batches": self.batches,
+            "errors": self.errors,
+            "drainer_pid": os.getpid(),
+            "updated_at": time.time(),
+        }
+        path = os.path.join(self.directory, STATUS_FILE)
+        with open(path + ".tmp", "w") as f:
+            json.dump(status, f)
+        os.replace(path + ".tmp", path)
+
+    def stats(self):
+        try:
+            with open(os.path.join(self.directory, STATUS_FILE)) as f:
+                status = json.load(f)
+        except (OSError, ValueError):
+            status = {}
+        return dict(status, appended=self.appended, pid=os.getpid())
+
+    # Starts the drainer thread of this process. It waits until it holds drainer.lock,
+    # so exactly one process drains and another takes over if it dies.
+    def start_drainer(self, load_offsets, apply, forget, status_interval=1.0):
+        if self._drainer is not None and self._drainer[0] == os.getpid():
+            return
+
+        def run():
+            lock_fd = os.open(os.path.join(self.directory, DRAINER_LOCK), os.O_RDWR | os.O_CREAT, 0o644)
+            while not self._stop.is_set():
+                try:
+                    fcntl.flock(lock_fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+                    break
+                except BlockingIOError:
+                    self._stop.wait(self.interval * 10)
+            offsets = None
+            status_at = 0.0
+            while not self._stop.is_set():
+                try:
+                    if offsets is None:
+                        offsets = load_offsets()
+                    drained = self.drain_once(offsets, apply, forget)
+                    if time.monotonic() - status_at >= status_interval:
+                        self.write_status(offsets)
+                        status_at = time.monotonic()
+                except Exception:
+                    log.exception("Spool drain failed, retrying")
+                    self.errors += 1
+                    # Re-read the committed offsets, the failed batch was rolled back
+                    offsets = None
+                    drained = 0
+                    self._stop.wait(self.interval * 10)
+                if not drained:
+                    self._stop.wait(self.interval)
+            os.close(lock_fd)
+
+        thread = threading.Thread(target=run, name="spool-drainer", daemon=True)
+        self._drainer = (os.getpid(), thread)
+        thread.start()
@@ -1,19 +1,142 @@
+import hashlib
 import json
-from flask import Flask, request, jsonify
-from datetime import datetime
+import click
+from flask import Flask, Response, request, jsonify, stream_with_context
+from datetime import datetime, timedelta
 from io import TextIOWrapper
 import mysql.connector
 import db
+import loader
+import spool
 import os
-import csv
 
 
 app = Flask(__name__)
 
-mydb = db.connect_db()
-
-
-cursor = mydb.cursor(dictionary=True, buffered=True)
+# Every route borrows its connection from the pool and hands it back here
+app.teardown_appcontext(db.close_db)
+
+# Rows per multi-row upsert/commit when loading /batch-weight files
+BATCH_CHUNK_SIZE = int(os.environ.get('BATCH_CHUNK_SIZE', 1000))
+
+# POST /weight/batch: readings per request, and readings per transaction
+MAX_BATCH_READINGS = int(os.environ.get('MAX_BATCH_READINGS', 5000))
+READING_CHUNK_SIZE = int(os.environ.get('READING_CHUNK_SIZE', 100))
+
+# Optional write-behind ingestion for POST /weight, see spool.py
+SPOOL_ENABLED = os.environ.get('WEIGHT_SPOOL', '0') == '1'
+SPOOL_DIR = os.environ.get('SPOOL_DIR', os.path.join(os.path.dirname(os.path.abspath(__file__)), 'spool'))
+reading_spool = spool.Spool(
+    SPOOL_DIR,
+    batch_size=int(os.environ.get('SPOOL_BATCH_SIZE', 200)),
+    segment_bytes=int(os.environ.get('SPOOL_SEGMENT_BYTES', 64 * 1024 * 1024)),
+) if SPOOL_ENABLED else None
+
+SPOOL_OFFSETS_QUERY = "SELECT segment, byte_offset FROM spool_offsets"
+SPOOL_OFFSET_UPSERT = ("INSERT INTO spool_offsets (segment, byte_offset) VALUES (%s, %s) "
+                       "ON DUPLICATE KEY UPDATE byte_offset = VALUES(byte_offset)")
+
+# Read queries of the routes below. Each one is backed by an index from
+# migrations/, apis_test/test_query_plans.py EXPLAINs them to keep it that way.
+ITEM_EXISTS_QUERY = "SELECT truck FROM transactions WHERE truck = %s LIMIT 1"
+
+ITEM_QUERY = """
+SELECT 
+    truck, 
+    MAX(truckTara) AS truckTara, 
+    GROUP_CONCAT(DISTINCT session ORDER BY session SEPARATOR ', ') AS sessions
+FROM transactions
+WHERE datetime BETWEEN %s AND %s
+AND truck = %s
+GROUP BY truck
+"""
+
+# Archived days of /item, see db.archive_sessions
+ITEM_ROLLUP_EXISTS_QUERY = "SELECT truck FROM daily_rollups WHERE truck = %s LIMIT 1"
+
+ITEM_ROLLUP_QUERY = """
+SELECT MAX(max_truckTara) AS truckTara, GROUP_CONCAT(session_ids SEPARATOR ',') AS sessions
+FROM daily_rollups
+WHERE truck = %s
+AND day BETWEEN %s AND %s
+"""
+
+SESSION_QUERY = "SELECT session, truck, bruto, produce, truckTara, neto FROM sessions WHERE session = %s"
+
+SESSIONS_IN_QUERY = "SELECT session, truck, bruto, produce, truckTara, neto FROM sessions WHERE session IN ({})"
+
+SESSIONS_RANGE_QUERY = """
+SELECT session, truck, bruto, produce, truckTara, neto FROM sessions
+WHERE session BETWEEN %s AND %s ORDER BY session
+"""
+
+WEIGHT_QUERY = """
+SELECT id, direction, bruto, neto, produce, containers 
+FROM transactions
+WHERE datetime BETWEEN %s AND %s
+AND direction IN ({})
+"""
+
+WEIGHT_ARCHIVE_QUERY = """
+SELECT id, direction, bruto, neto, produce, containers 
+FROM transactions_archive
+WHERE datetime BETWEEN %s AND %s
+AND direction IN ({})
+"""
+
+# transactions is partitioned by month, look at the recent ones first
+LAST_DIRECTION_QUERY = "SELECT direction FROM transactions WHERE datetime >= %s ORDER BY datetime DESC LIMIT 1"
+
+OPEN_SESSION_QUERY = "SELECT session, transaction_id, bruto, datetime FROM open_sessions WHERE truck = %s FOR UPDATE"
+
+UNKNOWN_QUERY = "SELECT container_id FROM unknown_containers WHERE container_id > %s ORDER BY container_id LIMIT %s"
+
+# Whole days of a /produce-totals window, from the daily rollups
+PRODUCE_ROLLUP_TOTALS_QUERY = """
+SELECT produce, SUM(sessions) AS sessions, SUM(neto_sessions) AS count, SUM(neto) AS amount
+FROM daily_rollups
+WHERE truck IN ({})
+AND day >= %s AND day < %s
+GROUP BY produce
+"""
+
+PRODUCE_ROLLUP_TOTALS_BY_TRUCK_QUERY = """
+SELECT truck, produce, SUM(sessions) AS sessions, SUM(neto_sessions) AS count, SUM(neto) AS amount
+FROM daily_rollups
+WHERE truck IN ({})
+AND day >= %s AND day < %s
+GROUP BY truck, produce
+"""
+
+# The partial days at either end, from the sessions themselves
+PRODUCE_TOTALS_QUERY = """
+SELECT produce, COUNT(*) AS sessions, COUNT(neto) AS count, SUM(neto) AS amount
+FROM sessions
+WHERE truck IN ({})
+AND out_datetime BETWEEN %s AND %s
+GROUP BY produce
+"""
+
+PRODUCE_TOTALS_BY_TRUCK_QUERY = """
+SELECT truck, produce, COUNT(*) AS sessions, COUNT(neto) AS count, SUM(neto) AS amount
+FROM sessions
+WHERE truck IN ({})
+AND out_datetime BETWEEN %s AND %s
+GROUP BY truck, produce
+"""
+
+# Bulk /sessions lookups: at most MAX_BULK_SESSIONS ids per request,
+# fetched SESSION_CHUNK_SIZE ids per query
+MAX_BULK_SESSIONS = 5000
+SESSION_CHUNK_SIZE = 500
+
+# Trucks per /produce-totals query
+TRUCK_CHUNK_SIZE = 500
+
+# GET /weight paging
+DEFAULT_PAGE_SIZE = 1000
+MAX_PAGE_SIZE = 10000
+STREAM_BATCH_SIZE = 500
 
 # Converts LBS to kg, Returns int per containers_registered table.
 def convert_weight(weight):
@@ -41,29 +164,28 @@ def get_item(id):
         if from_time > to_time :
             return "The 'from' time must be earlier than the 'to' time.", 400
 
-
-        cursor.execute("SELECT truck FROM transactions WHERE truck = %s", (id,))
+        archived_before = db.archived_before()
+        cursor = db.get_db().cursor(dictionary=True, buffered=True)
+        cursor.execute(ITEM_EXISTS_QUERY, (id,))
         id_check = cursor.fetchone()  # Fetch one result 
+        if not id_check and archived_before:
+            cursor.execute(ITEM_ROLLUP_EXISTS_QUERY, (id,))
+            id_check = cursor.fetchone()
 
         if not id_check:
             return jsonify({"error": "Item not found"}), 404 
 
-        # Construct SQL query
-        query = """
-        SELECT 
-            truck, 
-            MAX(truckTara) AS truckTara, 
-            GROUP_CONCAT(DISTINCT session ORDER BY session SEPARATOR ', ') AS sessions
-        FROM transactions
-        WHERE datetime BETWEEN %s AND %s
-        AND truck = %s
-        GROUP BY truck
-        """
         params = (from_time, to_time, id) 
 
-        cursor.execute(query, params)
+        cursor.execute(ITEM_QUERY, params)
         result = cursor.fetchone()
 
+        # Days before the archive horizon are answered by the daily rollups, whole days at a time
+        if archived_before and from_time < archived_before:
+            last_day = min(to_time, archived_before - timedelta(seconds=1)).date()
+            cursor.execute(ITEM_ROLLUP_QUERY, (id, from_time.date(), last_day))
+            result = merge_item(id, result, cursor.fetchone())
+
 
         return jsonify(result)
     
@@ -73,27 +195,24 @@ def get_item(id):
     except Exception as e:
         return jsonify({"error": str(e)}), 500
 
-@app.route("/batch-weight", methods=["POST"]) ## DONE do not touch!!
-def containers_insert():
-    
-    mysql = db.connect_db()
-    cursor = mysql.cursor(dictionary=True)
-    
-    def insert_into_db(container_id, weight, unit):
-        try:
-            cursor.execute(
-                """
-                INSERT INTO containers_registered (container_id, weight, unit)
-                VALUES (%s, %s, %s) ON DUPLICATE KEY UPDATE weight = VALUES(weight) """,
-                (container_id, weight, unit)
-            )
-
-            mysql.commit()
-        except Exception as e:
-            print(f"Error inserting into database: {str(e)}")   
+def merge_item(truck, live, archived):
+    rows = [row for row in (live, archived) if row and row.get("sessions")]
+    if not rows:
+        return live
+    sessions = sorted({int(session) for row in rows for session in str(row["sessions"]).split(",")})
+    taras = [row["truckTara"] for row in rows if row.get("truckTara") is not None]
+    return {
+        "truck": truck,
+        "truckTara": max(taras) if taras else None,
+        "sessions": ", ".join(str(session) for session in sessions),
+    }
 
+
+@app.route("/batch-weight", methods=["POST"])
+def containers_insert():
     try:
-        filename = request.get_json().get("file")
+        data = request.get_json()
+        filename = data.get("file")
         if not filename:
             return {"error": "No file part in the request"}, 400
 
@@ -102,69 +221,32 @@ def containers_insert():
         if not os.path.isfile(file_path):
             return {"error": "File not found"}, 404
 
-        file_extension = os.path.splitext(file_path)[1].lower()
-
-
-        # Process JSON files
-        if file_extension == '.json':
-            with open(file_path, 'r', encoding='utf-8') as f:
-                data = json.load(f)
-
-            for entry in data:
-                container_id = entry.get("id")
-                if not container_id:
-                    return {"error":f"Missing container ID, cannot continue"}, 400
-                weight = entry.get("weight")
-                unit = entry.get("unit")
-                
-                if unit == "lbs":
-                    weight = convert_weight(weight)
-                    unit = "kg"
-                
-                insert_into_db(container_id, weight, unit)
-
-
-        # Process CSV files
-        elif file_extension == '.csv':
-            with open(file_path, 'r', encoding='utf-8') as f:
-                csv_reader = csv.DictReader(f)
-                
-                # Detect unit type from headers
-                unit_type = "lbs" if "lbs" in csv_reader.fieldnames else "kg"
-                row_num = 0
-                warnings=[]
-                for row in csv_reader:
-                    container_id = row.get("id")
-                    if not container_id:
-                        warnings.append(f"Missing Container ID at line {row_num}") 
-                    elif unit_type == "lbs":
-                        weight = row.get("lbs")
-                        if not weight:
-                            weight = None
-                            insert_into_db(container_id, weight, unit)
-                        else:
-                            weight = convert_weight(weight)
-                            unit="kg"
-                            insert_into_db(container_id, weight, unit)
-                    else:
-                        weight = row.get("kg")
-                        if not weight:
-                            weight = None
-                        
-                        insert_into_db(container_id, weight, unit_type)
-                    row_num+=1
-             
+        try:
+            chunk_size = int(data.get("chunk_size", BATCH_CHUNK_SIZE))
+        except (TypeError, ValueError):
+            return {"error": "chunk_size must be a positive integer"}, 400
+        if chunk_size < 1:
+            return {"error": "chunk_size must be a positive integer"}, 400
 
-        else:
-            return {"error": "Unsupported file type. Only CSV and JSON are allowed."}, 400
-        
-        if warnings:
-            return {"message": "File processed with warnings", "Warning":warnings}, 200
-        else:
-            return {"message": "File processed successfully"}, 200
+        report = loader.load_file(db.get_db(), file_path, chunk_size)
 
+    except (loader.UnsupportedFile, loader.MalformedFile) as e:
+        return {"error": str(e)}, 400
     except Exception as e:
         return jsonify({"error": str(e)}), 500
+
+    result = {
+        "rows": report["rows"],
+        "rejected": report["rejected"],
+        "elapsed": report["elapsed"],
+        "rows_per_second": report["rows_per_second"],
+        "recomputed": report["recomputed"],
+    }
+    if report["rejected"]:
+        result.update({"message": "File processed with warnings", "Warning": report["warnings"]})
+    else:
+        result["message"] = "File processed successfully"
+    return result, 200
     
 
 # http://localhost:5000/session/1619874477.123456
@@ -172,26 +254,12 @@ def containers_insert():
 def get_session(id):
 
     try:
-        cursor.execute("SELECT truck FROM transactions WHERE session = %s", (id,))
-        id_check = cursor.fetchone()  # Fetch one result 
-
-        if not id_check:
-            return jsonify({"error": "Item not found"}), 404 
-
-        query = """
-        SELECT session, truck,
-        MAX(bruto) AS bruto,
-        MAX(produce) AS produce,
-        MAX(truckTara) AS truckTara,
-        MAX(neto) AS neto 
-            FROM transactions
-            WHERE session = %s
-            GROUP BY session, truck
-            """
-
-        cursor.execute(query, (id,))
+        cursor = db.get_db().cursor(dictionary=True, buffered=True)
+        cursor.execute(SESSION_QUERY, (id,))
         result = cursor.fetchone()
 
+        if not result:
+            return jsonify({"error": "Item not found"}), 404 
 
         return jsonify(result)
     
@@ -199,15 +267,163 @@ def get_session(id):
         return jsonify({"error": str(e)}), 500
 
 
+# http://localhost:5000/sessions?ids=10001,10002,10005
+# http://localhost:5000/sessions?from_id=10001&to_id=10500
+# POST /sessions {"ids": [10001, 10002, 10005]} for lists too long for a URL
+@app.route("/sessions", methods=["GET", "POST"])
+def get_sessions():
+    try:
+        if request.method == "POST":
+            ids = (request.get_json(silent=True) or {}).get("ids")
+            if not isinstance(ids, list):
+                return jsonify({"error": "Body must be {\"ids\": [...]}"}), 400
+            ids = [int(session_id) for session_id in ids]
+        elif "ids" in request.args:
+            ids = [int(session_id) for session_id in request.args["ids"].split(",") if session_id.strip()]
+        else:
+            from_id = int(request.args["from_id"])
+            to_id = int(request.args["to_id"])
+            if from_id > to_id:
+                return jsonify({"error": "'from_id' must not be greater than 'to_id'"}), 400
+            if to_id - from_id + 1 > MAX_BULK_SESSIONS:
+                return jsonify({"error": f"At most {MAX_BULK_SESSIONS} sessions per request"}), 400
+            ids = None
+    except (KeyError, TypeError, ValueError):
+        return jsonify({"error": "Pass session ids as 'ids' or a 'from_id'/'to_id' range"}), 400
+
+    if ids is not None and len(ids) > MAX_BULK_SESSIONS:
+        return jsonify({"error": f"At most {MAX_BULK_SESSIONS} sessions per request"}), 400
+
+    try:
+        cursor = db.get_db().cursor(dictionary=True, buffered=True)
+        if ids is None:
+            cursor.execute(SESSIONS_RANGE_QUERY, (from_id, to_id))
+            return jsonify({"sessions": cursor.fetchall()}), 200
+
+        ids = list(dict.fromkeys(ids))
+        found = {}
+        for start in range(0, len(ids), SESSION_CHUNK_SIZE):
+            chunk = ids[start:start + SESSION_CHUNK_SIZE]
+            cursor.execute(SESSIONS_IN_QUERY.format(",".join(["%s"] * len(chunk))), chunk)
+            for row in cursor.fetchall():
+                found[row["session"]] = row
+
+        return jsonify({
+            "sessions": [found[session_id] for session_id in ids if session_id in found],
+            "missing": [session_id for session_id in ids if session_id not in found],
+        }), 200
+
+    except mysql.connector.Error as e:
+        return jsonify({"error": str(e)}), 500
+
+
+# http://localhost:5000/produce-totals?trucks=T-1,T-2&from=20230301000000&to=20230331235959
+# POST /produce-totals {"trucks": [...], "from": ..., "to": ...}
+# Per produce: completed sessions, sessions with a known neto and their total neto,
+# for sessions whose "out" weighing falls in the window. Whole days are summed from
+# daily_rollups (one row per truck, produce and day), only partial days read sessions.
+# With group_by=truck the same totals are returned per truck, for callers that bill
+# many providers at once.
+@app.route("/produce-totals", methods=["GET", "POST"])
+def get_produce_totals():
+    args = (request.get_json(silent=True) or {}) if request.method == "POST" else request.args
+    trucks = args.get("trucks", [])
+    if isinstance(trucks, str):
+        trucks = [truck.strip() for truck in trucks.split(",") if truck.strip()]
+    if not isinstance(trucks, list):
+        return jsonify({"error": "'trucks' must be a list of truck ids"}), 400
+    group_by = args.get("group_by")
+    if group_by not in (None, "truck"):
+        return jsonify({"error": "'group_by' only supports 'truck'"}), 400
+
+    try:
+        from_time = datetime.strptime(args.get('from', datetime.now().replace(day=1).strftime("%Y%m%d") + "000000"), "%Y%m%d%H%M%S")
+        to_time = datetime.strptime(args.get('to', datetime.now().strftime("%Y%m%d%H%M%S")), "%Y%m%d%H%M%S")
+    except ValueError:
+        return "Invalid date format. Use YYYYMMDDHHMMSS.", 400
+    if from_time > to_time :
+        return "The 'from' time must be earlier than the 'to' time.", 400
+
+    days, partial = produce_totals_windows(from_time, to_time)
+    queries = [(PRODUCE_ROLLUP_TOTALS_BY_TRUCK_QUERY if group_by else PRODUCE_ROLLUP_TOTALS_QUERY, window)
+               for window in days]
+    queries += [(PRODUCE_TOTALS_BY_TRUCK_QUERY if group_by else PRODUCE_TOTALS_QUERY, window)
+                for window in partial]
+
+    try:
+        totals = {}
+        cursor = db.get_db().cursor(dictionary=True, buffered=True)
+        trucks = list(dict.fromkeys(trucks))
+        for start in range(0, len(trucks), TRUCK_CHUNK_SIZE):
+            chunk = trucks[start:start + TRUCK_CHUNK_SIZE]
+            for query, window in queries:
+                cursor.execute(query.format(",".join(["%s"] * len(chunk))), chunk + list(window))
+                for row in cursor.fetchall():
+                    # Rollups file sessions without a produce under "na"
+                    produce = row["produce"] or "na"
+                    products = totals.setdefault(row.get("truck"), {})
+                    product = products.setdefault(produce, {"produce": produce, "sessions": 0, "count": 0, "amount": 0})
+                    product["sessions"] += int(row["sessions"])
+                    product["count"] += int(row["count"])
+                    product["amount"] += int(row["amount"] or 0)
+
+        def summary(products):
+            return {
+                "sessionCount": sum(product["sessions"] for product in products.values()),
+                "products": list(products.values()),
+            }
+
+        if group_by:
+            return jsonify({"trucks": {truck: summary(products) for truck, products in totals.items()}}), 200
+        return jsonify(summary(totals.get(None, {}))), 200
+
+    except mysql.connector.Error as e:
+        return jsonify({"error": str(e)}), 500
+
+
+# Splits [from_time, to_time] into the whole days inside it, as one [first, end) range
+# of dates for the rollups, and the partial days at either end for the sessions table
+def produce_totals_windows(from_time, to_time):
+    first_day = from_time.replace(hour=0, minute=0, second=0, microsecond=0)
+    if first_day < from_time:
+        first_day += timedelta(days=1)
+    end_day = (to_time + timedelta(seconds=1)).replace(hour=0, minute=0, second=0, microsecond=0)
+    if first_day >= end_day:
+        return [], [(from_time, to_time)]
+    partial = []
+    if from_time < first_day:
+        partial.append((from_time, first_day - timedelta(seconds=1)))
+    if end_day <= to_time:
+        partial.append((end_day, to_time))
+    return [(first_day.date(), end_day.date())], partial
+
+
 @app.route('/health', methods=['GET']) ##DONE
 def healthcheck():
-      if mydb.is_connected():
-        cursor.execute("SELECT 1;") 
+    try:
+        cursor = db.get_db().cursor()
+        cursor.execute("SELECT 1;")
         cursor.fetchall()  # Ensure all results are read
+        cursor.close()
         return "OK", 200
-      else:
-          return "Failure", 500
-
+    except Exception:
+        return "Failure", 500
+
+
+@app.route('/stats', methods=['GET'])
+def get_stats():
+    stats = {
+        "pool": db.get_pool().stats(),
+        "container_cache": db.container_cache.stats(),
+    }
+    if reading_spool is not None:
+        stats["spool"] = reading_spool.stats()
+    return jsonify(stats), 200
+
+# http://localhost:5000/weight?from=20230301000000&to=20230302235959&limit=500&next=10500
+# Without limit/next the whole range is returned as a list. With them, one page
+# ordered by id plus the token for the following page. format=ndjson streams
+# the range row by row from an unbuffered cursor instead.
 @app.route('/weight', methods=['GET']) ##DONE
 def get_weight():
     try:
@@ -220,177 +436,523 @@ def get_weight():
     # Validate that 'from' time is earlier than 'to' time
     if from_time > to_time :
         return "The 'from' time must be earlier than the 'to' time.", 400
+
+    try:
+        after_id = int(request.args.get('next', 0))
+        limit = request.args.get('limit')
+        if limit is not None:
+            limit = int(limit)
+            if not 1 <= limit <= MAX_PAGE_SIZE:
+                raise ValueError
+    except ValueError:
+        return f"'next' must be a token from a previous page and 'limit' between 1 and {MAX_PAGE_SIZE}.", 400
+    paginate = limit is not None or 'next' in request.args
+    stream = request.args.get('format') == 'ndjson'
     
     try:        
         # Construct SQL query
-        query = """
-        SELECT id, direction, bruto, neto, produce, containers 
-        FROM transactions
-        WHERE datetime BETWEEN %s AND %s
-        AND direction IN ({})
-        """.format(",".join(["%s"] * len(filter_by)))  # Creates placeholders dynamically
+        placeholders = ",".join(["%s"] * len(filter_by))  # Creates placeholders dynamically
+        query = WEIGHT_QUERY.format(placeholders)
         
         params = [from_time, to_time] + filter_by
+
+        suffix = ""
+        if paginate or stream:
+            suffix += " AND id > %s ORDER BY id"
+            params.append(after_id)
+        if paginate and not stream:
+            limit = limit or DEFAULT_PAGE_SIZE
+        if limit is not None:
+            suffix += " LIMIT %s"
+            params.append(limit)
+        query += suffix
+
+        # Sessions closed before the archive horizon were moved to transactions_archive
+        archived_before = db.archived_before()
+        if archived_before and from_time < archived_before:
+            query = "({}) UNION ALL ({})".format(query, WEIGHT_ARCHIVE_QUERY.format(placeholders) + suffix)
+            params = params * 2
+            if paginate or stream:
+                query += " ORDER BY id"
+            if limit is not None:
+                query += " LIMIT %s"
+                params.append(limit)
+
+        if stream:
+            return Response(stream_with_context(stream_rows(query, params)), mimetype='application/x-ndjson')
         
+        cursor = db.get_db().cursor(dictionary=True, buffered=True)
         cursor.execute(query, params)
         result = cursor.fetchall()
 
+        if paginate:
+            next_token = str(result[-1]["id"]) if len(result) == limit else None
+            return jsonify({"results": result, "next": next_token})
         
         return jsonify(result)
     except mysql.connector.Error as e:
         return jsonify({"error": str(e)}), 500
 
+
+# Emits rows as the server sends them, one JSON document per line
+def stream_rows(query, params):
+    conn = db.get_db()
+    cursor = conn.cursor(dictionary=True)
+    try:
+        cursor.execute(query, params)
+        while True:
+            rows = cursor.fetchmany(STREAM_BATCH_SIZE)
+            if not rows:
+                break
+            yield "".join(json.dumps(row) + "\n" for row in rows)
+    finally:
+        # Drain what the client did not read so the connection can go back to the pool
+        try:
+            conn.consume_results()
+        except Exception:
+            pass
+        cursor.close()
+
 @app.route('/weight', methods=['POST']) ##Working on fixes
 def info_insert():
     # Ensure correct Content-Type
     if request.content_type != 'application/json':
         return ({"error": "Content-Type must be application/json"}), 415
-    
-    #set up the last session id to maintaine continues
-    def fetch_session_id():
-        mysql = db.connect_db()
-        cursor = mysql.cursor(dictionary=True)
-        cursor.execute(""" SELECT session FROM transactions ORDER BY session DESC""")
-        result = cursor.fetchone()
-        if result is None:
-            return 0
-        return result["session"]
 
     # Parse JSON payload
-    data = request.json
-    direction = data.get('direction')  # "in", "out", or "none"
-    truck = data.get('truck', 'na')  # Default to "na" if no truck is provided
-    containers = data.get('containers', '')  # Comma-separated container IDs
-    weight = data.get('weight')
+    reading, error = parse_reading(request.json)
+    if error:
+        return error
+    current_date = datetime.now().strftime('%Y-%m-%d %H:%M:%S')
+
+    # Write-behind mode: acknowledge once the reading is on disk, ?sync=1 applies it now
+    if reading_spool is not None and request.args.get('sync') != '1':
+        return spool_reading(reading, current_date)
+
+    conn = db.get_db()
+    body, status = apply_reading(conn, reading, current_date)
+    if reading_failed(body, status):
+        conn.rollback()
+    else:
+        conn.commit()
+    return body, status
+
+
+# http://localhost:5000/weight/batch
+# POST [{"direction": ..., "truck": ..., ...}, ...] or {"readings": [...]}
+# Applies buffered gate readings in order with the same rules as POST /weight. Each chunk
+# of READING_CHUNK_SIZE readings is one transaction, each reading runs under a savepoint
+# so a rejected reading leaves the rest of its chunk in place. A reading may carry its own
+# "datetime" (YYYYMMDDHHMMSS) when it is replayed after the fact.
+@app.route('/weight/batch', methods=['POST'])
+def batch_insert():
+    if request.content_type != 'application/json':
+        return ({"error": "Content-Type must be application/json"}), 415
+
+    payload = request.get_json(silent=True)
+    readings = payload.get("readings") if isinstance(payload, dict) else payload
+    if not isinstance(readings, list) or not readings:
+        return {"error": "Expected a non-empty list of readings"}, 400
+    if len(readings) > MAX_BATCH_READINGS:
+        return {"error": f"At most {MAX_BATCH_READINGS} readings per request"}, 400
+
+    conn = db.get_db()
+    cursor = conn.cursor()
+    results = []
+    for start in range(0, len(readings), READING_CHUNK_SIZE):
+        chunk = readings[start:start + READING_CHUNK_SIZE]
+        chunk_results = []
+        try:
+            for index, data in enumerate(chunk, start=start):
+                reading, error = parse_reading(data)
+                if not error:
+                    reading_date, error = parse_reading_date(data)
+                if error:
+                    chunk_results.append(reading_result(index, *error))
+                    continue
+                cursor.execute("SAVEPOINT reading")
+                try:
+                    body, status = apply_reading(conn, reading, reading_date)
+                except mysql.connector.Error:
+                    raise
+                except Exception as e:
+                    # Anything but a database error only concerns this reading
+                    body, status = {"error": f"Failed to apply reading: {e}"}, 500
+                if reading_failed(body, status):
+                    cursor.execute("ROLLBACK TO SAVEPOINT reading")
+                chunk_results.append(reading_result(index, body, status))
+            conn.commit()
+        except mysql.connector.Error as e:
+            # The chunk is lost as a whole, later readings may depend on it so stop here
+            conn.rollback()
+            for index in range(start, len(readings)):
+                results.append(reading_result(index, {"error": f"Not applied, chunk rolled back: {e}"}, 500))
+            break
+        results.extend(chunk_results)
+
+    failed = sum(1 for result in results if not result["ok"])
+    return {"applied": len(results) - failed, "failed": failed, "results": results}, 200
+
+
+# Touches nothing but the spool file, so readings are still accepted while the database
+# is down. The drainer assigns the session id when it applies the reading with the same
+# rules as POST /weight, the ticket identifies the reading until then.
+def spool_reading(reading, current_date):
+    if reading["direction"] not in ("in", "out", "none"):
+        return {"Error": "Page Not Found, try different route"}, 404
+    ticket = reading_spool.append({"reading": reading, "datetime": current_date})
+    return {"queued": True, "ticket": ticket, "truck": reading["truck"]}, 202
+
+
+def load_spool_offsets():
+    with app.app_context():
+        cursor = db.get_db().cursor()
+        cursor.execute(SPOOL_OFFSETS_QUERY)
+        return dict(cursor.fetchall())
+
+
+# Applies a batch of spooled readings and the new segment offsets in one transaction,
+# returns the readings POST /weight would have rejected
+def apply_spooled(records, offsets):
+    rejected = []
+    with app.app_context():
+        conn = db.get_db()
+        cursor = conn.cursor()
+        try:
+            for record in records:
+                cursor.execute("SAVEPOINT reading")
+                body, status = apply_reading(conn, record["reading"], record["datetime"], record.get("session"))
+                if reading_failed(body, status):
+                    cursor.execute("ROLLBACK TO SAVEPOINT reading")
+                    rejected.append(dict(record, status=status, response=body))
+            cursor.executemany(SPOOL_OFFSET_UPSERT, list(offsets.items()))
+            conn.commit()
+        except Exception:
+            conn.rollback()
+            raise
+    return rejected
+
+
+def forget_spool_segment(segment):
+    with app.app_context():
+        conn = db.get_db()
+        conn.cursor().execute("DELETE FROM spool_offsets WHERE segment = %s", (segment,))
+        conn.commit()
+
+
+# Starts this process' spool drainer, one process at a time actually drains
+def start_spool():
+    if reading_spool is not None:
+        reading_spool.start_drainer(load_spool_offsets, apply_spooled, forget_spool_segment)
+
+
+def parse_reading(data):
+    if not isinstance(data, dict):
+        return None, ({"error": "Reading must be an object"}, 400)
+    reading = {
+        "direction": data.get('direction'),  # "in", "out", or "none"
+        "truck": data.get('truck', 'na'),  # Default to "na" if no truck is provided
+        "containers": data.get('containers', ''),  # Comma-separated container IDs
+        "weight": data.get('weight'),
+        "force": data.get('force', False),  # Default is False
+        "produce": data.get('produce', 'na'),  # Default to "na"
+    }
     unit = data.get('unit', 'kg')  # Default to "kg"
-    force = data.get('force', False)  # Default is False
-    produce = data.get('produce', 'na')  # Default to "na"
-    current_date=datetime.now().strftime('%Y-%m-%d %H:%M:%S')
+    if not isinstance(unit, str):
+        return None, ({"error": "Unit must be kg or lbs"}, 400)
+    if reading["weight"] is not None:
+        try:
+            int(reading["weight"])
+        except (TypeError, ValueError):
+            return None, ({"error": "Weight must be a whole number"}, 400)
 
     # Converts weight from Pounds to Kilograms 
     if unit.lower() == "lbs" or unit.lower() == "lb":
-        weight = convert_weight(weight)
+        reading["weight"] = convert_weight(reading["weight"])
 
     # Validate required fields
-    if not direction or not weight or not truck or not containers or not produce:
-        return ({"error": "Missing required fields"}), 400
+    if not all(reading[field] for field in ("direction", "weight", "truck", "containers", "produce")):
+        return None, ({"error": "Missing required fields"}, 400)
+    return reading, None
 
-    mysql = db.connect_db()
-    cursor = mysql.cursor(dictionary=True)
+
+def parse_reading_date(data):
+    if not data.get('datetime'):
+        return datetime.now().strftime('%Y-%m-%d %H:%M:%S'), None
+    try:
+        return datetime.strptime(str(data['datetime']), "%Y%m%d%H%M%S").strftime('%Y-%m-%d %H:%M:%S'), None
+    except ValueError:
+        return None, ({"error": "Invalid datetime format. Use YYYYMMDDHHMMSS."}, 400)
+
+
+def reading_failed(body, status):
+    return status >= 400 or (isinstance(body, dict) and ("error" in body or "Error" in body))
+
+
+def reading_result(index, body, status):
+    result = body if isinstance(body, dict) else {"error": body}
+    return {"index": index, "status": status, "ok": not reading_failed(body, status), **result}
+
+
+# Applies one reading on `conn` without committing, the caller commits or rolls back.
+# Returns the (body, status) POST /weight answers with. `session_id` is used for a new
+# session instead of allocating one (readings spooled by older releases bring theirs).
+def apply_reading(conn, reading, current_date, session_id=None):
+    direction = reading["direction"]
+    truck = reading["truck"]
+    containers = reading["containers"]
+    weight = reading["weight"]
+    force = reading["force"]
+    produce = reading["produce"]
+
+    cursor = conn.cursor(dictionary=True, buffered=True)
 
     # Direction: "in"
     if direction == "in":
         # Check if there's an "in" session for the same truck
-        cursor.execute(""" SELECT * FROM transactions WHERE truck = %s AND direction = 'in' AND session NOT IN 
-                    (SELECT session FROM transactions WHERE direction = 'out') LIMIT 1; """, (truck, ))
+        cursor.execute(OPEN_SESSION_QUERY, (truck, ))
         existing_in = cursor.fetchone()
 
         if existing_in and not force:
             return {"error": "An active 'in' session already exists. Use force=true to overwrite."}, 500
-        # Insert a new "in" session
-        session_id= fetch_session_id()
-        cursor.execute(""" SELECT truck FROM transactions WHERE truck = %s AND direction = 'in' LIMIT 1; """, (truck, ))
-        truck_exist = cursor.fetchone()
-        if force and truck_exist: ## add check for the same trackid
+        # Overwrite the active "in" session, keeping its session id
+        if existing_in:
+            session_id = existing_in["session"]
             cursor.execute("UPDATE transactions "
-                "SET session = %s, truck = %s, direction = %s, bruto = %s, datetime = %s, containers = %s, produce = %s "
-                "WHERE truck = %s",
-                (session_id, truck, direction, weight, current_date, containers, produce, truck))
-            mysql.commit()
+                "SET bruto = %s, datetime = %s, containers = %s, produce = %s "
+                "WHERE id = %s AND datetime = %s",
+                (weight, current_date, containers, produce, existing_in["transaction_id"], existing_in["datetime"]))
+            cursor.execute("UPDATE open_sessions SET bruto = %s, datetime = %s WHERE truck = %s",
+                           (weight, current_date, truck))
+            cursor.execute("UPDATE sessions SET bruto = %s, produce = %s, in_datetime = %s WHERE session = %s",
+                           (weight, produce, current_date, session_id))
+            db.record_unknown_containers(cursor, containers)
             return {"session": session_id, "truck": truck, "bruto": weight}, 200
-        session_id +=1
+        # Insert a new "in" session, claiming the truck's open-session row first
+        session_id = session_id or db.allocate_session_id()
+        try:
+            cursor.execute("INSERT INTO open_sessions (truck, session, bruto, datetime) VALUES (%s, %s, %s, %s)",
+                           (truck, session_id, weight, current_date))
+        except mysql.connector.IntegrityError:
+            # Another gate opened a session for this truck at the same moment
+            return {"error": "An active 'in' session already exists. Use force=true to overwrite."}, 500
         cursor.execute("INSERT INTO transactions (session, truck, direction, bruto, datetime, containers, produce) "
                         "VALUES (%s, %s, %s, %s, %s, %s, %s)", (session_id, truck, direction, weight, current_date, containers, produce))
-        mysql.commit()
+        cursor.execute("UPDATE open_sessions SET transaction_id = %s WHERE truck = %s", (cursor.lastrowid, truck))
+        cursor.execute("INSERT INTO sessions (session, truck, produce, bruto, in_datetime) VALUES (%s, %s, %s, %s, %s)",
+                       (session_id, truck, produce, weight, current_date))
+        db.record_unknown_containers(cursor, containers)
         return {"session": session_id, "truck": truck, "bruto": weight}, 200
 
 
     # Direction: "out"
     elif direction == "out":
-        # Get the latest "in" session for this truck
-        cursor.execute(""" SELECT * FROM transactions WHERE truck = %s AND direction = 'in' AND session NOT IN 
-                    (SELECT session FROM transactions WHERE direction = 'out') LIMIT 1; """, (truck,))
+        # Get the open "in" session for this truck
+        cursor.execute(OPEN_SESSION_QUERY, (truck,))
         last_in = cursor.fetchone()
 
         if not last_in:
-            return {"error": "No 'in' session found for this truck. Cannot proceed with 'out'."}
+            return {"error": "No 'in' session found for this truck. Cannot proceed with 'out'."}, 200
 
         # Calculate neto (Fruits)
         session_id=last_in.get("session")
         try:
             bruto_weight = last_in["bruto"] # Get bruto from last_in
             truck_tara = weight  # Current truck weight
-            container_weight, status_code = db.container_data(containers)  # Weight of containers
-            if status_code == 500:
-                return {"Error": container_weight}, 500
-            net_weight = bruto_weight - int(truck_tara) - int(container_weight)
+            # Weight of containers, read fresh: a cached tara would be written into neto for good
+            container_weight, unresolved = db.container_data(containers, conn)
+            # Without every container weight neto stays open until /batch-weight brings them
+            net_weight = None if unresolved else bruto_weight - int(truck_tara) - int(container_weight)
             
         except Exception as e:
             return {"error": f"Failed to calculate net weight: {e}"}, 500
 
 
-        # Insert a new "out" session
-        # Here we need to get tara weight, truck id, calculate neto as input
+        # Insert a new "out" session and close the open one
         cursor.execute("INSERT INTO transactions (session, truck, direction, truckTara, datetime, containers, neto) "
                         "VALUES (%s, %s, %s, %s, %s, %s, %s)", (session_id, truck, direction, truck_tara, current_date, containers, net_weight))
-        mysql.commit()
+        if unresolved:
+            cursor.executemany(db.PENDING_NETO_INSERT,
+                               [(container, cursor.lastrowid, session_id) for container in unresolved if len(container) <= 50])
+        cursor.execute("DELETE FROM open_sessions WHERE truck = %s", (truck,))
+        cursor.execute("UPDATE sessions SET truckTara = %s, neto = %s, out_datetime = %s WHERE session = %s",
+                       (truck_tara, net_weight, current_date, session_id))
+        cursor.execute(db.ROLLUP_SESSION_QUERY, (session_id,))
+        db.record_unknown_containers(cursor, containers)
         return {
             "sesssion": last_in["session"],
             "truck": truck,
             "truckTara": truck_tara,
-            "neto": net_weight
-        }
+            "neto": net_weight if net_weight is not None else "na"
+        }, 200
 
     # Direction: "none"
     elif direction == "none":
-        cursor.execute(""" SELECT direction FROM transactions ORDER BY datetime DESC LIMIT 1;""")
+        cursor.execute(LAST_DIRECTION_QUERY, (db.add_months(db.month_start(datetime.now()), -1),))
         result = cursor.fetchone()
         if not result:
-            session_id= fetch_session_id()
-            session_id +=1
-            cursor.execute("INSERT INTO transactions (session, direction, datetime) VALUES (%s, %s, %s)", (session_id, direction, current_date))
-            mysql.commit()
-            return {"id": session_id, "truck": "na", "bruto": weight}, 200
-        elif 'in' in result['direction']:
+            cursor.execute(LAST_DIRECTION_QUERY, (datetime(1970, 1, 1),))
+            result = cursor.fetchone()
+        if result and 'in' in result['direction']:
             return ("Error, na after in detected"), 500
-        else:
-            session_id= fetch_session_id()
-            session_id +=1
-            cursor.execute("INSERT INTO transactions (session, direction, datetime) VALUES (%s, %s, %s)", (session_id, direction, current_date))
-            mysql.commit()
-            return {"id": session_id, "truck": "na", "bruto": weight}, 200
+        session_id = session_id or db.allocate_session_id()
+        cursor.execute("INSERT INTO transactions (session, direction, datetime) VALUES (%s, %s, %s)", (session_id, direction, current_date))
+        cursor.execute("INSERT INTO sessions (session, in_datetime) VALUES (%s, %s)", (session_id, current_date))
+        return {"id": session_id, "truck": "na", "bruto": weight}, 200
 
 
 
     # If invalid direction
     return {"Error": "Page Not Found, try different route"}, 404
 
+# http://localhost:5000/unknown?limit=500&after=C-1042
+# Containers we have no weight for: registered without one, or weighed but never
+# registered. One page ordered by id, `next` is the `after` of the following page.
 @app.route('/unknown', methods=['GET']) ##DONE
 def get_unknown():
+    after = request.args.get('after', '')
+    try:
+        limit = int(request.args.get('limit', DEFAULT_PAGE_SIZE))
+        if not 1 <= limit <= MAX_PAGE_SIZE:
+            raise ValueError
+    except ValueError:
+        return f"'limit' must be between 1 and {MAX_PAGE_SIZE}.", 400
     
     try:        
-        # Intializing a list for empty containers
-        contaniers_empty = []
+        cursor = db.get_db().cursor(dictionary=True, buffered=True)
+        # Pollers get a 304 from the version row alone, the list is read only when it moved
+        version = db.unknown_containers_version(cursor)
+        etag = None
+        if version is not None:
+            etag = hashlib.sha1(json.dumps([version, after, limit]).encode()).hexdigest()
+            if request.if_none_match.contains(etag):
+                cursor.close()
+                response = Response(status=304)
+                response.set_etag(etag)
+                response.headers["Cache-Control"] = "no-cache"
+                return response
+        cursor.execute(UNKNOWN_QUERY, (after, limit))
+        containers_unknown = [row["container_id"] for row in cursor.fetchall()]
+        cursor.close()
+    except mysql.connector.Error as e:
+        return jsonify({"error": str(e)}), 500
 
-        # SQL querry for empty_containers, where whight is null
-        query = """
-        SELECT container_id from containers_registered WHERE weight IS NULL
-        """     
+    body = {"id": containers_unknown, "next": containers_unknown[-1] if len(containers_unknown) == limit else None}
+    response = jsonify(body)
+    if etag is not None:
+        response.set_etag(etag)
+    response.headers["Cache-Control"] = "no-cache"
+    return response
 
-        cursor.execute(query)
-        result = cursor.fetchall()
 
-        # indexing the specifc ID's from the querry to the containers_empty list
-        for id in result:
-            contaniers_empty.append(id["container_id"])
-        
-        # Return the list of empty continare id's 
-        return {"id": contaniers_empty}, 200
+@app.cli.command("migrate")
+def migrate_command():
+    """Apply pending schema migrations to the weight database."""
+    conn = db.connect_db()
+    try:
+        applied = db.migrate(conn)
+    finally:
+        conn.close()
+    click.echo("\n".join(applied) if applied else "Database is up to date")
 
 
-    except mysql.connector.Error as e:
-        return jsonify({"error": str(e)}), 500
+@app.cli.command("rebuild-sessions")
+def rebuild_sessions_command():
+    """Rebuild the sessions summary table from transactions."""
+    conn = db.connect_db()
+    try:
+        count = db.rebuild_sessions(conn)
+    finally:
+        conn.close()
+    click.echo(f"{count} sessions rebuilt")
+
+
+@app.cli.command("rebuild-rollups")
+def rebuild_rollups_command():
+    """Rebuild the daily (truck, produce) rollups from the sessions table."""
+    conn = db.connect_db()
+    try:
+        count = db.rebuild_rollups(conn)
+    finally:
+        conn.close()
+    click.echo(f"{count} daily rollups rebuilt")
+
+
+@app.cli.command("rebuild-unknown")
+def rebuild_unknown_command():
+    """Rebuild the unknown_containers index from containers_registered and transactions."""
+    conn = db.connect_db()
+    try:
+        count = db.rebuild_unknown_containers(conn)
+    finally:
+        conn.close()
+    click.echo(f"{count} unknown containers")
+
+
+@app.cli.command("backfill-open-sessions")
+def backfill_open_sessions_command():
+    """Rebuild the open_sessions table from existing transactions."""
+    conn = db.connect_db()
+    try:
+        count = db.backfill_open_sessions(conn)
+    finally:
+        conn.close()
+    click.echo(f"{count} open sessions restored")
+
+
+@app.cli.command("archive")
+@click.option("--before", default=None, help="Archive sessions closed before this day, as YYYYMMDD. "
+              "Defaults to ARCHIVE_HORIZON_DAYS ago.")
+@click.option("--chunk-size", default=db.ARCHIVE_CHUNK_SIZE, show_default=True, help="Sessions per statement.")
+def archive_command(before, chunk_size):
+    """Move closed sessions past the horizon to transactions_archive and daily_rollups."""
+    try:
+        cutoff = datetime.strptime(before, "%Y%m%d") if before else datetime.now() - timedelta(days=db.ARCHIVE_HORIZON_DAYS)
+    except ValueError:
+        raise click.BadParameter("Use YYYYMMDD", param_hint="--before")
+    conn = db.connect_db()
+    try:
+        report = db.archive_sessions(conn, cutoff, chunk_size)
+    finally:
+        conn.close()
+    click.echo(f"{report['sessions']} sessions ({report['transactions']} transactions) archived, "
+               f"archive covers everything before {report['archived_before']:%Y-%m-%d}")
+
+
+@app.cli.command("ensure-partitions")
+@click.option("--months-ahead", default=db.PARTITION_MONTHS_AHEAD, show_default=True,
+              help="Monthly partitions to keep ready after the current month.")
+def ensure_partitions_command(months_ahead):
+    """Create the upcoming monthly partitions of transactions (run daily from cron)."""
+    conn = db.connect_db()
+    try:
+        created = db.ensure_partitions(conn, months_ahead)
+    finally:
+        conn.close()
+    click.echo("\n".join(created) if created else "Partitions are up to date")
+
+
+@app.cli.command("detach-partitions")
+@click.option("--before", required=True, help="First month to keep, as YYYYMM.")
+@click.option("--force", is_flag=True, help="Detach months that still hold open sessions.")
+def detach_partitions_command(before, force):
+    """Move the monthly partitions of transactions before a month out into their own tables."""
+    try:
+        cutoff = datetime.strptime(before, "%Y%m")
+    except ValueError:
+        raise click.BadParameter("Use YYYYMM", param_hint="--before")
+    conn = db.connect_db()
+    try:
+        detached = db.detach_partitions(conn, cutoff, force)
+    finally:
+        conn.close()
+    click.echo("\n".join(detached) if detached else "Nothing to detach")
 
 
 if __name__ == "__main__":
+    conn = db.connect_db()
+    db.migrate(conn)
+    db.ensure_partitions(conn)
+    conn.close()
+    start_spool()
     app.run(host="0.0.0.0", debug=True)
@@ -41,6 +41,13 @@ CREATE TABLE IF NOT EXISTS `transactions` (
   PRIMARY KEY (`id`)
 ) ENGINE=MyISAM AUTO_INCREMENT=10001 ;
 
+-- --------------------------------------------------------
+
+--
+-- Everything after this baseline lives in app/migrations/ and is applied by
+-- the app on startup (or `flask --app weight migrate`)
+--
+
 show tables;
 
 describe containers_registered;